@@ -19,5 +19,12 @@
 
 if __name__ == '__main__':
     import sys
-    from dmxctrl import main
+    from dmxctrlcli import is_cli_cmdline
+
+    # режимы без GUI не должны зависеть от GTK
+    if is_cli_cmdline(sys.argv[1:]):
+        from dmxctrlcli import main
+    else:
+        from dmxctrl import main
+
     sys.exit(main())
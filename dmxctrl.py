@@ -19,6 +19,11 @@
     along with this program.  If not, see <http://www.gnu.org/licenses/>."""
 
 
+from time import monotonic
+
+# для измерения времени запуска (см. MainWnd.timer_func())
+STARTUP_TIME = monotonic()
+
 DEBUG = False
 
 TITLE = 'DMXCtrl'
@@ -28,19 +33,30 @@ COPYRIGHT = '🄯 2022 MC-6312'
 URL = 'https://github.com/mc6312/dmxctrl'
 
 
+if __name__ == '__main__':
+    # режимы без GUI (python3 -m dmxctrl --check и т.п.) не должны
+    # зависеть от GTK - разбираются до импорта gtktools, как в __main__.py
+    import sys
+    from dmxctrlcli import is_cli_cmdline
+
+    if is_cli_cmdline(sys.argv[1:]):
+        from dmxctrlcli import main as cli_main
+
+        sys.exit(cli_main())
+
+
 from gtktools import *
 from gi.repository import Gtk, GLib, Gdk #, GObject, Pango
 from gi.repository.GdkPixbuf import Pixbuf
-import cairo
-from math import pi
-
 import sys
 import os.path
-from traceback import format_exception
-from array import array
 
 from dmxctrldata import *
 from dmxctrlcfg import *
+from dmxctrlbuf import *
+from dmxctrlengine import *
+from dmxctrlbin import load_console_file
+from dmxctrlrec import ShowRecorder, new_show_file_name
 
 from colorsys import hls_to_rgb
 
@@ -54,6 +70,21 @@ def hue_to_rgba(hue, saturation=1.0):
     return Gdk.RGBA(r, g, b, 1.0)
 
 
+__colorsPalette = None
+
+
+def get_colors_palette():
+    """Возвращает палитру для Gtk.ColorButton (список Gdk.RGBA).
+    Палитра создаётся при первом вызове."""
+
+    global __colorsPalette
+
+    if __colorsPalette is None:
+        __colorsPalette = __init_palette()
+
+    return __colorsPalette
+
+
 def __init_palette():
     pal = []
 
@@ -71,9 +102,6 @@ def __init_palette():
     return pal
 
 
-COLORS_PALETTE = __init_palette()
-
-
 def bool_gtk_orientation(v):
     return Gtk.Orientation.VERTICAL if v else Gtk.Orientation.HORIZONTAL
 
@@ -269,7 +297,10 @@ class SwitchWidget(ControlWidget):
                     if not rgrp:
                         rgrp = rbtn
 
-                    self.radioButtons[rbtn] = opt.value
+                    # значения заранее преобразуются в bytes, чтобы
+                    # при переключении записывать их в буфер каналов
+                    # одной операцией над срезом
+                    self.radioButtons[rbtn] = (bytes(opt.value), opt.fade)
 
                     rbtn.connect('toggled', self.value_changed)
 
@@ -287,12 +318,16 @@ class SwitchWidget(ControlWidget):
 
     def value_changed(self, rbtn):
         if rbtn is None:
+            # начальные значения устанавливаются без перехода
             rbtn = self.activeButton
+            fade = 0.0
         elif not rbtn.get_active():
             return
+        else:
+            fade = self.radioButtons[rbtn][1]
 
         self.owner.set_channel_values(self.control.channel,
-                                      self.radioButtons[rbtn])
+                                      self.radioButtons[rbtn][0], fade)
         self.activeButton = rbtn
 
     def setMinLevel(self):
@@ -332,15 +367,17 @@ class LevelWidget(ControlWidget):
             self.widget.pack_start(slab, False, False, 0)
 
         #!!!
+        maxv = float(self.control.getMaxValue())
+
         if self.control.steps > 0:
-            sstep = 255.0 / self.control.steps
+            sstep = maxv / self.control.steps
         else:
             sstep = 1.0
 
         self.adjustment = Gtk.Adjustment.new(self.control.value,
-            0.0, 255.0,
+            0.0, maxv,
             sstep,
-            16.0 if self.control.steps == 0 else sstep,
+            (maxv + 1.0) / 16.0 if self.control.steps == 0 else sstep,
             0.0)
 
         self.scale = Gtk.Scale.new(_ornt, None)
@@ -364,13 +401,16 @@ class LevelWidget(ControlWidget):
         self.widget.pack_start(self.scale, True, True, 0)
 
     def value_changed(self, scale):
-        self.owner.set_channel_values(self.control.channel, [int(self.scale.get_value())])
+        # у 16-битного движка старший и младший байты
+        # записываются в буфер одной операцией
+        self.owner.set_channel_values(self.control.channel,
+            self.control.getChannelValues(int(self.scale.get_value())))
 
     def setMinLevel(self):
         self.scale.set_value(0)
 
     def setMaxLevel(self):
-        self.scale.set_value(255)
+        self.scale.set_value(self.control.getMaxValue())
 
 
 class ColorLevelWidget(LevelWidget):
@@ -386,7 +426,7 @@ class ColorLevelWidget(LevelWidget):
         self.clrbtn.add_palette(Gtk.Orientation.VERTICAL, 1, None)
         self.clrbtn.add_palette(Gtk.Orientation.VERTICAL,
                            COLORS_PALETTE_COLS,
-                           COLORS_PALETTE)
+                           get_colors_palette())
         self.clrbtn.connect('color-set', self.value_changed)
 
         self.widget.pack_end(self.clrbtn, False, False, 0)
@@ -399,16 +439,327 @@ class ColorLevelWidget(LevelWidget):
         # 0.0 - 1.0
 
         self.owner.set_channel_values(self.control.channel,
-                            [int(rgba.red * level),
-                             int(rgba.green * level),
-                             int(rgba.blue * level)])
+                            bytes((int(rgba.red * level),
+                                   int(rgba.green * level),
+                                   int(rgba.blue * level))))
+
+
+class SubmasterWidget(LevelWidget):
+    def format_tooltip_text(self, control):
+        cstr = control.getCommentStr()
+        if cstr:
+            cstr = '%s\n\n' % cstr
+
+        return '%sSubmaster, channels: %s' % (cstr, ' '.join(map(str, control.channels)))
+
+    def value_changed(self, scale):
+        self.owner.engine.set_submaster(self.control, int(self.scale.get_value()))
+
+
+class GroupLevelWidget(SubmasterWidget):
+    def format_tooltip_text(self, control):
+        cstr = control.getCommentStr()
+        if cstr:
+            cstr = '%s\n\n' % cstr
+
+        return '%sGroup "%s" (%s), %d channel(s)' % (cstr, control.group, control.mode, len(control.channels))
+
+
+class CueListWidget(ControlWidget):
+    def setup(self):
+        self.cueStack = self.owner.engine.cueStacks[self.control]
+
+        self.widget = Gtk.Box.new(bool_gtk_orientation(self.control.vertical),
+                                  WIDGET_SPACING)
+        self.set_tooltip_text(self.widget, self.control)
+
+        if self.control.icon:
+            self.widget.pack_start(self.owner.load_icon_image(self.control), False, False, 0)
+
+        if self.control.name:
+            self.widget.pack_start(Gtk.Label.new(self.control.name), False, False, 0)
+
+        self.labCue = Gtk.Label.new('')
+        self.labCue.set_width_chars(8)
+        self.labCue.set_ellipsize(Pango.EllipsizeMode.END)
+        self.widget.pack_start(self.labCue, True, True, 0)
+
+        def __add_button(label, handler, btnclass=Gtk.Button):
+            btn = btnclass.new_with_label(label)
+            btn.connect('clicked' if btnclass is Gtk.Button else 'toggled', handler)
+            self.widget.pack_start(btn, False, False, 0)
+            return btn
+
+        __add_button('BACK', self.btnBack_clicked)
+        self.tbtnPause = __add_button('PAUSE', self.tbtnPause_toggled, Gtk.ToggleButton)
+        btnGo = __add_button('GO', self.btnGo_clicked)
+        btnGo.get_style_context().add_class('suggested-action')
+
+    def format_tooltip_text(self, control):
+        return control.getCommentStr()
+
+    def update_state(self):
+        self.labCue.set_text(self.cueStack.get_cue_name())
 
+        self.tbtnPause.handler_block_by_func(self.tbtnPause_toggled)
+        self.tbtnPause.set_active(self.cueStack.paused)
+        self.tbtnPause.handler_unblock_by_func(self.tbtnPause_toggled)
+
+    def value_changed(self, widget):
+        self.update_state()
+
+    def btnGo_clicked(self, btn):
+        self.cueStack.go(monotonic())
+        self.update_state()
+
+    def btnBack_clicked(self, btn):
+        self.cueStack.back(monotonic())
+        self.update_state()
+
+    def tbtnPause_toggled(self, btn):
+        self.cueStack.pause(monotonic())
+        self.update_state()
+
+
+class ChaseWidget(ControlWidget):
+    def setup(self):
+        self.chaseStack = self.owner.engine.cueStacks[self.control]
+
+        self.widget = Gtk.Box.new(bool_gtk_orientation(self.control.vertical),
+                                  WIDGET_SPACING)
+        self.set_tooltip_text(self.widget, self.control)
+
+        if self.control.icon:
+            self.widget.pack_start(self.owner.load_icon_image(self.control), False, False, 0)
+
+        if self.control.name:
+            self.widget.pack_start(Gtk.Label.new(self.control.name), False, False, 0)
+
+        self.labBPM = Gtk.Label.new('')
+        self.labBPM.set_width_chars(8)
+        self.widget.pack_start(self.labBPM, True, True, 0)
+
+        btnTap = Gtk.Button.new_with_label('TAP')
+        btnTap.connect('clicked', self.btnTap_clicked)
+        self.widget.pack_start(btnTap, False, False, 0)
+
+        self.tbtnRun = Gtk.ToggleButton.new_with_label('RUN')
+        self.tbtnRun.set_active(self.control.active)
+        self.tbtnRun.connect('toggled', self.tbtnRun_toggled)
+        self.tbtnRun.get_style_context().add_class('suggested-action')
+        self.widget.pack_start(self.tbtnRun, False, False, 0)
+
+        self.update_state()
+
+    def format_tooltip_text(self, control):
+        cstr = control.getCommentStr()
+        if cstr:
+            cstr = '%s\n\n' % cstr
+
+        return '%sSteps: %d, direction: %s' % (cstr, len(control.children), control.direction)
+
+    def update_state(self):
+        self.labBPM.set_text('%.1f BPM' % self.chaseStack.bpm)
+
+    def btnTap_clicked(self, btn):
+        # время - по тем же часам, что и расчёт кадров
+        self.chaseStack.tap(monotonic())
+        self.update_state()
+
+    def tbtnRun_toggled(self, btn):
+        if btn.get_active():
+            self.chaseStack.start(monotonic())
+        else:
+            self.chaseStack.stop()
+
+
+class EffectWidget(ControlWidget):
+    def setup(self):
+        self.generator = self.owner.engine.effects[self.control]
+
+        self.widget = Gtk.ToggleButton.new()
+        self.set_tooltip_text(self.widget, self.control)
+
+        lbox = Gtk.Box.new(Gtk.Orientation.HORIZONTAL, WIDGET_SPACING)
+
+        if self.control.icon:
+            lbox.pack_start(self.owner.load_icon_image(self.control), False, False, 0)
+
+        lbox.pack_start(Gtk.Label.new(self.control.name if self.control.name else self.control.wave),
+                        True, True, 0)
+        self.widget.add(lbox)
+
+        self.widget.set_active(self.control.active)
+        self.widget.connect('toggled', self.value_changed)
+
+    def format_tooltip_text(self, control):
+        cstr = control.getCommentStr()
+        if cstr:
+            cstr = '%s\n\n' % cstr
+
+        return '%sChannels: %d-%d' % (cstr, control.channel,
+            self.generator.stop)
+
+    def value_changed(self, btn):
+        self.generator.active = self.widget.get_active()
+
+
+class TimelineWidget(ControlWidget):
+    def setup(self):
+        self.sequencer = self.owner.engine.timelines[self.control]
+
+        self.widget = Gtk.ToggleButton.new()
+        self.set_tooltip_text(self.widget, self.control)
+
+        lbox = Gtk.Box.new(Gtk.Orientation.HORIZONTAL, WIDGET_SPACING)
+
+        if self.control.icon:
+            lbox.pack_start(self.owner.load_icon_image(self.control), False, False, 0)
+
+        lbox.pack_start(Gtk.Label.new(self.control.name if self.control.name else self.control.TAG),
+                        True, True, 0)
+        self.widget.add(lbox)
+
+        self.widget.set_active(self.control.active)
+        self.widget.connect('toggled', self.value_changed)
+
+    def format_tooltip_text(self, control):
+        cstr = control.getCommentStr()
+        if cstr:
+            cstr = '%s\n\n' % cstr
+
+        return '%sEvents: %d, length: %.1f s' % (cstr, len(control.events), control.length)
+
+    def value_changed(self, btn):
+        if self.widget.get_active():
+            self.sequencer.start(monotonic())
+        else:
+            self.sequencer.stop()
 
 
 CONTROL_WIDGETS = {Panel: PanelWidget,
+    Fixture: PanelWidget,
     Level: LevelWidget,
     ColorLevel: ColorLevelWidget,
-    Switch: SwitchWidget}
+    Submaster: SubmasterWidget,
+    GroupLevel: GroupLevelWidget,
+    Switch: SwitchWidget,
+    CueList: CueListWidget,
+    Chase: ChaseWidget,
+    Effect: EffectWidget,
+    Timeline: TimelineWidget}
+
+# элементы, не отображаемые в UI
+NON_VISUAL_CONTROLS = (Source, Patch, Group, Derived)
+
+
+class ScenesWindow():
+    """Окно библиотеки сцен: строка поиска и список сцен консоли.
+
+    Сцена вызывается двойным щелчком или клавишей Enter в списке
+    или в строке поиска (вызывается выбранная сцена), Escape закрывает
+    окно. В список выбираются только имена сцен, не более
+    dmxctrlscenes.FIND_LIMIT.
+
+    Атрибуты экземпляра класса:
+        owner       - экземпляр MainWnd;
+        window      - экземпляр Gtk.Window;
+        store       - экземпляр Gtk.ListStore (идентификатор, имя сцены)."""
+
+    def __init__(self, owner):
+        self.owner = owner
+
+        self.window = Gtk.Window.new(Gtk.WindowType.TOPLEVEL)
+        self.window.set_title('Scenes')
+        self.window.set_transient_for(owner.window)
+        self.window.set_destroy_with_parent(True)
+        self.window.set_default_size(-1, 400)
+        self.window.connect('delete-event', lambda w, e: w.hide_on_delete())
+
+        vbox = Gtk.Box.new(Gtk.Orientation.VERTICAL, WIDGET_SPACING)
+        vbox.set_border_width(WIDGET_SPACING)
+        self.window.add(vbox)
+
+        self.entSearch = Gtk.SearchEntry.new()
+        self.entSearch.connect('search-changed', lambda e: self.refresh())
+        self.entSearch.connect('activate', lambda e: self.recall_selected())
+        self.entSearch.connect('stop-search', lambda e: self.window.hide())
+        self.entSearch.connect('key-press-event', self.entSearch_key_press_event)
+        vbox.pack_start(self.entSearch, False, False, 0)
+
+        self.store = Gtk.ListStore(int, str)
+
+        self.tvScenes = Gtk.TreeView.new_with_model(self.store)
+        self.tvScenes.set_headers_visible(False)
+        self.tvScenes.set_enable_search(False)
+        self.tvScenes.append_column(Gtk.TreeViewColumn('Scene', Gtk.CellRendererText(), text=1))
+        self.tvScenes.connect('row-activated', lambda tv, path, col: self.recall_selected())
+
+        swnd = Gtk.ScrolledWindow.new(None, None)
+        swnd.set_policy(Gtk.PolicyType.NEVER, Gtk.PolicyType.AUTOMATIC)
+        swnd.set_shadow_type(Gtk.ShadowType.IN)
+        swnd.add(self.tvScenes)
+        vbox.pack_start(swnd, True, True, 0)
+
+        hbox = Gtk.Box.new(Gtk.Orientation.HORIZONTAL, WIDGET_SPACING)
+        vbox.pack_end(hbox, False, False, 0)
+
+        for label, tooltip, handler in (('Recall', 'Recall selected scene', self.recall_selected),
+                ('Release', 'Release recalled scene', self.owner.engine.release_scene),
+                ('Delete', 'Delete selected scene', self.delete_selected)):
+            btn = Gtk.Button.new_with_label(label)
+            btn.set_tooltip_text(tooltip)
+            btn.connect('clicked', lambda b, h=handler: h())
+            hbox.pack_start(btn, True, True, 0)
+
+    def entSearch_key_press_event(self, entry, event):
+        # стрелка вниз - переход из строки поиска в список
+        if event.keyval == Gdk.KEY_Down:
+            self.tvScenes.grab_focus()
+            return True
+
+        return False
+
+    def refresh(self):
+        """Заполнение списка сценами, найденными по строке поиска."""
+
+        scenes = self.owner.get_scene_library()
+
+        # при заполнении отключённого от TreeView списка
+        # TreeView не перерисовывается на каждой строке
+        self.tvScenes.set_model(None)
+        self.store.clear()
+
+        if scenes is not None:
+            for row in scenes.find(self.entSearch.get_text().strip()):
+                self.store.append(row)
+
+        self.tvScenes.set_model(self.store)
+
+        itr = self.store.get_iter_first()
+        if itr is not None:
+            self.tvScenes.get_selection().select_iter(itr)
+
+    def get_selected_id(self):
+        model, itr = self.tvScenes.get_selection().get_selected()
+
+        return model.get_value(itr, 0) if itr is not None else None
+
+    def recall_selected(self):
+        sceneId = self.get_selected_id()
+        if sceneId is not None:
+            self.owner.recall_scene(sceneId)
+
+    def delete_selected(self):
+        sceneId = self.get_selected_id()
+        if sceneId is not None:
+            self.owner.get_scene_library().delete(sceneId)
+            self.refresh()
+
+    def show(self):
+        self.window.show_all()
+        self.window.present()
+        self.entSearch.grab_focus()
 
 
 class MainWnd():
@@ -417,14 +768,27 @@ class MainWnd():
         self.dmxTimer = False
         Gtk.main_quit()
 
+    UI_FILE = 'dmxctrl.ui'
+    # объекты из UI_FILE, загружаемые при запуске
+    UI_MAIN_OBJECTS = ['wndConsole', 'mnuMain', 'adjGrandMaster',
+        'imgBtnAllLevelsMax', 'imgBtnAllLevelsMin',
+        'imgBtnOpenRecentFile', 'imgBtnRemoveRecentFile',
+        'imgTbtnConsoleScrollable', 'lstoreRecentFiles']
+
+    # если переменная окружения задана - программа завершается после
+    # вывода первого кадра, сообщив время запуска (см. "make bench-startup")
+    BENCH_STARTUP_ENV = 'DMXCTRL_BENCH_STARTUP'
+
     def __init__(self, cfg):
         self.cfg = cfg
         self.errorTitle = '%s error' % TITLE_VERSION
         # детальный заголовок сообщения об ошибке - только при инициализации
         # позже она не будет нужна
 
-        resldr = get_resource_loader()
-        uibldr = resldr.load_gtk_builder('dmxctrl.ui')
+        # диалоги загружаются из файла .ui при первом использовании
+        self.resldr = get_resource_loader()
+        uibldr = self.resldr.load_gtk_builder(self.UI_FILE, self.UI_MAIN_OBJECTS)
+        resldr = self.resldr
 
         iconSize = Gtk.IconSize.MENU
 
@@ -445,6 +809,13 @@ class MainWnd():
         except Exception as ex:
             self.show_exception(ex)
             sys.exit(-1)
+
+        # ответы и данные от olad (в т.ч. со входа DMX) обрабатываются
+        # в основном цикле GTK
+        GLib.io_add_watch(self.wrapper.Client().GetSocket().fileno(),
+                          GLib.PRIORITY_DEFAULT, GLib.IO_IN,
+                          self.__ola_socket_ready)
+        self.inputUniverse = None
         #
 
         self.boxControls = None
@@ -476,11 +847,15 @@ class MainWnd():
         self.consoleFile = ''
         self.console = None
         self.consoleWidgets = []
-        #!!!
-        self.channels = array('B', [0] * 512)
+        # расчёт выводимых кадров;
+        # буфер значений каналов, общий для контролов и движка
+        self.engine = DMXEngine()
+        self.channels = self.engine.channels
         #
         self.dmxSendEnabled = True
         self.dmxTimer = True
+        # время следующей отсылки всех universe
+        self.nextRefresh = 0.0
 
         #
         # список ранее использованных файлов
@@ -491,15 +866,7 @@ class MainWnd():
         #
         #
         #
-        self.dlgAbout = uibldr.get_object('dlgAbout')
-        logoSizePx = Gtk.IconSize.lookup(Gtk.IconSize.DIALOG)[1] * 4
-        logo = resldr.load_pixbuf('images/dmxctrl.png', logoSizePx, logoSizePx)
-        self.dlgAbout.set_logo(logo)
-        self.dlgAbout.set_program_name(TITLE)
-        self.dlgAbout.set_version('v%s' % VERSION)
-        self.dlgAbout.set_copyright(COPYRIGHT)
-        self.dlgAbout.set_website(URL)
-        self.dlgAbout.set_website_label(URL)
+        self.dlgAbout = None
 
         #
         #
@@ -508,6 +875,15 @@ class MainWnd():
 
         mnuMainDumpChannels.set_sensitive(DEBUG)
         mnuMainDumpChannels.set_visible(DEBUG)
+
+        # запись отосланных в DMX кадров в файл
+        self.mnuMainRecordShow = uibldr.get_object('mnuMainRecordShow')
+        self.recorder = None
+
+        # библиотека сцен открывается и окно создаётся при первом
+        # использовании
+        self.scenes = None
+        self.scenesWindow = None
         #
         #
         #
@@ -517,13 +893,13 @@ class MainWnd():
         #
         #
         #
-        self.dlgFileOpen = uibldr.get_object('dlgFileOpen')
+        self.dlgFileOpen = None
 
         #
-        #
+        # встроенные иконки создаются при первом использовании
         #
         self.icons = dict()
-        self.create_named_icons()
+        self.benchStartup = bool(os.environ.get(self.BENCH_STARTUP_ENV))
 
         print('Setting up console...', file=sys.stderr)
         if self.consoleFile:
@@ -580,29 +956,68 @@ class MainWnd():
     def btnRemoveRecentFile_clicked(self, btn):
         print('btnRemoveRecentFile_clicked() not implemented', file=sys.stderr)
 
-    def create_named_icons(self):
-        for iname, ihue in PALETTE_HUE_NAMES.items():
-            csurf = cairo.ImageSurface(cairo.FORMAT_ARGB32, self.smallIconSizePx, self.smallIconSizePx)
+    def get_named_icon(self, iname):
+        """Возвращает экземпляр Pixbuf - встроенную иконку с именем
+        iname (из PALETTE_HUE_NAMES, в нижнем регистре).
+        Иконка создаётся при первом запросе."""
+
+        pbuf = self.icons.get(iname)
+        if pbuf is not None:
+            return pbuf
+
+        import cairo
+        from math import pi
+
+        ihue = PALETTE_HUE_NAMES[iname]
+
+        csurf = cairo.ImageSurface(cairo.FORMAT_ARGB32, self.smallIconSizePx, self.smallIconSizePx)
+
+        cc = cairo.Context(csurf)
+        #cc.scale(iconSize, iconSize)
 
-            cc = cairo.Context(csurf)
-            #cc.scale(iconSize, iconSize)
+        center = self.smallIconSizePx / 2.0
+        radius = center * 0.7
+        circle = 2 * pi
 
-            center = self.smallIconSizePx / 2.0
-            radius = center * 0.7
-            circle = 2 * pi
+        cc.set_source(cairo.SolidPattern(0.0, 0.0, 0.0))
 
-            cc.set_source(cairo.SolidPattern(0.0, 0.0, 0.0))
+        cc.arc(center, center, radius, 0.0, circle)
+        cc.fill()
 
-            cc.arc(center, center, radius, 0.0, circle)
-            cc.fill()
+        radius1 = radius - 1.0
 
-            radius1 = radius - 1.0
+        cc.set_source(cairo.SolidPattern(*hue_to_rgba(ihue)))
+        cc.arc(center, center, radius1, 0.0, circle)
+        cc.fill()
 
-            cc.set_source(cairo.SolidPattern(*hue_to_rgba(ihue)))
-            cc.arc(center, center, radius1, 0.0, circle)
-            cc.fill()
+        pbuf = Gdk.pixbuf_get_from_surface(csurf, 0, 0, self.smallIconSizePx, self.smallIconSizePx)
+        self.icons[iname] = pbuf
 
-            self.icons[iname.lower()] = Gdk.pixbuf_get_from_surface(csurf, 0, 0, self.smallIconSizePx, self.smallIconSizePx)
+        return pbuf
+
+    def get_about_dialog(self):
+        if self.dlgAbout is None:
+            self.dlgAbout = self.resldr.load_gtk_builder(self.UI_FILE, ['dlgAbout']).get_object('dlgAbout')
+            self.dlgAbout.set_transient_for(self.window)
+
+            logoSizePx = Gtk.IconSize.lookup(Gtk.IconSize.DIALOG)[1] * 4
+            logo = self.resldr.load_pixbuf('images/dmxctrl.png', logoSizePx, logoSizePx)
+            self.dlgAbout.set_logo(logo)
+            self.dlgAbout.set_program_name(TITLE)
+            self.dlgAbout.set_version('v%s' % VERSION)
+            self.dlgAbout.set_copyright(COPYRIGHT)
+            self.dlgAbout.set_website(URL)
+            self.dlgAbout.set_website_label(URL)
+
+        return self.dlgAbout
+
+    def get_file_open_dialog(self):
+        if self.dlgFileOpen is None:
+            self.dlgFileOpen = self.resldr.load_gtk_builder(self.UI_FILE,
+                ['dlgFileOpen', 'filefilterDMXctrls']).get_object('dlgFileOpen')
+            self.dlgFileOpen.set_transient_for(self.window)
+
+        return self.dlgFileOpen
 
     def mnuMainSwitchToConsole_activate(self, mnu):
         self.stackPages.set_visible_child(self.boxConsole)
@@ -611,9 +1026,119 @@ class MainWnd():
         self.stackPages.set_visible_child(self.boxRecents)
 
     def mnuMainAbout_activate(self, mnu):
-        self.dlgAbout.show_all()
-        self.dlgAbout.run()
-        self.dlgAbout.hide()
+        dlg = self.get_about_dialog()
+        dlg.show_all()
+        dlg.run()
+        dlg.hide()
+
+    def start_recording(self):
+        """Начало записи кадров в новый файл в каталоге файла консоли."""
+
+        self.stop_recording()
+
+        if not self.console:
+            return
+
+        fname = new_show_file_name(self.consoleFile)
+
+        try:
+            self.recorder = ShowRecorder(fname)
+        except OSError as ex:
+            msg_dialog(self.window, 'Show recording', 'Can not create file "%s" - %s' % (fname, ex))
+            return
+
+        print('Recording show to "%s"...' % fname, file=sys.stderr)
+
+        # первый кадр записи - текущие значения всех каналов
+        self.__send_channels(True)
+
+    def stop_recording(self):
+        if self.recorder is not None:
+            recorder = self.recorder
+            self.recorder = None
+            recorder.close()
+
+            if recorder.error is not None:
+                print('Show recording error - %s' % recorder.error, file=sys.stderr)
+            else:
+                print('Show recorded to "%s"' % recorder.filename, file=sys.stderr)
+
+    def mnuMainRecordShow_toggled(self, mnu):
+        if mnu.get_active():
+            self.start_recording()
+
+            if self.recorder is None:
+                mnu.set_active(False)
+        else:
+            self.stop_recording()
+
+    def get_scene_library(self):
+        """Возвращает экземпляр SceneLibrary для загруженной консоли
+        или None, если консоль не загружена."""
+
+        if self.scenes is None and self.console:
+            from dmxctrlscenes import SceneLibrary
+
+            self.scenes = SceneLibrary(self.consoleFile)
+
+        return self.scenes
+
+    def close_scene_library(self):
+        if self.scenes is not None:
+            self.scenes.close()
+            self.scenes = None
+
+    def recall_scene(self, sceneId):
+        try:
+            self.engine.recall_scene(*self.get_scene_library().load(sceneId))
+        except Exception as ex:
+            self.show_exception(ex)
+
+    def mnuMainSaveScene_activate(self, mnu):
+        if not self.console:
+            return
+
+        from time import strftime
+
+        entName = Gtk.Entry.new()
+        entName.set_text(strftime('%Y-%m-%d %H:%M:%S'))
+        entName.set_activates_default(True)
+
+        chkNonZero = Gtk.CheckButton.new_with_label('Only channels with non-zero values')
+        chkNonZero.set_tooltip_text('Other channels will not be changed when scene is recalled')
+
+        if msg_dialog(self.window, 'Save scene', 'Scene name:', Gtk.MessageType.QUESTION,
+                Gtk.ButtonsType.OK_CANCEL, widgets=(entName, chkNonZero),
+                default_response=Gtk.ResponseType.OK) != Gtk.ResponseType.OK:
+            return
+
+        # снимок - значения каналов до масштабирования общими уровнями
+        data = self.engine.frame
+        mask = bytes(map(bool, data)) if chkNonZero.get_active() else None
+
+        try:
+            self.get_scene_library().save(entName.get_text(), data, mask)
+        except Exception as ex:
+            self.show_exception(ex)
+            return
+
+        if self.scenesWindow is not None and self.scenesWindow.window.get_visible():
+            self.scenesWindow.refresh()
+
+    def mnuMainScenes_activate(self, mnu):
+        if not self.console:
+            return
+
+        if self.scenesWindow is None:
+            self.scenesWindow = ScenesWindow(self)
+
+        try:
+            self.scenesWindow.refresh()
+        except Exception as ex:
+            self.show_exception(ex)
+            return
+
+        self.scenesWindow.show()
 
     def mnuMainDumpChannels_activate(self, mnu):
         cd = []
@@ -623,23 +1148,26 @@ class MainWnd():
             cr = ['%.3d:' % cn]
 
             for col in range(32):
-                cr.append('%.2x' % self.channels[cn])
+                cr.append('%.2x' % self.engine.output.data[cn])
                 cn += 1
 
             cd.append(' '.join(cr))
 
         print('*** Channel values ***\n%s' % ('\n'.join(cd)))
+        print('*** Frame time ***\n%s' % self.engine.stats)
 
     def mnuFileOpen_activate(self, mnu):
+        dlg = self.get_file_open_dialog()
+
         if self.consoleFile:
-            self.dlgFileOpen.select_filename(self.consoleFile)
+            dlg.select_filename(self.consoleFile)
 
-        self.dlgFileOpen.show_all()
-        r = self.dlgFileOpen.run()
-        self.dlgFileOpen.hide()
+        dlg.show_all()
+        r = dlg.run()
+        dlg.hide()
 
         if r == Gtk.ResponseType.OK:
-            fn = self.dlgFileOpen.get_filename()
+            fn = dlg.get_filename()
 
             if fn:
                 self.consoleFile = fn
@@ -648,6 +1176,8 @@ class MainWnd():
                     self.update_recent_files_lv()
 
     def show_exception(self, ex):
+        from traceback import format_exception
+
         etrace = '\n'.join(format_exception(*sys.exc_info()))
         ex = str(ex)
 
@@ -667,7 +1197,7 @@ class MainWnd():
         # на этом этапе ctrl.icon содержит правильный путь
         # или проверенное имя встроенной иконки
         if ctrl.isInternalIcon:
-            pbuf = self.icons[ctrl.icon]
+            pbuf = self.get_named_icon(ctrl.icon)
         else:
             pbuf = Pixbuf.new_from_file_at_size(ctrl.icon,
                                                 self.smallIconSizePx,
@@ -680,12 +1210,18 @@ class MainWnd():
         Путь к файлу должен быть в self.consoleFile.
         Метод возвращает булевское значение - True в случае успешной загрузки."""
 
+        # запись и библиотека сцен относятся к одной консоли
+        self.mnuMainRecordShow.set_active(False)
+        self.close_scene_library()
+
+        if self.scenesWindow is not None:
+            self.scenesWindow.window.hide()
+
         def _clear_console():
             self.console = None
             self.consoleWidgets.clear()
 
-            for i in range(len(self.channels)):
-                self.channels[i] = 0
+            self.engine.setup(None)
 
             if self.boxControls:
                 self.boxControls.destroy()
@@ -729,10 +1265,17 @@ class MainWnd():
                 if not os.path.exists(self.consoleFile):
                     raise Exception('File "%s" is not found' % self.consoleFile)
 
-                self.console = DMXControls(self.consoleFile)
+                self.console = load_console_file(self.consoleFile)
                 if not self.console.children:
                     raise Exception('No controls defined in file "%s"' % self.consoleFile)
 
+                __step = 'setting up console'
+                __show_step()
+                # до создания виджетов, т.к. они сразу пишут значения
+                # в каналы и могут ссылаться на части движка
+                self.engine.setup(self.console)
+                self.__register_input_universe(self.engine.inputUniverse)
+
                 self.headerBar.set_tooltip_text(self.console.getCommentStr())
 
                 __step = 'building console UI'
@@ -742,7 +1285,8 @@ class MainWnd():
                 self.vpControls.add(self.boxControls)
 
                 for cc in self.console.children:
-                    self.boxControls.pack_start(_build_console_widgets(cc), False, False, 0)
+                    if not isinstance(cc, NON_VISUAL_CONTROLS):
+                        self.boxControls.pack_start(_build_console_widgets(cc), False, False, 0)
 
             except Exception as ex:
                 self.show_exception('Error %s.\n%s' % (__step, ex))
@@ -772,31 +1316,34 @@ class MainWnd():
         print('Console is %sloaded' % ('' if ret else 'not '), file=sys.stderr)
         return ret
 
-    def set_channel_values(self, channel, values):
+    def set_channel_values(self, channel, values, fade=0.0):
         """Установка значений в каналах.
 
-        channel - номер первого изменяемого канала;
-        values  - список целых значений."""
+        channel - номер первого изменяемого канала (от 1);
+        values  - значения (bytes, array('B') или список целых),
+                  см. ChannelBuffer.set_values();
+        fade    - время плавного перехода к значениям в секундах
+                  (см. DMXEngine.set_ui_values())."""
 
-        for cv in values:
-            # вынимание!
-            # каналы в контролах нумеруются от 1 (как в протоколе DMX-512)
-            # но массив channels имеет индексаци1 от 0!
-            self.channels[channel - 1] = cv
-            channel += 1
+        self.engine.set_ui_values(channel, values, monotonic(), fade)
 
     def btnAllLevelsMin_clicked(self, btn):
-        for wctl in self.consoleWidgets:
-            wctl.setMinLevel()
+        # положения движков не меняются - плавно убирается общий уровень
+        self.engine.outputStage.blackout(monotonic(), True)
 
     def btnAllLevelsMax_clicked(self, btn):
+        self.engine.outputStage.blackout(monotonic(), False)
+
         for wctl in self.consoleWidgets:
             wctl.setMaxLevel()
 
+    def scGrandMaster_value_changed(self, scale):
+        self.engine.outputStage.set_grand_master(int(scale.get_value()))
+
     def btnDebug_clicked(self, btn):
         ixch = 0
         for y in range(16):
-            print('%.3d  \033[1m%s\033[0m' % (ixch, ' '.join(map(lambda v: '%.2x' % v, self.channels[ixch:ixch + 32]))))
+            print('%.3d  \033[1m%s\033[0m' % (ixch, ' '.join(map(lambda v: '%.2x' % v, self.engine.output.view[ixch:ixch + 32]))))
             ixch += 32
 
     def __DMX_sent(self, state):
@@ -806,13 +1353,62 @@ class MainWnd():
             self.wrapper.Stop()
             print('DMX communication error %s' % str(state), file=sys.stderr)
 
-    def __send_channels(self):
+    def __ola_socket_ready(self, fd, condition):
+        self.wrapper.Client().SocketReady()
+        return True
+
+    def __DMX_received(self, data):
+        self.engine.set_input_values(data)
+
+    def __register_input_universe(self, universe):
+        """Подписка на получение данных со входа DMX (universe - целое
+        или None) и отписка от ранее использованного universe."""
+
+        if universe == self.inputUniverse:
+            return
+
+        client = self.wrapper.Client()
+
+        if self.inputUniverse is not None:
+            client.RegisterUniverse(self.inputUniverse, client.UNREGISTER)
+
+        self.inputUniverse = universe
+
+        if universe is not None:
+            client.RegisterUniverse(universe, client.REGISTER, self.__DMX_received)
+
+    def __send_channels(self, force=False):
+        """Отсылка значений каналов всех universe.
+        olad сам повторяет последний полученный кадр, потому,
+        если force == False, неизменившиеся значения повторно
+        не отсылаются (кроме периодической отсылки всех universe
+        в timer_func())."""
+
         if self.console:
-            self.wrapper.Client().SendDmx(self.console.universe, self.channels, self.__DMX_sent)
+            client = self.wrapper.Client()
+
+            for universe, buf in self.engine.patch.universes.items():
+                if buf.pop_dirty() or force:
+                    client.SendDmx(universe, buf.data, self.__DMX_sent)
+
+                    if self.recorder is not None:
+                        self.recorder.record(universe, buf.data)
 
     def timer_func(self, data):
         if self.dmxSendEnabled:
-            self.__send_channels()
+            now = monotonic()
+            self.engine.render(now)
+
+            force = now >= self.nextRefresh
+            if force:
+                self.nextRefresh = now + FULL_REFRESH_INTERVAL
+
+            self.__send_channels(force)
+
+            if self.benchStartup:
+                self.benchStartup = False
+                print('Time to first frame: %.1f ms' % ((monotonic() - STARTUP_TIME) * 1000.0), file=sys.stderr)
+                self.wnd_destroy(self.window)
 
         return self.dmxTimer
 
@@ -822,10 +1418,12 @@ class MainWnd():
         finally:
             print('Black out DMX channels...', file=sys.stderr)
 
-            for ix in range(len(self.channels)):
-                self.channels[ix] = 0
+            self.engine.patch.clear()
+            self.__send_channels(True)
+            self.stop_recording()
+            self.close_scene_library()
 
-            self.__send_channels()
+            print('Frame time: %s' % self.engine.stats, file=sys.stderr)
 
 
 def main():
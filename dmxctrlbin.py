@@ -0,0 +1,311 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+""" This file is part of DMXCtrl.
+
+    DMXCtrl is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    DMXCtrl is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with DMXCtrl.  If not, see <http://www.gnu.org/licenses/>."""
+
+
+""" Двоичный ("скомпилированный") формат файла описания консоли.
+
+    Файл содержит уже проверенное дерево контролов, и загружается
+    одним чтением файла и разбором буфера, без SAX и проверки
+    атрибутов.
+
+    Формат (все целые - little endian):
+        заголовок   - MAGIC, версия формата (uint16), сигнатура набора
+                      атрибутов контролов (SCHEMA_SIGNATURE_SIZE байт,
+                      см. dmxctrldata.get_schema_signature()); файл,
+                      скомпилированный другой версией программы,
+                      требуется скомпилировать заново;
+        строки      - количество (uint32), затем для каждой строки -
+                      длина (uint32) и байты в UTF-8; все строки
+                      (имена тэгов, атрибутов и строковые значения)
+                      хранятся в таблице один раз, далее на них
+                      ссылаются по индексам;
+        дерево      - узел корневого элемента.
+
+    Узел:
+        индекс имени тэга (uint32), количество атрибутов (uint32),
+        атрибуты - индекс имени (uint32) и значение,
+        количество дочерних узлов (uint32), дочерние узлы.
+
+    Значение - байт типа, за которым следуют данные:
+        N, T, F - None, True, False (без данных);
+        i       - целое (int64);
+        f       - вещественное (double);
+        s       - индекс строки (uint32);
+        l, t    - список или кортеж: количество элементов (uint32),
+                  затем элементы."""
+
+
+from struct import Struct
+
+from dmxctrldata import *
+
+
+MAGIC = b'DMXCTRL\x00'
+FORMAT_VERSION = 4
+SCHEMA_SIGNATURE_SIZE = 40
+
+COMPILED_FILE_EXT = '.dmxctrlc'
+
+__U16 = Struct('<H')
+__U32 = Struct('<I')
+__I64 = Struct('<q')
+__F64 = Struct('<d')
+__NODE = Struct('<II')
+
+# атрибуты, не сохраняемые в файл
+SKIPPED_ATTRIBUTES = {'console', 'children',
+    # внутренние атрибуты загрузчика DMXControls
+    'fixtures', 'locator', 'stack', 'stackTop', 'curChannel',
+    'templates', 'references', 'recording', 'channelBase'}
+
+# классы контролов по именам тэгов
+CONTROL_CLASSES = {cls.TAG: cls for cls in DMXControls.CHILD_CLASSES + (DMXControls,)}
+
+
+class CompiledFormatError(ValueError):
+    def __init__(self, filename, msg):
+        super().__init__('Error in compiled console file "%s": %s' % (filename, msg))
+
+
+def is_compiled_console(filename):
+    """Возвращает True, если файл filename - скомпилированный."""
+
+    with open(filename, 'rb') as f:
+        return f.read(len(MAGIC)) == MAGIC
+
+
+def save_compiled_console(console, filename):
+    """Сохранение загруженной консоли console (экземпляра DMXControls)
+    в файл filename в двоичном формате."""
+
+    strings = dict()
+    body = bytearray()
+
+    def __string(s):
+        ix = strings.get(s)
+        if ix is None:
+            ix = len(strings)
+            strings[s] = ix
+
+        return ix
+
+    def __put_value(v):
+        if v is None:
+            body.extend(b'N')
+        elif v is True:
+            body.extend(b'T')
+        elif v is False:
+            body.extend(b'F')
+        elif isinstance(v, int):
+            body.extend(b'i')
+            body.extend(__I64.pack(v))
+        elif isinstance(v, float):
+            body.extend(b'f')
+            body.extend(__F64.pack(v))
+        elif isinstance(v, str):
+            body.extend(b's')
+            body.extend(__U32.pack(__string(v)))
+        elif isinstance(v, (list, tuple)):
+            body.extend(b'l' if isinstance(v, list) else b't')
+            body.extend(__U32.pack(len(v)))
+            for item in v:
+                __put_value(item)
+        else:
+            raise TypeError('unsupported value type - %s' % type(v).__name__)
+
+    def __put_node(ctrl):
+        attrs = [(k, v) for k, v in vars(ctrl).items() if k not in SKIPPED_ATTRIBUTES]
+
+        body.extend(__U32.pack(__string(ctrl.TAG)))
+        body.extend(__U32.pack(len(attrs)))
+
+        for k, v in attrs:
+            body.extend(__U32.pack(__string(k)))
+            __put_value(v)
+
+        body.extend(__U32.pack(len(ctrl.children)))
+        for child in ctrl.children:
+            __put_node(child)
+
+    __put_node(console)
+
+    with open(filename, 'wb') as f:
+        f.write(MAGIC)
+        f.write(__U16.pack(FORMAT_VERSION))
+        f.write(get_schema_signature().encode('ascii'))
+        f.write(__U32.pack(len(strings)))
+
+        # словари сохраняют порядок добавления - индексы совпадают
+        for s in strings:
+            bs = s.encode('utf-8')
+            f.write(__U32.pack(len(bs)))
+            f.write(bs)
+
+        f.write(body)
+
+
+def load_compiled_console(filename):
+    """Загрузка консоли из файла filename в двоичном формате.
+    Возвращает экземпляр DMXControls."""
+
+    with open(filename, 'rb') as f:
+        buf = memoryview(f.read())
+
+    if buf[:len(MAGIC)] != MAGIC:
+        raise CompiledFormatError(filename, 'file is not a compiled console file')
+
+    pos = len(MAGIC)
+    version = __U16.unpack_from(buf, pos)[0]
+    if version != FORMAT_VERSION:
+        raise CompiledFormatError(filename, 'unsupported format version %d, file must be recompiled' % version)
+
+    pos += __U16.size
+
+    if bytes(buf[pos:pos + SCHEMA_SIGNATURE_SIZE]) != get_schema_signature().encode('ascii'):
+        raise CompiledFormatError(filename, 'file is compiled by another program version, file must be recompiled')
+
+    pos += SCHEMA_SIGNATURE_SIZE
+
+    u32 = __U32.unpack_from
+
+    nstrings = u32(buf, pos)[0]
+    pos += 4
+
+    strings = []
+    for i in range(nstrings):
+        slen = u32(buf, pos)[0]
+        pos += 4
+        strings.append(str(buf[pos:pos + slen], 'utf-8'))
+        pos += slen
+
+    def __get_value():
+        nonlocal pos
+
+        vtype = buf[pos]
+        pos += 1
+
+        if vtype == 0x4e: # N
+            return None
+        elif vtype == 0x54: # T
+            return True
+        elif vtype == 0x46: # F
+            return False
+        elif vtype == 0x69: # i
+            v = __I64.unpack_from(buf, pos)[0]
+            pos += 8
+            return v
+        elif vtype == 0x66: # f
+            v = __F64.unpack_from(buf, pos)[0]
+            pos += 8
+            return v
+        elif vtype == 0x73: # s
+            v = strings[u32(buf, pos)[0]]
+            pos += 4
+            return v
+        elif vtype in (0x6c, 0x74): # l, t
+            count = u32(buf, pos)[0]
+            pos += 4
+            v = [__get_value() for i in range(count)]
+            return v if vtype == 0x6c else tuple(v)
+        else:
+            raise CompiledFormatError(filename, 'invalid value type at offset %d' % (pos - 1))
+
+    def __get_node(console):
+        nonlocal pos
+
+        tag, nattrs = __NODE.unpack_from(buf, pos)
+        pos += __NODE.size
+
+        cls = CONTROL_CLASSES.get(strings[tag])
+        if cls is None:
+            raise CompiledFormatError(filename, 'unsupported tag "%s"' % strings[tag])
+
+        if console is None:
+            # конструктор корневого элемента загружает файл XML
+            ctrl = cls.__new__(cls)
+            Container.__init__(ctrl)
+        else:
+            # атрибуты, которых нет в файле, получат значения по умолчанию
+            ctrl = cls()
+
+        d = vars(ctrl)
+
+        for i in range(nattrs):
+            name = strings[u32(buf, pos)[0]]
+            pos += 4
+            d[name] = __get_value()
+
+        if console is None:
+            # внутренние атрибуты загрузчика
+            console = ctrl
+            xml.sax.ContentHandler.__init__(console)
+            console.fixtures = None
+            console.locator = None
+            console.stack = []
+            console.stackTop = None
+
+        ctrl.console = console
+
+        nchildren = u32(buf, pos)[0]
+        pos += 4
+        ctrl.children = [__get_node(console) for i in range(nchildren)]
+
+        return ctrl
+
+    try:
+        console = __get_node(None)
+    except IndexError as ex:
+        raise CompiledFormatError(filename, 'unexpected end of file') from ex
+
+    if not isinstance(console, DMXControls):
+        raise CompiledFormatError(filename, 'invalid root element')
+
+    return console
+
+
+def load_console_file(filename):
+    """Загрузка консоли из файла filename в любом поддерживаемом
+    формате (XML или двоичном).
+    Возвращает экземпляр DMXControls."""
+
+    if is_compiled_console(filename):
+        return load_compiled_console(filename)
+
+    return DMXControls(filename)
+
+
+def compile_console_file(filename, outfilename=None):
+    """Компиляция файла описания консоли filename в двоичный формат.
+    Если outfilename не указан, имя выходного файла получается
+    заменой расширения на COMPILED_FILE_EXT.
+    Возвращает имя выходного файла."""
+
+    if not outfilename:
+        outfilename = os.path.splitext(filename)[0] + COMPILED_FILE_EXT
+
+    save_compiled_console(DMXControls(filename), outfilename)
+
+    return outfilename
+
+
+if __name__ == '__main__':
+    print('[debugging %s]' % __file__)
+
+    fn = compile_console_file('example.dmxctrl', '/tmp/example.dmxctrlc')
+    console = load_console_file(fn)
+    print(repr(console))
@@ -0,0 +1,168 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+""" This file is part of DMXCtrl.
+
+    DMXCtrl is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    DMXCtrl is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with DMXCtrl.  If not, see <http://www.gnu.org/licenses/>."""
+
+
+from array import array
+
+
+# количество каналов в одном universe DMX512
+DMX_UNIVERSE_SIZE = 512
+
+
+class ChannelBuffer():
+    """Буфер значений каналов одного universe DMX512.
+
+    Один экземпляр буфера совместно используется контролами UI,
+    "движками" и средствами вывода (OLA и т.п.) - без копирования
+    данных, через memoryview.
+
+    Внимание! Методы класса принимают номера каналов в том виде,
+    как они указаны в файлах описания консолей, т.е. нумерация
+    начинается с 1 (как в протоколе DMX-512), а индексы в data
+    и view - как положено, с 0.
+
+    Атрибуты экземпляра класса:
+        data        - экземпляр array('B'), значения каналов;
+                      может передаваться напрямую в OLA (SendDmx);
+        view        - экземпляр memoryview для data;
+        dirtyFirst,
+        dirtyStop   - целые, диапазон индексов (от dirtyFirst
+                      до dirtyStop-1), в котором значения изменились
+                      с момента последнего вызова метода pop_dirty();
+                      если изменений не было, оба атрибута равны None."""
+
+    def __init__(self, size=DMX_UNIVERSE_SIZE):
+        self.data = array('B', bytes(size))
+        self.view = memoryview(self.data)
+        self.reset_dirty()
+
+    def __len__(self):
+        return len(self.data)
+
+    def reset_dirty(self):
+        self.dirtyFirst = None
+        self.dirtyStop = None
+
+    def mark_dirty(self, first, stop):
+        """Расширение диапазона изменённых значений.
+
+        first, stop - целые, индексы (не номера каналов!)
+                      первого изменённого значения и следующего
+                      за последним изменённым."""
+
+        if self.dirtyFirst is None:
+            self.dirtyFirst = first
+            self.dirtyStop = stop
+        else:
+            if first < self.dirtyFirst:
+                self.dirtyFirst = first
+
+            if stop > self.dirtyStop:
+                self.dirtyStop = stop
+
+    def pop_dirty(self):
+        """Возвращает кортеж из двух целых - индексы первого изменённого
+        значения и следующего за последним изменённым, и сбрасывает
+        диапазон изменений.
+        Если изменений не было - возвращает None."""
+
+        if self.dirtyFirst is None:
+            return None
+
+        r = (self.dirtyFirst, self.dirtyStop)
+        self.reset_dirty()
+
+        return r
+
+    def check_range(self, channel, count):
+        """Проверка диапазона каналов.
+
+        channel - целое, номер первого канала (от 1);
+        count   - целое, количество каналов.
+
+        Возвращает индекс в data, соответствующий channel.
+        В случае выхода за границы буфера генерирует ValueError."""
+
+        ix = channel - 1
+
+        if ix < 0 or count < 0 or ix + count > len(self.data):
+            raise ValueError('channels %d..%d are out of range 1..%d' % (channel, channel + count - 1, len(self.data)))
+
+        return ix
+
+    def set_values(self, channel, values):
+        """Установка значений в каналах одной операцией над срезом.
+
+        channel - целое, номер первого изменяемого канала (от 1);
+        values  - значения каналов: bytes, bytearray, array('B'),
+                  memoryview, массив NumPy с dtype=uint8 и прочие
+                  объекты, поддерживающие buffer protocol с форматом 'B';
+                  также допустимы списки и прочие последовательности
+                  целых в диапазоне 0..255 (они копируются во временный
+                  array('B'))."""
+
+        nvalues = len(values)
+        ix = self.check_range(channel, nvalues)
+        stop = ix + nvalues
+
+        try:
+            self.view[ix:stop] = values
+        except (TypeError, ValueError):
+            # список целых, либо буфер с другим форматом элементов
+            try:
+                self.view[ix:stop] = array('B', values)
+            except OverflowError as ex:
+                raise ValueError('channel values must be in range 0..255') from ex
+
+        self.mark_dirty(ix, stop)
+
+    def get_values(self, channel, count):
+        """Возвращает memoryview (без копирования) со значениями
+        count каналов, начиная с channel (от 1)."""
+
+        ix = self.check_range(channel, count)
+
+        return self.view[ix:ix + count]
+
+    def assign(self, src):
+        """Копирование значений всех каналов из src - экземпляра
+        ChannelBuffer или объекта, поддерживающего buffer protocol,
+        с тем же количеством элементов.
+        Если значения не изменились, диапазон изменений не расширяется.
+        Возвращает True, если значения изменились."""
+
+        if isinstance(src, ChannelBuffer):
+            src = src.view
+
+        if self.view == src:
+            return False
+
+        self.view[:] = src
+        self.mark_dirty(0, len(self.data))
+
+        return True
+
+    def clear(self):
+        """Обнуление значений во всех каналах."""
+
+        self.view[:] = bytes(len(self.data))
+        self.mark_dirty(0, len(self.data))
+
+    def __repr__(self):
+        return '%s(size=%d, dirty=%s..%s)' % (self.__class__.__name__,
+            len(self.data), self.dirtyFirst, self.dirtyStop)
@@ -0,0 +1,299 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+""" This file is part of DMXCtrl.
+
+    DMXCtrl is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    DMXCtrl is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with DMXCtrl.  If not, see <http://www.gnu.org/licenses/>."""
+
+
+""" Режимы работы без GUI (запускаются ключами командной строки).
+    Модуль не должен импортировать GTK."""
+
+
+import sys
+import os
+import argparse
+import json
+from time import perf_counter
+from concurrent.futures import ProcessPoolExecutor
+
+
+def is_cli_cmdline(args):
+    """Возвращает True, если аргументы командной строки args (без имени
+    программы) требуют работы без GUI."""
+
+    return bool(args) and args[0].startswith('-')
+
+
+def cmd_compile(args):
+    from dmxctrlbin import compile_console_file
+
+    if args.output and len(args.files) > 1:
+        print('Option --output may be used with single file only', file=sys.stderr)
+        return 1
+
+    for fname in args.files:
+        try:
+            outfname = compile_console_file(fname, args.output)
+        except Exception as ex:
+            print(ex, file=sys.stderr)
+            return 1
+
+        print('%s -> %s' % (fname, outfname), file=sys.stderr)
+
+    return 0
+
+
+def find_channel_overlaps(console):
+    """Поиск каналов, используемых более чем одним контролом
+    (это допустимо, но чаще всего - результат опечатки).
+
+    Возвращает список словарей с ключами "first", "last" (номера каналов)
+    и "controls" (список строк с описаниями контролов)."""
+
+    from dmxctrldata import Regulator, Submaster
+
+    users = dict()
+
+    for ctrl in console.walk():
+        if isinstance(ctrl, Regulator) and not isinstance(ctrl, Submaster):
+            descr = '%s "%s" (%d)' % (ctrl.TAG, ctrl.name, ctrl.channel) if ctrl.name else '%s (%d)' % (ctrl.TAG, ctrl.channel)
+
+            for channel in range(ctrl.channel, ctrl.channel + ctrl.getNChannels()):
+                users.setdefault(channel, []).append(descr)
+
+    # соседние каналы с одинаковым набором контролов объединяются
+    overlaps = []
+
+    for channel in sorted(users):
+        controls = users[channel]
+        if len(controls) < 2:
+            continue
+
+        if overlaps and overlaps[-1]['last'] == channel - 1 and overlaps[-1]['controls'] == controls:
+            overlaps[-1]['last'] = channel
+        else:
+            overlaps.append({'first': channel, 'last': channel, 'controls': controls})
+
+    return overlaps
+
+
+def check_console_file(fname):
+    """Проверка файла описания консоли fname: загрузка и подготовка
+    движка к выводу кадров (компиляция выражений, таблиц коммутации
+    и т.п.).
+    Возвращает словарь с результатами проверки (см. cmd_check())."""
+
+    from xml.sax import SAXParseException
+    from dmxctrldata import DMXControls, Regulator
+    from dmxctrlbin import load_console_file
+    from dmxctrlengine import DMXEngine
+
+    r = {'file': fname, 'ok': False, 'time': None, 'error': None,
+         'controls': 0, 'channels': 0, 'overlaps': []}
+
+    t0 = perf_counter()
+
+    try:
+        console = load_console_file(fname)
+    except DMXControls.Error as ex:
+        r['error'] = {'message': ex.message, 'line': ex.line, 'column': ex.column, 'element': ex.element}
+    except SAXParseException as ex:
+        r['error'] = {'message': ex.getMessage(), 'line': ex.getLineNumber(), 'column': ex.getColumnNumber(), 'element': None}
+    except Exception as ex:
+        r['error'] = {'message': str(ex), 'line': None, 'column': None, 'element': None}
+    else:
+        r['ok'] = True
+
+    r['time'] = perf_counter() - t0
+
+    if r['ok']:
+        try:
+            DMXEngine().setup(console)
+        except ValueError as ex:
+            r['ok'] = False
+            r['error'] = {'message': str(ex), 'line': None, 'column': None, 'element': None}
+
+    if r['ok']:
+        channels = set()
+
+        for ctrl in console.walk():
+            if isinstance(ctrl, Regulator):
+                r['controls'] += 1
+                channels.update(range(ctrl.channel, ctrl.channel + ctrl.getNChannels()))
+
+        r['channels'] = len(channels)
+        r['overlaps'] = find_channel_overlaps(console)
+
+    return r
+
+
+def cmd_check(args):
+    """Проверка файлов описания консолей.
+
+    В stdout выводится JSON - список словарей с ключами:
+        file        - имя файла;
+        ok          - булевское значение, True, если файл загружен
+                      и движок подготовлен к выводу без ошибок;
+        time        - время загрузки файла в секундах;
+        error       - None или словарь с ключами message, line, column
+                      и element (путь к элементу с ошибкой);
+        controls    - количество контролов, изменяющих значения каналов;
+        channels    - количество используемых каналов;
+        overlaps    - список каналов, используемых несколькими контролами
+                      (см. find_channel_overlaps()).
+
+    Возвращает 0, если все файлы загружены без ошибок (и, с ключом
+    --strict, без пересечений каналов), иначе - 1."""
+
+    t0 = perf_counter()
+
+    jobs = args.jobs if args.jobs else os.cpu_count() or 1
+
+    if jobs <= 1 or len(args.files) <= 1:
+        results = list(map(check_console_file, args.files))
+    else:
+        with ProcessPoolExecutor(max_workers=jobs) as executor:
+            results = list(executor.map(check_console_file, args.files))
+
+    json.dump(results, sys.stdout, ensure_ascii=False, indent=1)
+    print()
+
+    nerrors = sum(1 for r in results if not r['ok'])
+    noverlaps = sum(1 for r in results if r['overlaps'])
+
+    print('%d file(s) checked in %.3f s, %d with errors, %d with overlapping channels' % (len(results),
+        perf_counter() - t0, nerrors, noverlaps), file=sys.stderr)
+
+    return 1 if nerrors or (args.strict and noverlaps) else 0
+
+
+def cmd_run(args):
+    """Воспроизведение консоли (или записи шоу) без UI."""
+
+    from dmxctrlrunner import ShowRunner
+
+    if len(args.files) != 1:
+        print('Options --run and --play require single file', file=sys.stderr)
+        return 1
+
+    if args.speed <= 0:
+        print('Playback speed must be positive', file=sys.stderr)
+        return 1
+
+    if args.fps <= 0:
+        print('Frame rate must be positive', file=sys.stderr)
+        return 1
+
+    try:
+        runner = ShowRunner(args.files[0], args.control, args.fps, not args.no_output, args.record,
+                            args.speed, args.loop, args.start)
+    except Exception as ex:
+        print(ex, file=sys.stderr)
+        return 1
+
+    runner.run()
+
+    return 0
+
+
+def cmd_render(args):
+    """Расчёт кадров консоли без ожидания по часам (для проверки
+    запрограммированных последовательностей и замера скорости расчёта).
+    Результат записывается в файл в формате записи шоу, если указан
+    ключ --output."""
+
+    from dmxctrlrunner import ShowRunner, load_timed_commands
+
+    if len(args.files) != 1:
+        print('Option --render requires single console file', file=sys.stderr)
+        return 1
+
+    if args.duration is None or args.duration <= 0:
+        print('Option --render requires positive --duration', file=sys.stderr)
+        return 1
+
+    if args.fps <= 0:
+        print('Frame rate must be positive', file=sys.stderr)
+        return 1
+
+    try:
+        commands = load_timed_commands(args.commands) if args.commands else []
+
+        runner = ShowRunner(args.files[0], fps=args.fps, output=False)
+        nframes, elapsed = runner.render_offline(args.duration, commands, args.output)
+    except Exception as ex:
+        print(ex, file=sys.stderr)
+        return 1
+
+    print('%d frame(s) (%.1f s at %d fps) rendered in %.3f s, %.1f fps, %.1fx real time' % (nframes,
+        args.duration, args.fps, elapsed, nframes / elapsed if elapsed else 0.0,
+        args.duration / elapsed if elapsed else 0.0), file=sys.stderr)
+    print('Frame time: %s' % runner.engine.stats, file=sys.stderr)
+
+    return 0
+
+
+def main(args=None):
+    if args is None:
+        args = sys.argv[1:]
+
+    parser = argparse.ArgumentParser(prog='dmxctrl',
+        description='DMXCtrl command line mode. Run without options to start GUI.')
+
+    parser.add_argument('--compile', dest='command', action='store_const', const=cmd_compile,
+        help='compile console files into binary format')
+    parser.add_argument('--check', dest='command', action='store_const', const=cmd_check,
+        help='check console files, print results in JSON format')
+    parser.add_argument('--run', dest='command', action='store_const', const=cmd_run,
+        help='run console without GUI')
+    parser.add_argument('--play', dest='command', action='store_const', const=cmd_run,
+        help='play recorded show file without GUI')
+    parser.add_argument('--render', dest='command', action='store_const', const=cmd_render,
+        help='render console frames as fast as possible, report frame rate')
+    parser.add_argument('-o', '--output', help='output file name (for --compile and --render)')
+    parser.add_argument('-j', '--jobs', type=int, default=0,
+        help='number of parallel processes (for --check, default - number of CPUs)')
+    parser.add_argument('--strict', action='store_true',
+        help='treat overlapping channels as errors (for --check)')
+    parser.add_argument('--control', metavar='ADDRESS',
+        help='control socket for --run: TCP port, host:port or AF_UNIX socket path')
+    parser.add_argument('--fps', type=int, default=30,
+        help='frame rate for --run and --render (default - 30)')
+    parser.add_argument('--no-output', action='store_true',
+        help='do not send frames to DMX (for --run)')
+    parser.add_argument('--record', metavar='SHOWFILE',
+        help='record frames sent to DMX into file (for --run)')
+    parser.add_argument('--speed', type=float, default=1.0,
+        help='playback speed (for --play, default - 1.0)')
+    parser.add_argument('--loop', action='store_true',
+        help='loop playback (for --play)')
+    parser.add_argument('--start', type=float, default=0.0, metavar='SECONDS',
+        help='playback start position (for --play)')
+    parser.add_argument('--duration', type=float, metavar='SECONDS',
+        help='rendered time (for --render)')
+    parser.add_argument('--commands', metavar='FILE',
+        help='timed control commands (for --render)')
+    parser.add_argument('files', nargs='+', metavar='FILE', help='console file(s)')
+
+    args = parser.parse_args(args)
+
+    if args.command is None:
+        parser.error('no command specified')
+
+    return args.command(args)
+
+
+if __name__ == '__main__':
+    sys.exit(main())
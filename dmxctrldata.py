@@ -18,8 +18,11 @@
 
 
 import xml.sax
+import ast
 from colorsys import hls_to_rgb
 import os.path
+import pickle
+from hashlib import sha1
 
 
 # значения цветов для встроенной палитры и иконок
@@ -129,7 +132,14 @@ class Control():
                                   управляет присвоением значения атрибуту
                                   channel при загрузке файла описания
                                   консоли, если он не указан явно
-                                  (см. описание атрибута channel).
+                                  (см. описание атрибута channel);
+        SETS_CHANNEL_COUNTER    - булевское значение; если True -
+                                  явно указанное значение атрибута channel
+                                  изменяет счётчик каналов загрузчика
+                                  (DMXControls.curChannel); должно быть
+                                  False у контролов, которые ссылаются
+                                  на произвольные каналы, не занимая их
+                                  (напр. значения каналов в cue).
         Атрибуты, содержащие множества, должны дополняться или
         перекрываться в классе-потомке, прочие - должны перекрываться.
 
@@ -165,6 +175,7 @@ class Control():
     PARAMETERS = set()
     OPTIONS = {'channel', 'expand'}
     USE_PARENT_CHANNEL = False
+    SETS_CHANNEL_COUNTER = True
 
     def __init__(self):
         # конструкторы задают значения атрибутов по умолчанию,
@@ -187,6 +198,15 @@ class Control():
 
         return 0
 
+    def walk(self):
+        """Генератор, перебирающий рекурсивно сам контрол
+        и все вложенные в него контролы."""
+
+        yield self
+
+        for child in self.children:
+            yield from child.walk()
+
     def strAttrToInt(self, ns, vs, strict=True, minv=None, maxv=None):
         """Преобразование строкового значения атрибута в целое.
 
@@ -217,6 +237,21 @@ class Control():
 
         return v
 
+    def strAttrToFloat(self, ns, vs, minv=None, maxv=None):
+        """Преобразование строкового значения атрибута в вещественное.
+
+        Параметры такие же, как у метода strAttrToInt (кроме strict)."""
+
+        try:
+            v = float(vs)
+        except ValueError as ex:
+            raise ValueError('attribute "%s" must be number' % ns) from ex
+
+        if (minv is not None and v < minv) or (maxv is not None and v > maxv):
+            raise ValueError('attribute "%s" is out of range' % ns)
+
+        return v
+
     def strAttrToIntList(self, ns, vs, strict=True, minv=None, maxv=None):
         """Преобразование строкового значения атрибута в список целых.
 
@@ -233,7 +268,69 @@ class Control():
 
         return r
 
-    def strAttrToRGB(self, ns, vs):
+    def strAttrToChannelList(self, ns, vs):
+        """Преобразование строкового значения атрибута в список номеров
+        каналов.
+
+        Параметры:
+            ns      - строка,  имя атрибута (для отображения в сообщениях
+                      об ошибках);
+            vs      - строка, список номеров каналов и/или диапазонов
+                      номеров каналов в формате "первый-последний",
+                      разделённых пробелами, напр. "1-3 10 12-14".
+
+        Метод возвращает список целых."""
+
+        r = []
+
+        for vix, vss in enumerate(vs.split(None), 1):
+            nsi = '%s:%d' % (ns, vix)
+            first, sep, last = vss.partition('-')
+
+            first = self.strAttrToInt(nsi, first, True, 1, 512)
+            last = self.strAttrToInt(nsi, last, True, first, 512) if sep else first
+
+            r.extend(range(first, last + 1))
+
+        if not r:
+            raise ValueError('attribute "%s" must contain at least one channel' % ns)
+
+        return r
+
+    CURVES = ('linear', 'square', 'scurve', 'gamma')
+    DEFAULT_GAMMA = 2.2
+
+    def strAttrToCurve(self, ns, vs):
+        """Преобразование строкового значения атрибута, задающего
+        кривую преобразования значений канала.
+
+        Параметры:
+            ns      - строка,  имя атрибута (для отображения в сообщениях
+                      об ошибках);
+            vs      - строка, значение атрибута: одно из значений CURVES;
+                      для "gamma" может быть указан показатель -
+                      "gamma(2.8)", по умолчанию - DEFAULT_GAMMA.
+
+        Метод возвращает кортеж из строки - названия кривой,
+        и вещественного - параметра кривой (для кривых без параметров - 0)."""
+
+        vs = vs.lower().replace(' ', '')
+        name, sep, param = vs.partition('(')
+
+        name = self.strAttrToChoice(ns, name, self.CURVES)
+
+        if not sep:
+            return (name, self.DEFAULT_GAMMA if name == 'gamma' else 0.0)
+
+        if name != 'gamma':
+            raise ValueError('curve "%s" of attribute "%s" has no parameters' % (name, ns))
+
+        if not param.endswith(')'):
+            raise ValueError('invalid value of attribute "%s" - brackets are not closed' % ns)
+
+        return (name, self.strAttrToFloat(ns, param[:-1], minv=0.1, maxv=10.0))
+
+    def strAttrToRGB(self, ns, vs, maxv=255):
         """Преобразование строкового значения атрибута, задающего цвет,
         в список целых.
 
@@ -249,7 +346,9 @@ class Control():
                       4. цвет в формате hls(hue, lightness, saturation)",
                          где hue        - значение оттенка, 0..360;
                              lightness  - значение светлоты, 0..100;
-                             saturation - значение насыщенности, 0..100).
+                             saturation - значение насыщенности, 0..100);
+            maxv    - целое, максимальное значение для формата 1
+                      (напр. 65535 для 16-битных значений).
 
         Метод возвращает список из трёх целых."""
 
@@ -301,7 +400,7 @@ class Control():
             return [int(r * 255), int(g * 255), int(b * 255)]
         else:
             # список целых?
-            return self.strAttrToIntList(ns, vs, True, 0, 255)
+            return self.strAttrToIntList(ns, vs, True, 0, maxv)
 
     def strAttrToBool(self, ns, vs):
         """Преобразование строкового значения атрибута в булевское.
@@ -323,6 +422,24 @@ class Control():
             else:
                 raise ValueError('attribute "%s" must be boolean or integer' % ns)
 
+    def strAttrToChoice(self, ns, vs, choices):
+        """Проверка строкового значения атрибута на соответствие
+        одному из допустимых значений.
+
+        Параметры:
+            ns      - строка,  имя атрибута (для отображения в сообщениях
+                      об ошибках);
+            vs      - строка, значение атрибута;
+            choices - кортеж строк в нижнем регистре - допустимые значения.
+
+        Метод возвращает значение в нижнем регистре."""
+
+        vs = vs.lower()
+        if vs not in choices:
+            raise ValueError('attribute "%s" must be one of: %s' % (ns, ', '.join(choices)))
+
+        return vs
+
     def setParameter(self, ns, vs):
         """Установка значения атрибута экземпляра класса.
 
@@ -451,9 +568,56 @@ class Panel(Container):
 class Regulator(NamedControl):
     """Активный контрол - может менять значение в своём канале.
     Этот класс - базовый для прочих активных контролов, напрямую
-    не используется."""
+    не используется.
+
+    Атрибуты экземпляра класса (в дополнение к унаследованным):
+        merge       - строка, правило смешивания значений из разных
+                      источников (см. Source) в каналах контрола:
+                      "htp" - выбирается наибольшее значение,
+                      "ltp" - выбирается значение, изменённое последним;
+                      None - используется значение атрибута merge
+                      корневого элемента (DMXControls);
+                      по умолчанию - None;
+        intensity   - булевское значение; True, если каналы контрола
+                      управляют яркостью (и их значения масштабируются
+                      общим уровнем - grand master и т.п.);
+                      по умолчанию - значение атрибута класса
+                      INTENSITY;
+        curve       - кортеж (название, параметр) - кривая преобразования
+                      значений каналов контрола при выводе
+                      (см. Control.strAttrToCurve());
+                      по умолчанию - ('linear', 0.0)."""
 
     PARENTS = {'dmxcontrols', 'panel'}
+    OPTIONS = NamedControl.OPTIONS | {'merge', 'intensity', 'curve'}
+    INTENSITY = True
+
+    MERGE_RULES = ('htp', 'ltp')
+
+    def __init__(self):
+        super().__init__()
+
+        self.merge = None
+        self.intensity = self.INTENSITY
+        self.curve = ('linear', 0.0)
+
+    def getDefaultValues(self):
+        """Возвращает bytes - начальные значения каналов контрола
+        (те же, что задаёт соответствующий виджет UI при создании).
+
+        Метод должен быть перекрыт классом-потомком."""
+
+        return bytes(self.getNChannels())
+
+    def setParameter(self, ns, vs):
+        super().setParameter(ns, vs)
+
+        if ns == 'merge':
+            self.merge = self.strAttrToChoice(ns, vs, self.MERGE_RULES)
+        elif ns == 'intensity':
+            self.intensity = self.strAttrToBool(ns, vs)
+        elif ns == 'curve':
+            self.curve = self.strAttrToCurve(ns, vs)
 
 
 class Switch(Regulator):
@@ -473,12 +637,17 @@ class Switch(Regulator):
                       если vertical=True);
                       значения <=0, "*" или "auto" означают, что
                       кнопки будут расположены в одну строку или столбец
-                      без ограничения количества.
+                      без ограничения количества;
+        fade        - вещественное, время плавного перехода (в секундах)
+                      к значениям выбранной кнопки; используется для
+                      option, у которых не указан собственный атрибут fade;
+                      по умолчанию - 0 (значения устанавливаются сразу).
         Список значений для выбора (экземпляров SwitchOption) хранится
         в атрибуте children."""
 
     TAG = 'switch'
-    OPTIONS = Regulator.OPTIONS | {'vertical', 'active', 'nchannels', 'bpl'}
+    OPTIONS = Regulator.OPTIONS | {'vertical', 'active', 'nchannels', 'bpl', 'fade'}
+    INTENSITY = False
 
     def __init__(self):
         super().__init__()
@@ -487,10 +656,14 @@ class Switch(Regulator):
         self.active = 1
         self.nchannels = 1
         self.buttonsPerLine = 0
+        self.fade = 0.0
 
     def getNChannels(self):
         return self.nchannels
 
+    def getDefaultValues(self):
+        return bytes(self.children[self.active - 1].value)
+
     def setParameter(self, ns, vs):
         super().setParameter(ns, vs)
 
@@ -504,6 +677,8 @@ class Switch(Regulator):
             self.nchannels = self.strAttrToInt(ns, vs, minv=1, maxv=512)
         elif ns == 'bpl':
             self.buttonsPerLine = self.strAttrToInt(ns, vs, strict=False)
+        elif ns == 'fade':
+            self.fade = self.strAttrToFloat(ns, vs, minv=0.0)
 
     def checkParameters(self):
         lc = len(self.children)
@@ -514,6 +689,9 @@ class Switch(Regulator):
             if len(opt.value) != self.nchannels:
                 raise ValueError('option #%d has the wrong number of channel values in attribute "value"' % ixo)
 
+            if opt.fade is None:
+                opt.fade = self.fade
+
         if self.active > lc:
             raise ValueError('"active" value out of range')
 
@@ -531,23 +709,30 @@ class SwitchOption(NamedControl):
                     2. цвет (сохраняются значения для трёх каналов);
                        формат значения такой же, как у метода
                        strArgToRGB.
-                  значение по умолчанию - [0]."""
+                  значение по умолчанию - [0];
+        fade    - вещественное, время плавного перехода (в секундах)
+                  к значениям этой кнопки; если не указано - используется
+                  значение атрибута fade переключателя."""
 
     TAG = 'option'
     PARENTS = {'switch'}
     PARAMETERS = NamedControl.PARAMETERS | {'value'}
+    OPTIONS = NamedControl.OPTIONS | {'fade'}
     USE_PARENT_CHANNEL = True
 
     def __init__(self):
         super().__init__()
 
         self.value = [0]
+        self.fade = None
 
     def setParameter(self, ns, vs):
         super().setParameter(ns, vs)
 
         if ns == 'value':
             self.value = self.strAttrToRGB(ns, vs)
+        elif ns == 'fade':
+            self.fade = self.strAttrToFloat(ns, vs, minv=0.0)
 
 
 class Level(Regulator):
@@ -564,10 +749,25 @@ class Level(Regulator):
                       по умолчанию - 0;
         vertical    - булевское значение; если равно True -
                       движок вертикальный;
-                      значение по умолчанию - True."""
+                      значение по умолчанию - True;
+        fine        - булевское значение; если равно True - движок
+                      16-битный, занимает два канала (старший и младший
+                      байты значения), а value задаётся в диапазоне
+                      0..65535; задаётся атрибутами fine="true"
+                      или bits="16";
+                      значение по умолчанию - False;
+        slew        - вещественное, максимальная скорость изменения
+                      выводимых значений каналов (единиц 0..255
+                      в секунду, для 16-битного движка - в единицах
+                      старшего байта); 0 - без ограничения;
+                      по умолчанию - 0;
+        smooth      - вещественное, постоянная времени (в секундах)
+                      экспоненциального сглаживания выводимых значений;
+                      0 - без сглаживания;
+                      по умолчанию - 0."""
 
     TAG = 'level'
-    OPTIONS = Regulator.OPTIONS | {'value', 'steps', 'vertical'}
+    OPTIONS = Regulator.OPTIONS | {'value', 'steps', 'vertical', 'fine', 'bits', 'slew', 'smooth'}
 
     def __init__(self):
         super().__init__()
@@ -575,19 +775,54 @@ class Level(Regulator):
         self.value = 0
         self.steps = 0
         self.vertical = True
+        self.fine = False
+        self.slew = 0.0
+        self.smooth = 0.0
 
     def getNChannels(self):
-        return 1
+        return 2 if self.fine else 1
+
+    def getMaxValue(self):
+        """Возвращает максимальное значение движка."""
+
+        return 65535 if self.fine else 255
+
+    def getChannelValues(self, value):
+        """Возвращает bytes - значения каналов для положения движка value
+        (для 16-битного движка - старший и младший байты)."""
+
+        return value.to_bytes(self.getNChannels(), 'big')
+
+    def getDefaultValues(self):
+        return self.getChannelValues(self.value)
 
     def setParameter(self, ns, vs):
         super().setParameter(ns, vs)
 
         if ns == 'value':
-            self.value = self.strAttrToInt(ns, vs, minv=0, maxv=255)
+            # проверка максимального значения будет в методе checkParameters(),
+            # т.к. оно зависит от атрибута fine
+            self.value = self.strAttrToInt(ns, vs, minv=0, maxv=65535)
         elif ns == 'steps':
             self.steps = self.strAttrToInt(ns, vs, minv=0, maxv=32)
         elif ns == 'vertical':
             self.vertical = self.strAttrToBool(ns, vs)
+        elif ns == 'fine':
+            self.fine = self.strAttrToBool(ns, vs)
+        elif ns == 'bits':
+            bits = self.strAttrToInt(ns, vs)
+            if bits not in (8, 16):
+                raise ValueError('attribute "%s" must be 8 or 16' % ns)
+
+            self.fine = bits == 16
+        elif ns == 'slew':
+            self.slew = self.strAttrToFloat(ns, vs, minv=0.0)
+        elif ns == 'smooth':
+            self.smooth = self.strAttrToFloat(ns, vs, minv=0.0)
+
+    def checkParameters(self):
+        if self.value > self.getMaxValue():
+            raise ValueError('"value" out of range')
 
 
 class ColorLevel(Level):
@@ -599,7 +834,7 @@ class ColorLevel(Level):
                   в диапазоне 0..255."""
 
     TAG = 'colorlevel'
-    OPTIONS = Level.OPTIONS | {'color'}
+    OPTIONS = (Level.OPTIONS - {'fine', 'bits'}) | {'color'}
 
     def __init__(self):
         super().__init__()
@@ -609,6 +844,10 @@ class ColorLevel(Level):
     def getNChannels(self):
         return 3
 
+    def getDefaultValues(self):
+        # яркость цвета регулируется движком
+        return bytes(int(c / 255 * self.value) for c in self.color)
+
     def setParameter(self, ns, vs):
         super().setParameter(ns, vs)
 
@@ -616,191 +855,1680 @@ class ColorLevel(Level):
             self.color = self.strAttrToRGB(ns, vs)
 
 
-class DMXControls(Container, xml.sax.ContentHandler):
-    TAG = 'dmxcontrols'
-    OPTIONS = Container.OPTIONS | {'universe'}
+class Submaster(Level):
+    """Движок, масштабирующий значения группы каналов при выводе
+    (значения, заданные прочими контролами, умножаются на value/255).
+    Каналы сам не занимает.
 
-    class Error(ValueError):
-        def __init__(self, loader, msg):
-            super().__init__('Error at position %s of file "%s": %s' % (loader.getLocatorStr(), loader.filename, msg))
+    Атрибуты экземпляра класса (в дополнение к унаследованным от Level):
+        channels    - список целых, номера каналов группы, обязательный
+                      атрибут (формат см. в Control.strAttrToChannelList());
+        value       - по умолчанию - 255."""
 
-    class __StkItem():
-        def __init__(self, n, o):
-            super().__init__()
+    TAG = 'submaster'
+    PARAMETERS = Level.PARAMETERS | {'channels'}
+    OPTIONS = Level.OPTIONS - {'merge', 'intensity', 'curve', 'fine', 'bits', 'slew', 'smooth'}
+    SETS_CHANNEL_COUNTER = False
 
-            self.name = n
-            self.obj = o
+    def __init__(self):
+        super().__init__()
 
-        def __repr__(self):
-            return repr_to_str(self)
+        self.value = 255
+        self.channels = []
+
+    def getNChannels(self):
+        return 0
+
+    def setParameter(self, ns, vs):
+        super().setParameter(ns, vs)
 
-    def __init__(self, filename):
+        if ns == 'channels':
+            self.channels = self.strAttrToChannelList(ns, vs)
+
+
+class GroupLevel(Submaster):
+    """Движок группы каналов (см. Group): масштабирует значения каналов
+    группы (mode="scale", как Submaster) или прибавляет к ним значение
+    движка (mode="offset"). Номера каналов берутся из описания группы
+    при загрузке файла.
+
+    Атрибуты экземпляра класса (в дополнение к унаследованным от Submaster):
+        group       - строка, имя группы (элемента group, описанного
+                      в файле ранее), обязательный атрибут;
+        mode        - строка, одно из значений MODES;
+                      по умолчанию - "scale";
+        value       - по умолчанию - 255 для mode="scale"
+                      и 0 для mode="offset"."""
+
+    TAG = 'grouplevel'
+    PARAMETERS = Level.PARAMETERS | {'group'}
+    OPTIONS = Submaster.OPTIONS | {'mode'}
+
+    MODES = ('scale', 'offset')
+
+    def __init__(self):
         super().__init__()
-        xml.sax.ContentHandler.__init__(self)
 
-        self.filename = filename
-        self.universe = 1
-        self.channel = 1
+        self.value = None
+        self.group = None
+        self.mode = 'scale'
 
-        self.locator = None
-        self.stack = []
-        self.stackTop = None
-        self.curChannel = 1
+    def setParameter(self, ns, vs):
+        super().setParameter(ns, vs)
 
-        parser = xml.sax.make_parser()
-        parser.setContentHandler(self)
-        parser.parse(filename)
+        if ns == 'group':
+            self.group = vs
+        elif ns == 'mode':
+            self.mode = self.strAttrToChoice(ns, vs, self.MODES)
 
-    def getParent(self):
-        return self.stack[-2] if len(self.stack) >= 2 else None
+    def checkParameters(self):
+        if self.value is None:
+            self.value = 255 if self.mode == 'scale' else 0
 
-    def getStackStr(self):
-        return '/'.join(map(lambda i: i.name, self.stack))
+        super().checkParameters()
 
-    def setDocumentLocator(self, locator):
-        self.locator = locator
+        for ctrl in self.console.walk():
+            if isinstance(ctrl, Group) and ctrl.name == self.group:
+                self.channels = list(ctrl.channels)
+                break
+        else:
+            raise ValueError('group "%s" is not found' % self.group)
 
-    def getLocatorStr(self):
-        ss = self.getStackStr()
 
-        return '?' if not self.locator else '%d:%d%s' % (
-            self.locator.getLineNumber(),
-            self.locator.getColumnNumber(),
-            '' if not ss else ' (%s)' % ss)
+class Group(Control):
+    """Описание группы каналов для GroupLevel.
+
+    Каналы группы могут принадлежать разным контролам и приборам.
+    Группа должна быть описана в файле до ссылающихся на неё
+    элементов grouplevel.
+
+    Атрибуты экземпляра класса (в дополнение к унаследованным):
+        name        - строка, имя группы, обязательный атрибут;
+        channels    - список целых, номера каналов группы
+                      (формат см. в Control.strAttrToChannelList());
+        controls    - список строк, имена контролов (а также panel
+                      и fixture), все каналы которых входят в группу;
+                      контролы должны быть описаны в файле ранее;
+                      должен быть указан хотя бы один из атрибутов
+                      channels и controls.
+        После загрузки channels содержит отсортированный список номеров
+        всех каналов группы."""
+
+    TAG = 'group'
+    PARENTS = {'dmxcontrols'}
+    PARAMETERS = Control.PARAMETERS | {'name'}
+    OPTIONS = Control.OPTIONS | {'channels', 'controls'}
+    SETS_CHANNEL_COUNTER = False
 
-    CHILD_CLASSES = (Panel, Level, ColorLevel, Switch, SwitchOption)
+    def __init__(self):
+        super().__init__()
+
+        self.name = None
+        self.channels = []
+        self.controls = []
 
     def setParameter(self, ns, vs):
         super().setParameter(ns, vs)
 
-        if ns == 'universe':
-            self.universe = self.strAttrToInt(ns, vs)
-            if self.universe is None:
-                self.universe = 1
-            elif self.universe < 1:
-                raise self.Error('invalid universe value')
+        if ns == 'name':
+            self.name = vs
+        elif ns == 'channels':
+            self.channels = self.strAttrToChannelList(ns, vs)
+        elif ns == 'controls':
+            self.controls = vs.split(None)
 
-    def startElement(self, name, attributes):
-        self.stackTop = self.__StkItem(name, None)
-        self.stack.append(self.stackTop)
-        stackLen = len(self.stack)
-        #
-        #print(f'\033[32m%sstartElement({name})\033[0m' % (' ' * stackLen))
+    def checkParameters(self):
+        if not self.channels and not self.controls:
+            raise ValueError('attribute "channels" or "controls" must be specified')
+
+        channels = set(self.channels)
+        names = set(self.controls)
+        found = set()
+
+        for ctrl in self.console.walk():
+            name = getattr(ctrl, 'name', None)
+            if name in names and not isinstance(ctrl, Group):
+                found.add(name)
+
+                for c in ctrl.walk():
+                    if isinstance(c, Regulator) and not isinstance(c, Submaster):
+                        channels.update(range(c.channel, c.channel + c.getNChannels()))
+
+        if found != names:
+            raise ValueError('control(s) not found: %s' % ', '.join(sorted(names - found)))
+
+        self.channels = sorted(channels)
+
+
+class Derived(Control):
+    """Вычисляемый канал - значение канала рассчитывается по выражению
+    из значений других каналов и контролов (см. dmxctrlengine.DerivedStage).
+
+    Выражение - арифметическое выражение в синтаксисе Python, в котором
+    допускаются:
+        - числа;
+        - имена вида chN - значение канала N (0..255) после смешивания
+          источников, в т.ч. другого вычисляемого канала;
+        - имена контролов консоли, изменяющих значения каналов -
+          значение первого канала контрола;
+        - имена submaster'ов и движков групп - уровень движка;
+        - операции + - * / // % ** (** - см. power()), сравнения,
+          and, or, not,
+          условное выражение (a if условие else b);
+        - функции из EXPR_FUNCTIONS.
+    Результат округляется и ограничивается диапазоном 0..255.
 
-        def checkParent(parents):
-            if self.getParent().name not in parents:
-                pss = tuple(map(lambda v: '"%s"' % v, parents))
+    Атрибуты экземпляра класса (в дополнение к унаследованным):
+        channel     - целое, номер вычисляемого канала, обязательный
+                      атрибут;
+        expr        - строка, выражение, обязательный атрибут;
+        names       - список строк, имена каналов и контролов,
+                      используемых выражением (заполняется при проверке
+                      выражения)."""
+
+    TAG = 'derived'
+    PARENTS = {'dmxcontrols'}
+    PARAMETERS = Control.PARAMETERS | {'channel', 'expr'}
+    OPTIONS = set()
+    SETS_CHANNEL_COUNTER = False
+
+    EXPR_FUNCTIONS = {'min': min, 'max': max, 'abs': abs, 'round': round}
+
+    @staticmethod
+    def power(x, y):
+        """Операция ** в выражениях: рассчитывается в вещественных
+        числах, так что при переполнении генерирует OverflowError,
+        а не вычисляет сколь угодно большое целое."""
+
+        return float(x) ** y
+
+    # допустимые узлы дерева разбора выражения
+    EXPR_NODES = (ast.Expression, ast.BinOp, ast.UnaryOp, ast.BoolOp,
+        ast.Compare, ast.IfExp, ast.Call, ast.Name, ast.Constant, ast.Load,
+        ast.Add, ast.Sub, ast.Mult, ast.Div, ast.FloorDiv, ast.Mod, ast.Pow,
+        ast.UAdd, ast.USub, ast.Not, ast.And, ast.Or,
+        ast.Eq, ast.NotEq, ast.Lt, ast.LtE, ast.Gt, ast.GtE)
 
-                psa = pss[-1]
+    def __init__(self):
+        super().__init__()
 
-                if len(pss) >= 2:
-                    psa = '%s or %s' % (', '.join(pss[:-1]), psa)
+        self.expr = None
+        self.names = []
 
-                raise self.Error(self, '"%s" must be child of %s' % (name, psa))
+    @staticmethod
+    def channelNumber(name):
+        """Возвращает номер канала для имени вида chN или None."""
 
-        def checkSetAttributes():
-            try:
-                extra = set(attributes.keys()) - set(self.stackTop.obj.PARAMETERS | self.stackTop.obj.OPTIONS)
-                if extra:
-                    raise Exception('unsupported parameter(s) - %s' % (', '.join(map(lambda v: '"%s"' % v, extra))))
+        return int(name[2:]) if name.startswith('ch') and name[2:].isdigit() else None
 
-                # обязательные параметры
-                for pname in self.stackTop.obj.PARAMETERS:
-                    pval = attributes.get(pname, None)
-                    if pval is None:
-                        raise Exception('required parameter "%s" is missing' % pname)
+    def parseExpression(self):
+        """Разбор и проверка выражения.
+        Возвращает экземпляр ast.Expression.
+        В случае ошибок генерирует ValueError."""
 
-                    #print('%s parameter: %s=%s' % (name, pname, pval))
-                    self.stackTop.obj.setParameter(pname, pval)
+        try:
+            tree = ast.parse(self.expr.strip(), mode='eval')
+        except SyntaxError as ex:
+            raise ValueError('invalid expression "%s": %s' % (self.expr, ex.msg))
 
-                # необязательные параметры
-                for pname in self.stackTop.obj.OPTIONS:
-                    pval = attributes.get(pname, None)
+        for node in ast.walk(tree):
+            if not isinstance(node, self.EXPR_NODES):
+                raise ValueError('unsupported element "%s" in expression "%s"' % (type(node).__name__, self.expr))
 
-                    if pval is not None:
-                        #print('%s option: %s=%s' % (name, pname, pval))
-                        self.stackTop.obj.setParameter(pname, pval)
+            if isinstance(node, ast.Constant) and type(node.value) not in (int, float):
+                raise ValueError('unsupported constant %r in expression "%s"' % (node.value, self.expr))
 
-                # принудительная установка атрибута "channel" при необходимости
-                if self.stackTop.obj.channel is not None:
-                    # если канал задан явно - меняем значение глобального атрибута
-                    self.curChannel = self.stackTop.obj.channel
-                else:
-                    # иначе - задаём атрибут "channel" текущему объекту
-                    # принудительно
-                    if self.stackTop.obj.USE_PARENT_CHANNEL:
-                        prnt = self.getParent()
+            if isinstance(node, ast.Call):
+                if not isinstance(node.func, ast.Name) or node.func.id not in self.EXPR_FUNCTIONS or node.keywords:
+                    raise ValueError('unsupported function call in expression "%s"' % self.expr)
 
-                        self.stackTop.obj.channel = prnt.obj.channel if prnt else self.curChannel
-                    else:
-                        self.stackTop.obj.channel = self.curChannel
+        return tree
 
-                if isinstance(self.stackTop.obj, Regulator):
-                    # глобальный счётчик изменяют только активные контролы,
-                    # т.к. контейнеры сами каналов не занимают, только
-                    # хранят начальное значение канала для вложенных контролов
-                    self.curChannel += self.stackTop.obj.getNChannels()
+    def setParameter(self, ns, vs):
+        super().setParameter(ns, vs)
 
-            except Exception as ex:
-                raise self.Error(self, str(ex)) from ex
+        if ns == 'expr':
+            self.expr = vs
 
-        if stackLen == 1:
-            # вот таким тупым способом проверяем формат файла
-            if name != self.TAG:
-                raise self.Error(self, 'invalid root tag - file is not a DMXControls file')
+    def checkParameters(self):
+        tree = self.parseExpression()
 
-            self.stackTop.obj = self
-            checkSetAttributes()
-        else:
-            # служебные тэги
-            if name == 'br':
-                self.getParent().obj.comments.append('\n')
-            # тэги контролов
-            else:
-                isValidClass = False
+        names = []
+        funcs = set(node.func for node in ast.walk(tree) if isinstance(node, ast.Call))
 
-                for cclass in self.CHILD_CLASSES:
-                    if name == cclass.TAG:
-                        checkParent(cclass.PARENTS)
+        for node in ast.walk(tree):
+            if isinstance(node, ast.Name) and node not in funcs and node.id not in names:
+                channel = self.channelNumber(node.id)
+                if channel is not None and not 1 <= channel <= 512:
+                    raise ValueError('channel number out of range in expression "%s"' % self.expr)
 
-                        self.stackTop.obj = cclass()
-                        self.stackTop.obj.console = self
+                names.append(node.id)
 
-                        checkSetAttributes()
+        self.names = names
 
-                        oparent = self.getParent()
-                        oparent.obj.children.append(self.stackTop.obj)
 
-                        isValidClass = True
-                        break
+class ControlReferenceError(ValueError):
+    """Ошибка в ссылке контрола на другие элементы консоли (по имени
+    или номеру канала), обнаруженная после загрузки всего файла.
 
-                if not isValidClass:
-                    raise self.Error(self, 'unsupported tag "%s"' % name)
+    Атрибуты экземпляра класса:
+        control - экземпляр Control, в описании которого ошибка."""
 
-    def endElement(self, name):
-        #
-        self.stackTop = self.stack.pop() if self.stack else None
+    def __init__(self, control, msg):
+        super().__init__(msg)
 
-        #indent = '  ' * len(self.stack)
-        #print(f'\033[32m%sendElement({name}): %s\033[0m' % (
-        #      indent,
-        #      self.stackTop))
-        if self.stackTop.obj:
-            try:
-                self.stackTop.obj.checkParameters()
-            except Exception as ex:
-                raise self.Error(self, str(ex)) from ex
+        self.control = control
 
 
-    def characters(self, s):
-        s = s.strip()
-        if not s:
+def resolve_derived(console):
+    """Разрешение имён в выражениях вычисляемых каналов консоли console
+    (экземпляра DMXControls) и упорядочивание выражений по зависимостям:
+    выражение, использующее вычисляемый канал, рассчитывается после него.
+
+    Возвращает список кортежей (ctrl, inputs) в порядке расчёта, где
+    ctrl - экземпляр Derived, inputs - список входов выражения в порядке
+    ctrl.names: целых (номеров каналов) или экземпляров Submaster
+    (уровень движка).
+    В случае ошибок генерирует ControlReferenceError."""
+
+    derived = dict()
+    names = dict()
+
+    for ctrl in console.walk():
+        if isinstance(ctrl, Derived):
+            if ctrl.channel in derived:
+                raise ControlReferenceError(ctrl, 'derived channel %d is defined more than once' % ctrl.channel)
+
+            derived[ctrl.channel] = ctrl
+        elif isinstance(ctrl, Regulator) and getattr(ctrl, 'name', None):
+            if isinstance(ctrl, Submaster):
+                names.setdefault(ctrl.name, []).append(ctrl)
+            elif ctrl.getNChannels():
+                names.setdefault(ctrl.name, []).append(ctrl.channel)
+
+    if not derived:
+        return []
+
+    def __input(d, name):
+        channel = d.channelNumber(name)
+        if channel is not None:
+            return channel
+
+        refs = names.get(name)
+        if refs is None:
+            raise ControlReferenceError(d, 'expression "%s": control "%s" is not found' % (d.expr, name))
+
+        if len(refs) > 1:
+            raise ControlReferenceError(d, 'expression "%s": control name "%s" is ambiguous' % (d.expr, name))
+
+        return refs[0]
+
+    inputs = {channel: [__input(d, name) for name in d.names] for channel, d in derived.items()}
+
+    order = []
+    state = dict() # 1 - обрабатывается, 2 - обработан
+
+    def __visit(channel, path):
+        st = state.get(channel)
+        if st == 2:
             return
 
-        if self.stackTop and self.stackTop.obj:
-            self.stackTop.obj.comments.append(s)
-        else:
-            self.comments.append(s)
+        if st == 1:
+            raise ControlReferenceError(derived[channel], 'derived channels %s depend on each other' % ' -> '.join(map(str, path + [channel])))
+
+        state[channel] = 1
+        for src in inputs[channel]:
+            if src in derived:
+                __visit(src, path + [channel])
+
+        state[channel] = 2
+        order.append(channel)
+
+    for channel in sorted(derived):
+        __visit(channel, [])
+
+    return [(derived[channel], inputs[channel]) for channel in order]
+
+
+class CueList(NamedControl):
+    """Список (стек) сцен - "cue" - с кнопками перехода к следующей
+    (GO) и предыдущей (BACK) сцене и приостановки перехода (PAUSE).
+
+    Сцены (экземпляры Cue) хранятся в атрибуте children.
+    Переходы между сценами выполняются плавно, на каждом кадре вывода
+    (см. dmxctrlengine.CueStack).
+
+    Атрибуты экземпляра класса (в дополнение к унаследованным):
+        fadein      - вещественное, время (в секундах) нарастания уровней
+                      каналов при переходе к сцене; используется для
+                      сцен, у которых не указан собственный атрибут fadein;
+                      по умолчанию - 0;
+        fadeout     - вещественное, время (в секундах) спада уровней
+                      каналов; используется аналогично fadein;
+                      по умолчанию - 0;
+        loop        - булевское значение; если True - после последней
+                      сцены кнопка GO переключает на первую;
+                      по умолчанию - False;
+        vertical    - булевское значение; если True - кнопки
+                      расположены вертикально;
+                      по умолчанию - False."""
+
+    TAG = 'cuelist'
+    PARENTS = {'dmxcontrols', 'panel'}
+    OPTIONS = NamedControl.OPTIONS | {'fadein', 'fadeout', 'loop', 'vertical'}
+    SETS_CHANNEL_COUNTER = False
+
+    def __init__(self):
+        super().__init__()
+
+        self.fadein = 0.0
+        self.fadeout = 0.0
+        self.loop = False
+        self.vertical = False
+
+    def setParameter(self, ns, vs):
+        super().setParameter(ns, vs)
+
+        if ns == 'fadein':
+            self.fadein = self.strAttrToFloat(ns, vs, minv=0.0)
+        elif ns == 'fadeout':
+            self.fadeout = self.strAttrToFloat(ns, vs, minv=0.0)
+        elif ns == 'loop':
+            self.loop = self.strAttrToBool(ns, vs)
+        elif ns == 'vertical':
+            self.vertical = self.strAttrToBool(ns, vs)
+
+    def checkParameters(self):
+        if not self.children:
+            raise ValueError('%s must contain at least one cue' % self.__class__.__name__)
+
+
+class Chase(CueList):
+    """Чейз - циклическое переключение шагов (сцен) с заданным темпом.
+    В UI отображается кнопками запуска/остановки и "tap tempo".
+
+    Шаги - элементы cue (экземпляры Cue) - хранятся в атрибуте children,
+    собственные атрибуты fadein и fadeout шагов не используются.
+    Переключение шагов выполняется по часам вывода кадров
+    (см. dmxctrlengine.ChaseStack).
+
+    Атрибуты экземпляра класса (в дополнение к унаследованным от
+    NamedControl):
+        bpm         - вещественное, темп - количество шагов в минуту
+                      (MIN_BPM..MAX_BPM); по умолчанию - 120;
+        xfade       - вещественное, время перехода между шагами в процентах
+                      от длительности шага (0..100); по умолчанию - 0;
+        direction   - строка, порядок шагов, одно из значений
+                      DIRECTIONS: "forward" - по порядку, "backward" -
+                      в обратном порядке, "bounce" - вперёд и назад,
+                      "random" - в случайном порядке;
+                      по умолчанию - "forward";
+        active      - булевское значение, True, если чейз запускается
+                      при загрузке консоли; по умолчанию - False;
+        vertical    - см. CueList."""
+
+    TAG = 'chase'
+    OPTIONS = NamedControl.OPTIONS | {'bpm', 'xfade', 'direction', 'active', 'vertical'}
+
+    DIRECTIONS = ('forward', 'backward', 'bounce', 'random')
+    MIN_BPM = 1.0
+    MAX_BPM = 1200.0
+
+    def __init__(self):
+        super().__init__()
+
+        # шаги чейза переключаются по кругу
+        self.loop = True
+
+        self.bpm = 120.0
+        self.xfade = 0.0
+        self.direction = 'forward'
+        self.active = False
+
+    def setParameter(self, ns, vs):
+        super().setParameter(ns, vs)
+
+        if ns == 'bpm':
+            self.bpm = self.strAttrToFloat(ns, vs, minv=self.MIN_BPM, maxv=self.MAX_BPM)
+        elif ns == 'xfade':
+            self.xfade = self.strAttrToFloat(ns, vs, minv=0.0, maxv=100.0)
+        elif ns == 'direction':
+            self.direction = self.strAttrToChoice(ns, vs, self.DIRECTIONS)
+        elif ns == 'active':
+            self.active = self.strAttrToBool(ns, vs)
+
+
+class Cue(NamedControl):
+    """Сцена для CueList (или шаг Chase) - набор значений каналов.
+
+    Значения каналов (экземпляры CueValue) хранятся в атрибуте children;
+    каналы, значения которых не указаны, при переходе к сцене
+    получают значение 0.
+
+    Атрибуты экземпляра класса (в дополнение к унаследованным):
+        fadein, fadeout - вещественные, время нарастания и спада уровней
+                      каналов в секундах; если не указаны (None) -
+                      используются значения атрибутов родительского
+                      CueList."""
+
+    TAG = 'cue'
+    PARENTS = {'cuelist', 'chase'}
+    OPTIONS = NamedControl.OPTIONS | {'fadein', 'fadeout'}
+    SETS_CHANNEL_COUNTER = False
+
+    def __init__(self):
+        super().__init__()
+
+        self.fadein = None
+        self.fadeout = None
+
+    def setParameter(self, ns, vs):
+        super().setParameter(ns, vs)
+
+        if ns == 'fadein':
+            self.fadein = self.strAttrToFloat(ns, vs, minv=0.0)
+        elif ns == 'fadeout':
+            self.fadeout = self.strAttrToFloat(ns, vs, minv=0.0)
+
+
+class CueValue(Control):
+    """Значения каналов для Cue.
+
+    Атрибуты экземпляра класса (в дополнение к унаследованным):
+        channel - целое, номер первого канала, обязательный атрибут;
+        value   - список из одного и более целых - значения для каналов,
+                  начиная с channel; формат такой же, как у атрибута
+                  SwitchOption.value;
+        fine    - булевское значение; если равно True - значения
+                  16-битные (0..65535), и каждое занимает два канала
+                  (старший и младший байты); после проверки атрибутов
+                  value содержит уже значения байтов;
+                  значение по умолчанию - False."""
+
+    TAG = 'set'
+    PARENTS = {'cue'}
+    PARAMETERS = Control.PARAMETERS | {'channel', 'value'}
+    OPTIONS = Control.OPTIONS | {'fine'}
+    SETS_CHANNEL_COUNTER = False
+
+    def __init__(self):
+        super().__init__()
+
+        self.value = [0]
+        self.fine = False
+
+    def setParameter(self, ns, vs):
+        super().setParameter(ns, vs)
+
+        if ns == 'value':
+            # проверка максимального значения будет в методе checkParameters(),
+            # т.к. оно зависит от атрибута fine
+            self.value = self.strAttrToRGB(ns, vs, 65535)
+        elif ns == 'fine':
+            self.fine = self.strAttrToBool(ns, vs)
+
+    def checkParameters(self):
+        if self.fine:
+            self.value = list(b''.join(map(lambda v: v.to_bytes(2, 'big'), self.value)))
+        elif max(self.value) > 255:
+            raise ValueError('"value" out of range')
+
+        if self.channel + len(self.value) - 1 > 512:
+            raise ValueError('too many values for channel %d' % self.channel)
+
+
+class Effect(NamedControl):
+    """Генератор эффекта - периодического изменения значений в группе
+    каналов или в нескольких одинаковых "приборах" (напр. нескольких
+    ColorLevel). В UI отображается кнопкой включения/выключения.
+
+    Каналы сам не занимает - значения в каналах, начиная с channel,
+    задаются другими контролами, Effect только изменяет их при выводе.
+
+    Атрибуты экземпляра класса (в дополнение к унаследованным):
+        channel - целое, номер первого канала первого прибора,
+                  обязательный атрибут;
+        wave    - строка, форма волны, одно из значений EFFECT_WAVES;
+                  по умолчанию - "sine";
+        mode    - строка, способ изменения значений каналов:
+                  "scale" - значения, заданные другими контролами,
+                            умножаются на значение волны;
+                  "set"   - значения заменяются на значение волны;
+                  по умолчанию - "scale";
+        rate    - вещественное, частота (в герцах), по умолчанию - 1.0;
+        spread  - вещественное, разность фаз (в градусах), равномерно
+                  распределяемая между приборами; при значении 360
+                  фазы приборов равномерно распределены по периоду;
+                  по умолчанию - 0;
+        size    - целое, размах (0..255), по умолчанию - 255;
+        offset  - целое, минимальное значение для mode="set" (0..255),
+                  по умолчанию - 0;
+        count   - целое, количество приборов, по умолчанию - 1;
+        width   - целое, количество каналов одного прибора
+                  (напр. 3 для ColorLevel), по умолчанию - 1;
+        stride  - целое, разность номеров первых каналов соседних
+                  приборов; по умолчанию равно width;
+        active  - булевское значение, True, если эффект включен
+                  при загрузке консоли; по умолчанию - False."""
+
+    TAG = 'effect'
+    PARENTS = {'dmxcontrols', 'panel'}
+    PARAMETERS = NamedControl.PARAMETERS | {'channel'}
+    OPTIONS = NamedControl.OPTIONS | {'wave', 'mode', 'rate', 'spread',
+        'size', 'offset', 'count', 'width', 'stride', 'active'}
+    SETS_CHANNEL_COUNTER = False
+
+    EFFECT_WAVES = ('sine', 'ramp', 'square', 'random')
+    EFFECT_MODES = ('scale', 'set')
+
+    def __init__(self):
+        super().__init__()
+
+        self.wave = 'sine'
+        self.mode = 'scale'
+        self.rate = 1.0
+        self.spread = 0.0
+        self.size = 255
+        self.offset = 0
+        self.count = 1
+        self.width = 1
+        self.stride = None
+        self.active = False
+
+    def setParameter(self, ns, vs):
+        super().setParameter(ns, vs)
+
+        if ns == 'wave':
+            self.wave = self.strAttrToChoice(ns, vs, self.EFFECT_WAVES)
+        elif ns == 'mode':
+            self.mode = self.strAttrToChoice(ns, vs, self.EFFECT_MODES)
+        elif ns == 'rate':
+            self.rate = self.strAttrToFloat(ns, vs, minv=0.0, maxv=50.0)
+        elif ns == 'spread':
+            self.spread = self.strAttrToFloat(ns, vs)
+        elif ns == 'size':
+            self.size = self.strAttrToInt(ns, vs, minv=0, maxv=255)
+        elif ns == 'offset':
+            self.offset = self.strAttrToInt(ns, vs, minv=0, maxv=255)
+        elif ns == 'count':
+            self.count = self.strAttrToInt(ns, vs, minv=1, maxv=512)
+        elif ns == 'width':
+            self.width = self.strAttrToInt(ns, vs, minv=1, maxv=512)
+        elif ns == 'stride':
+            self.stride = self.strAttrToInt(ns, vs, minv=1, maxv=512)
+        elif ns == 'active':
+            self.active = self.strAttrToBool(ns, vs)
+
+    def checkParameters(self):
+        if self.stride is None:
+            self.stride = self.width
+        elif self.stride < self.width:
+            raise ValueError('"stride" must not be less than "width"')
+
+        if self.channel + self.stride * (self.count - 1) + self.width - 1 > 512:
+            raise ValueError('effect channels are out of range')
+
+
+class Timeline(NamedControl):
+    """Последовательность событий, выполняемых в заданные моменты
+    времени от начала воспроизведения: установка значений каналов,
+    плавные переходы, управление сценами и эффектами
+    (см. dmxctrlengine.TimelineSequencer). В UI отображается кнопкой
+    запуска/остановки.
+
+    События задаются вложенными элементами event и/или текстовым
+    файлом (атрибут file), в каждой строке которого - одно событие:
+        <время> set <канал> <значение> [<значение>...]
+        <время> fade <длительность> <канал> <значение> [<значение>...]
+        <время> go|back|pause <имя cuelist>
+        <время> effect <имя effect> on|off
+    Пустые строки и строки, начинающиеся с "#", пропускаются.
+
+    Атрибуты экземпляра класса (в дополнение к унаследованным):
+        file    - строка, путь к файлу событий или None;
+                  путь, начинающийся с "@", отсчитывается от каталога
+                  файла описания консоли;
+        loop    - булевское значение; если True - по окончании
+                  воспроизведение начинается сначала;
+                  по умолчанию - False;
+        length  - вещественное, длительность в секундах; если не указана
+                  (None) - равна времени последнего события;
+        active  - булевское значение, True, если воспроизведение
+                  начинается при загрузке консоли; по умолчанию - False;
+        events  - список событий, упорядоченный по времени, заполняется
+                  методом checkParameters(); событие - кортеж из шести
+                  элементов (время, действие, номер канала, список
+                  значений, длительность перехода, имя cuelist/effect),
+                  для действия "effect" список значений - [1] для
+                  включения или [0] для выключения.
+
+    После проверки параметров вложенные элементы event удаляются -
+    события хранятся только в атрибуте events."""
+
+    TAG = 'timeline'
+    PARENTS = {'dmxcontrols', 'panel'}
+    OPTIONS = NamedControl.OPTIONS | {'file', 'loop', 'length', 'active'}
+    SETS_CHANNEL_COUNTER = False
+
+    def __init__(self):
+        super().__init__()
+
+        self.file = None
+        self.loop = False
+        self.length = None
+        self.active = False
+        self.events = []
+
+    def setParameter(self, ns, vs):
+        super().setParameter(ns, vs)
+
+        if ns == 'file':
+            if vs.startswith('@'):
+                self.file = os.path.join(os.path.split(self.console.filename)[0], vs[1:])
+            else:
+                self.file = os.path.abspath(os.path.expanduser(vs))
+        elif ns == 'loop':
+            self.loop = self.strAttrToBool(ns, vs)
+        elif ns == 'length':
+            self.length = self.strAttrToFloat(ns, vs, minv=0.0)
+        elif ns == 'active':
+            self.active = self.strAttrToBool(ns, vs)
+
+    def loadEvents(self, filename):
+        """Загрузка событий из текстового файла filename.
+        Возвращает список событий (см. атрибут events)."""
+
+        events = []
+
+        with open(filename, 'r', encoding='utf-8') as f:
+            for lineno, line in enumerate(f, 1):
+                words = line.split()
+                if not words or words[0].startswith('#'):
+                    continue
+
+                try:
+                    events.append(self.wordsToEvent(words))
+                except ValueError as ex:
+                    raise ValueError('%s:%d: %s' % (filename, lineno, ex)) from ex
+
+        return events
+
+    def wordsToEvent(self, words):
+        """Преобразование строки файла событий, разбитой на слова,
+        в событие (см. атрибут events)."""
+
+        if len(words) < 2:
+            raise ValueError('time and action expected')
+
+        t = self.strAttrToFloat('time', words[0], minv=0.0)
+        action = self.strAttrToChoice('action', words[1], TimelineEvent.ACTIONS)
+        args = words[2:]
+
+        fade = 0.0
+        if action == 'fade':
+            if not args:
+                raise ValueError('fade time expected')
+
+            fade = self.strAttrToFloat('fade', args[0], minv=0.0)
+            args = args[1:]
+
+        if action in ('set', 'fade'):
+            if len(args) < 2:
+                raise ValueError('channel and value(s) expected')
+
+            channel = self.strAttrToInt('channel', args[0], minv=1, maxv=512)
+            value = [self.strAttrToInt('value', v, minv=0, maxv=255) for v in args[1:]]
+
+            if channel + len(value) - 1 > 512:
+                raise ValueError('too many values for channel %d' % channel)
+
+            return (t, action, channel, value, fade, None)
+
+        if not args:
+            raise ValueError('name expected')
+
+        if action == 'effect':
+            if len(args) < 2:
+                raise ValueError('effect name and "on" or "off" expected')
+
+            return (t, action, None, [int(self.strAttrToChoice('effect', args[-1], ('off', 'on')) == 'on')],
+                    0.0, ' '.join(args[:-1]))
+
+        return (t, action, None, [], 0.0, ' '.join(args))
+
+    def checkParameters(self):
+        events = [ev.getEvent() for ev in self.children]
+
+        if self.file:
+            events += self.loadEvents(self.file)
+
+        # сортировка устойчивая - события с одинаковым временем
+        # выполняются в порядке их описания
+        events.sort(key=lambda e: e[0])
+
+        self.events = events
+        self.children = []
+
+        if not self.events:
+            raise ValueError('%s must contain at least one event' % self.__class__.__name__)
+
+        if self.length is None:
+            self.length = self.events[-1][0]
+
+
+class TimelineEvent(Control):
+    """Событие Timeline.
+
+    Атрибуты экземпляра класса (в дополнение к унаследованным):
+        time    - вещественное, время в секундах от начала
+                  воспроизведения Timeline, обязательный атрибут;
+        action  - строка, действие, одно из значений ACTIONS,
+                  обязательный атрибут:
+                  "set"     - установка значений каналов;
+                  "fade"    - плавный переход значений каналов;
+                  "go", "back", "pause" - управление CueList;
+                  "effect"  - включение или выключение Effect;
+        channel - целое, номер первого канала (для set и fade);
+        value   - список целых - значения для каналов, начиная
+                  с channel; формат такой же, как у атрибута
+                  SwitchOption.value (для set и fade);
+        fade    - вещественное, время перехода в секундах (для fade);
+        target  - строка, имя CueList или Effect;
+        active  - булевское значение (для effect), True для включения
+                  эффекта; по умолчанию - True."""
+
+    TAG = 'event'
+    PARENTS = {'timeline'}
+    PARAMETERS = Control.PARAMETERS | {'time', 'action'}
+    OPTIONS = Control.OPTIONS | {'value', 'fade', 'target', 'active'}
+    SETS_CHANNEL_COUNTER = False
+
+    ACTIONS = ('set', 'fade', 'go', 'back', 'pause', 'effect')
+
+    def __init__(self):
+        super().__init__()
+
+        self.time = 0.0
+        self.action = None
+        self.value = None
+        self.fade = 0.0
+        self.target = None
+        self.active = True
+
+    def setParameter(self, ns, vs):
+        super().setParameter(ns, vs)
+
+        if ns == 'time':
+            self.time = self.strAttrToFloat(ns, vs, minv=0.0)
+        elif ns == 'action':
+            self.action = self.strAttrToChoice(ns, vs, self.ACTIONS)
+        elif ns == 'value':
+            self.value = self.strAttrToRGB(ns, vs)
+        elif ns == 'fade':
+            self.fade = self.strAttrToFloat(ns, vs, minv=0.0)
+        elif ns == 'target':
+            self.target = vs.strip()
+        elif ns == 'active':
+            self.active = self.strAttrToBool(ns, vs)
+
+    def checkParameters(self):
+        if self.action in ('set', 'fade'):
+            if self.value is None:
+                raise ValueError('attribute "value" is required for "%s" action' % self.action)
+
+            if self.channel + len(self.value) - 1 > 512:
+                raise ValueError('too many values for channel %d' % self.channel)
+        elif not self.target:
+            raise ValueError('attribute "target" is required for "%s" action' % self.action)
+
+    def getEvent(self):
+        """Возвращает событие в формате Timeline.events."""
+
+        if self.action in ('set', 'fade'):
+            return (self.time, self.action, self.channel, self.value,
+                    self.fade if self.action == 'fade' else 0.0, None)
+
+        return (self.time, self.action, None,
+                [int(self.active)] if self.action == 'effect' else [], 0.0, self.target)
+
+
+def resolve_timelines(console):
+    """Проверка ссылок событий Timeline консоли console (экземпляра
+    DMXControls) на элементы cuelist, chase и effect по именам.
+    В случае ошибок генерирует ControlReferenceError."""
+
+    cueLists = set()
+    effects = set()
+    timelines = []
+
+    for ctrl in console.walk():
+        if isinstance(ctrl, CueList):
+            cueLists.add(ctrl.name)
+        elif isinstance(ctrl, Effect):
+            effects.add(ctrl.name)
+        elif isinstance(ctrl, Timeline):
+            timelines.append(ctrl)
+
+    for tl in timelines:
+        for t, action, channel, value, fade, target in tl.events:
+            if action in ('go', 'back', 'pause') and target not in cueLists:
+                raise ControlReferenceError(tl, 'timeline "%s": cuelist "%s" is not found' % (tl.name, target))
+            elif action == 'effect' and target not in effects:
+                raise ControlReferenceError(tl, 'timeline "%s": effect "%s" is not found' % (tl.name, target))
+
+
+class Source(Control):
+    """Параметры источника значений каналов.
+
+    Значения каналов, задаваемые разными источниками (контролами UI,
+    сценами, эффектами и т.д.), смешиваются при выводе: сначала
+    выбираются источники с наибольшим приоритетом, из их значений -
+    наибольшее (HTP) или изменённое последним (LTP), в зависимости
+    от правила, заданного для канала (см. Regulator.merge).
+
+    Атрибуты экземпляра класса (в дополнение к унаследованным):
+        name        - строка, имя источника, одно из значений
+                      SOURCE_NAMES, обязательный атрибут:
+                      "ui"      - контролы UI;
+                      "cues"    - сцены (CueList);
+                      "effects" - эффекты (Effect) с mode="set";
+                      "remote"  - внешние программы;
+                      "timeline" - события Timeline;
+                      "scene"   - сцены из библиотеки сцен
+                                  (см. dmxctrlscenes);
+                      "input"   - вход DMX (universe задаётся атрибутом
+                                  universe);
+        priority    - целое, приоритет источника (0..255);
+                      по умолчанию - DEFAULT_PRIORITY;
+        universe    - целое, номер universe для источника "input";
+                      если не указан - вход DMX не используется."""
+
+    TAG = 'source'
+    PARENTS = {'dmxcontrols'}
+    PARAMETERS = Control.PARAMETERS | {'name'}
+    OPTIONS = Control.OPTIONS | {'priority', 'universe'}
+    SETS_CHANNEL_COUNTER = False
+
+    SOURCE_NAMES = ('ui', 'cues', 'effects', 'remote', 'input', 'timeline', 'scene')
+    DEFAULT_PRIORITY = 100
+
+    def __init__(self):
+        super().__init__()
+
+        self.name = None
+        self.priority = self.DEFAULT_PRIORITY
+        self.universe = None
+
+    def setParameter(self, ns, vs):
+        super().setParameter(ns, vs)
+
+        if ns == 'name':
+            self.name = self.strAttrToChoice(ns, vs, self.SOURCE_NAMES)
+        elif ns == 'priority':
+            self.priority = self.strAttrToInt(ns, vs, minv=0, maxv=255)
+        elif ns == 'universe':
+            self.universe = self.strAttrToInt(ns, vs, minv=1)
+
+    def checkParameters(self):
+        if self.universe is not None and self.name != 'input':
+            raise ValueError('attribute "universe" is supported only by "input" source')
+
+
+class Patch(Control):
+    """Таблица коммутации (patch) - соответствие логических номеров
+    каналов (указываемых в атрибутах channel контролов) физическим
+    адресам каналов и universe.
+
+    Содержит элементы PatchMap. Логические каналы, для которых
+    соответствие не задано, выводятся в каналы с теми же номерами
+    universe консоли (если эти физические каналы не заняты
+    элементами PatchMap)."""
+
+    TAG = 'patch'
+    PARENTS = {'dmxcontrols'}
+    OPTIONS = set()
+    SETS_CHANNEL_COUNTER = False
+
+
+class PatchMap(Control):
+    """Элемент таблицы коммутации.
+
+    Атрибуты экземпляра класса (в дополнение к унаследованным):
+        channel     - целое, номер первого логического канала,
+                      обязательный атрибут;
+        address     - целое, номер первого физического канала,
+                      обязательный атрибут;
+        universe    - целое, номер universe физических каналов;
+                      по умолчанию - None (universe консоли);
+        count       - целое, количество каналов, по умолчанию - 1;
+        curve       - кортеж (название, параметр) - кривая
+                      преобразования значений каналов
+                      (см. Control.strAttrToCurve()), перекрывает
+                      кривые, заданные контролами; по умолчанию - None.
+
+    Один логический канал может быть выведен в несколько физических."""
+
+    TAG = 'map'
+    PARENTS = {'patch'}
+    PARAMETERS = Control.PARAMETERS | {'channel', 'address'}
+    OPTIONS = {'universe', 'count', 'curve'}
+    SETS_CHANNEL_COUNTER = False
+
+    def __init__(self):
+        super().__init__()
+
+        self.address = None
+        self.universe = None
+        self.count = 1
+        self.curve = None
+
+    def setParameter(self, ns, vs):
+        super().setParameter(ns, vs)
+
+        if ns == 'address':
+            self.address = self.strAttrToInt(ns, vs, minv=1, maxv=512)
+        elif ns == 'universe':
+            self.universe = self.strAttrToInt(ns, vs, minv=1)
+        elif ns == 'count':
+            self.count = self.strAttrToInt(ns, vs, minv=1, maxv=512)
+        elif ns == 'curve':
+            self.curve = self.strAttrToCurve(ns, vs)
+
+    def checkParameters(self):
+        if self.channel + self.count - 1 > 512:
+            raise ValueError('too many logical channels for channel %d' % self.channel)
+
+        if self.address + self.count - 1 > 512:
+            raise ValueError('too many physical channels for address %d' % self.address)
+
+
+class Fixture(Panel):
+    """Прибор - панель с контролами, описанными в файле профиля прибора
+    (см. FixtureLibrary).
+
+    Вложенные элементы в файле описания консоли не допускаются -
+    контролы создаются из профиля, их номера каналов сдвигаются так,
+    что первый канал профиля соответствует атрибуту channel прибора.
+
+    Атрибуты экземпляра класса (в дополнение к унаследованным):
+        type        - строка, имя профиля прибора, обязательный атрибут;
+        nchannels   - целое, количество каналов, занимаемых прибором
+                      (определяется по профилю)."""
+
+    TAG = 'fixture'
+    PARAMETERS = Panel.PARAMETERS | {'type'}
+
+    def __init__(self):
+        super().__init__()
+
+        self.type = None
+        self.nchannels = 0
+
+    def getNChannels(self):
+        return self.nchannels
+
+    def setParameter(self, ns, vs):
+        super().setParameter(ns, vs)
+
+        if ns == 'type':
+            self.type = vs.strip()
+            if not self.type:
+                raise ValueError('attribute "%s" must not be empty' % ns)
+
+    def instantiate(self, library):
+        """Создание вложенных контролов по профилю прибора.
+        Вызывается загрузчиком, когда номер первого канала уже известен.
+
+        library - экземпляр FixtureLibrary."""
+
+        self.nchannels, self.children = library.get_controls(self.type,
+            self.console.filename, self.channel - 1)
+
+        for ctrl in self.walk():
+            ctrl.console = self.console
+
+        if self.channel + self.nchannels - 1 > 512:
+            raise ValueError('fixture channels %d..%d are out of range 1..512' % (self.channel,
+                self.channel + self.nchannels - 1))
+
+
+class FixtureLibrary():
+    """Библиотека профилей приборов.
+
+    Профиль прибора - файл в формате описания консоли, с именем,
+    состоящим из имени профиля и расширения FILE_EXT; номера каналов
+    в профиле отсчитываются от 1.
+
+    Профили ищутся в каталогах:
+        1. "fixtures" в каталоге файла описания консоли;
+        2. в каталоге файла описания консоли;
+        3. "fixtures" в каталоге настроек (~/.config/dmxctrl/fixtures).
+
+    Загруженный профиль хранится в памяти и в дисковом кэше
+    (~/.cache/dmxctrl/fixtures) в виде pickle'а списка деревьев
+    контролов из простых объектов (см. control_to_tree()),
+    и разбирается повторно только при изменении файла профиля
+    или набора атрибутов контролов (см. get_schema_signature()).
+    Экземпляры контролов для каждого прибора создаются конструкторами
+    классов из распакованных вызовом pickle.loads() деревьев - это
+    заметно быстрее разбора XML, а атрибуты, которых нет в дереве,
+    получают значения по умолчанию."""
+
+    FILE_EXT = '.dmxctrl'
+    DIR_NAME = 'fixtures'
+    CACHE_VERSION = 4
+
+    def __init__(self):
+        self.cacheDir = os.path.join(os.path.expanduser('~'), '.cache', 'dmxctrl', self.DIR_NAME)
+        self.libraryDir = os.path.join(os.path.expanduser('~'), '.config', 'dmxctrl', self.DIR_NAME)
+
+        # ключи - полные пути к файлам профилей,
+        # значения - кортежи (mtime, size, nchannels, pickle)
+        self.profiles = dict()
+
+        # пути профилей, загружаемых в данный момент
+        # (для обнаружения циклических ссылок)
+        self.loading = set()
+
+    def find_profile(self, ftype, consoleFileName):
+        """Возвращает полный путь к файлу профиля ftype.
+        Если файл не найден - генерирует ValueError."""
+
+        consoleDir = os.path.split(os.path.abspath(consoleFileName))[0]
+        fname = ftype if ftype.endswith(self.FILE_EXT) else ftype + self.FILE_EXT
+
+        for fdir in (os.path.join(consoleDir, self.DIR_NAME), consoleDir, self.libraryDir):
+            fpath = os.path.join(fdir, fname)
+            if os.path.isfile(fpath):
+                return os.path.abspath(fpath)
+
+        raise ValueError('fixture profile "%s" is not found' % ftype)
+
+    def __cache_path(self, fpath):
+        return os.path.join(self.cacheDir, '%s.pickle' % sha1(fpath.encode('utf-8')).hexdigest())
+
+    def __load_cached(self, fpath, mtime, size):
+        try:
+            with open(self.__cache_path(fpath), 'rb') as f:
+                version, cpath, cmtime, csize, nchannels, data = pickle.load(f)
+        except Exception:
+            # кэша нет или он испорчен - профиль будет разобран заново
+            return None
+
+        if version != (self.CACHE_VERSION, get_schema_signature()) or cpath != fpath or cmtime != mtime or csize != size:
+            return None
+
+        return nchannels, data
+
+    def __save_cached(self, fpath, mtime, size, nchannels, data):
+        try:
+            os.makedirs(self.cacheDir, exist_ok=True)
+
+            with open(self.__cache_path(fpath), 'wb') as f:
+                pickle.dump(((self.CACHE_VERSION, get_schema_signature()), fpath, mtime, size, nchannels, data), f)
+        except OSError:
+            # без дискового кэша тоже можно жить
+            pass
+
+    def __parse_profile(self, fpath):
+        if fpath in self.loading:
+            raise ValueError('fixture profile "%s" refers to itself' % fpath)
+
+        self.loading.add(fpath)
+        try:
+            profile = DMXControls(fpath, self)
+        finally:
+            self.loading.discard(fpath)
+
+        nchannels = 0
+
+        for ctrl in profile.walk():
+            if isinstance(ctrl, (Source, Patch, Timeline, Group, Derived)):
+                raise ValueError('fixture profile "%s" must not contain "%s" elements' % (fpath, ctrl.TAG))
+
+            if ctrl is profile:
+                continue
+
+            if isinstance(ctrl, (Regulator, Fixture)):
+                nchannels = max(nchannels, ctrl.channel + ctrl.getNChannels() - 1)
+
+        # ссылки на загрузчик профиля в кэш не попадают
+        return nchannels, pickle.dumps([control_to_tree(ctrl) for ctrl in profile.children],
+                                       pickle.HIGHEST_PROTOCOL)
+
+    def get_profile(self, ftype, consoleFileName):
+        """Возвращает кортеж из двух элементов: количества каналов,
+        занимаемых прибором, и pickle'а списка контролов профиля ftype."""
+
+        fpath = self.find_profile(ftype, consoleFileName)
+        st = os.stat(fpath)
+
+        cached = self.profiles.get(fpath)
+        if cached is not None and cached[0] == st.st_mtime_ns and cached[1] == st.st_size:
+            return cached[2], cached[3]
+
+        r = self.__load_cached(fpath, st.st_mtime_ns, st.st_size)
+        if r is None:
+            r = self.__parse_profile(fpath)
+            self.__save_cached(fpath, st.st_mtime_ns, st.st_size, *r)
+
+        self.profiles[fpath] = (st.st_mtime_ns, st.st_size) + r
+
+        return r
+
+    def get_controls(self, ftype, consoleFileName, offset):
+        """Возвращает кортеж из двух элементов: количества каналов,
+        занимаемых прибором, и списка новых экземпляров контролов
+        профиля ftype, номера каналов которых сдвинуты на offset."""
+
+        nchannels, data = self.get_profile(ftype, consoleFileName)
+        controls = [tree_to_control(tree) for tree in pickle.loads(data)]
+
+        if offset:
+            for ctrl in controls:
+                for c in ctrl.walk():
+                    if c.channel is not None:
+                        c.channel += offset
+
+                    if isinstance(c, Submaster):
+                        c.channels = [ch + offset for ch in c.channels]
+
+        return nchannels, controls
+
+
+# общая библиотека профилей, используется загрузчиком по умолчанию
+fixtureLibrary = FixtureLibrary()
+
+
+class DMXControls(Container, xml.sax.ContentHandler):
+    """Корневой элемент описания консоли и загрузчик файла описания.
+
+    Атрибуты экземпляра класса (в дополнение к унаследованным):
+        fixtures    - экземпляр FixtureLibrary - библиотека профилей
+                      для элементов fixture;
+        universe    - целое, номер universe DMX512, по умолчанию - 1;
+        merge       - строка, правило смешивания значений из разных
+                      источников по умолчанию (см. Regulator.merge);
+                      по умолчанию - "htp";
+        intensity   - булевское значение; True, если каналы, не занятые
+                      контролами (значения которых задаются только
+                      сценами, эффектами, внешними источниками и т.п.),
+                      управляют яркостью (см. Regulator.intensity);
+                      по умолчанию - True;
+        templates   - словарь, где ключи - имена шаблонов (template),
+                      а значения - списки записанных событий SAX;
+        references  - словарь, где ключи - контролы, ссылающиеся на другие
+                      элементы консоли (Derived, Timeline), а значения - кортежи
+                      (строка, колонка, путь к элементу) - позиции
+                      их описаний для сообщений об ошибках, найденных
+                      после загрузки всего файла (см. resolve_derived(),
+                      resolve_timelines()).
+
+    Элементы repeat, template и use обрабатываются самим загрузчиком:
+    события SAX для их вложенных элементов записываются, и затем
+    "проигрываются" через те же методы startElement()/endElement()
+    нужное количество раз, с назначением номеров каналов по ходу дела,
+    без повторного разбора XML и копирования деревьев контролов."""
+
+    TAG = 'dmxcontrols'
+    OPTIONS = Container.OPTIONS | {'universe', 'merge', 'intensity'}
+
+    class Error(ValueError):
+        """Ошибка в файле описания консоли.
+
+        Атрибуты экземпляра класса:
+            filename    - строка, имя файла;
+            line,
+            column      - целые, позиция ошибки в файле
+                          (или None, если неизвестна);
+            element     - строка, путь к элементу с ошибкой
+                          (напр. "dmxcontrols/panel/level");
+            message     - строка, описание ошибки."""
+
+        def __init__(self, loader, msg, location=None):
+            """location - кортеж (строка, колонка, путь к элементу)
+            или None - текущая позиция загрузчика."""
+
+            if location is None:
+                location = loader.getLocation() + (loader.getStackStr(),)
+
+            super().__init__('Error at position %s of file "%s": %s' % (loader.getLocatorStr(location), loader.filename, msg))
+
+            self.filename = loader.filename
+            self.line, self.column, self.element = location
+            self.message = msg
+
+    class __StkItem():
+        def __init__(self, n, o):
+            super().__init__()
+
+            self.name = n
+            self.obj = o
+
+        def __repr__(self):
+            return repr_to_str(self)
+
+    class __Recording():
+        """Записываемое тело элемента repeat или template."""
+
+        def __init__(self, name, params):
+            super().__init__()
+
+            self.name = name
+            self.params = params
+            # список кортежей (метод, аргументы)
+            self.events = []
+            # уровень вложенности записываемых элементов
+            self.depth = 0
+
+        def __repr__(self):
+            return repr_to_str(self)
+
+    # элементы, обрабатываемые загрузчиком;
+    # значения - кортежи из множеств имён обязательных
+    # и необязательных атрибутов
+    EXPANSION_TAGS = {'repeat': ({'count'}, {'stride', 'channel'}),
+        'template': ({'name'}, set()),
+        'use': ({'template'}, {'channel'})}
+
+    def __init__(self, filename, fixtures=None):
+        super().__init__()
+        xml.sax.ContentHandler.__init__(self)
+
+        self.filename = filename
+        self.fixtures = fixtureLibrary if fixtures is None else fixtures
+        self.universe = 1
+        self.channel = 1
+        self.merge = 'htp'
+        self.intensity = True
+
+        self.locator = None
+        self.stack = []
+        self.stackTop = None
+        self.curChannel = 1
+
+        self.templates = dict()
+        self.references = dict()
+        self.recording = None
+        # номер канала, от которого отсчитываются явно указанные
+        # номера каналов в теле repeat или template
+        self.channelBase = None
+
+        parser = xml.sax.make_parser()
+        parser.setContentHandler(self)
+        parser.parse(filename)
+
+    def getParent(self):
+        return self.stack[-2] if len(self.stack) >= 2 else None
+
+    def getStackStr(self):
+        return '/'.join(map(lambda i: i.name, self.stack))
+
+    def setDocumentLocator(self, locator):
+        self.locator = locator
+
+    def getLocation(self):
+        """Возвращает кортеж из двух целых - номера строки и колонки
+        текущей позиции в файле, или (None, None)."""
+
+        if not self.locator:
+            return (None, None)
+
+        return (self.locator.getLineNumber(), self.locator.getColumnNumber())
+
+    def getLocatorStr(self, location=None):
+        """Возвращает строку с позицией в файле - текущей, или заданной
+        кортежем location (строка, колонка, путь к элементу)."""
+
+        if location is None:
+            if not self.locator:
+                return '?'
+
+            location = self.getLocation() + (self.getStackStr(),)
+
+        line, column, ss = location
+
+        return '?' if line is None else '%d:%d%s' % (line, column,
+            '' if not ss else ' (%s)' % ss)
+
+    def checkReferences(self):
+        """Проверка ссылок контролов на другие элементы консоли после
+        загрузки всего файла; в случае ошибок генерирует self.Error
+        с позицией описания контрола."""
+
+        try:
+            resolve_derived(self)
+            resolve_timelines(self)
+        except ControlReferenceError as ex:
+            raise self.Error(self, str(ex), self.references.get(ex.control)) from ex
+
+    CHILD_CLASSES = (Panel, Level, ColorLevel, Switch, SwitchOption,
+        CueList, Cue, CueValue, Effect, Source, Submaster, Patch, PatchMap,
+        Fixture, Timeline, TimelineEvent, Chase, Group, GroupLevel, Derived)
+
+    def setParameter(self, ns, vs):
+        super().setParameter(ns, vs)
+
+        if ns == 'universe':
+            self.universe = self.strAttrToInt(ns, vs)
+            if self.universe is None:
+                self.universe = 1
+            elif self.universe < 1:
+                raise ValueError('invalid universe value')
+        elif ns == 'merge':
+            self.merge = self.strAttrToChoice(ns, vs, Regulator.MERGE_RULES)
+        elif ns == 'intensity':
+            self.intensity = self.strAttrToBool(ns, vs)
+
+    def __relative_channel(self, attributes):
+        """Пересчёт относительного номера канала в атрибутах
+        элемента из тела repeat или template в абсолютный."""
+
+        vs = attributes['channel'].strip()
+        if not vs.isdigit():
+            return attributes
+
+        attributes = dict(attributes.items())
+        attributes['channel'] = str(self.channelBase + int(vs) - 1)
+
+        return attributes
+
+    def __start_expansion(self, name, attributes):
+        required, optional = self.EXPANSION_TAGS[name]
+
+        extra = set(attributes.keys()) - required - optional
+        if extra:
+            raise self.Error(self, 'unsupported parameter(s) - %s' % (', '.join(map(lambda v: '"%s"' % v, extra))))
+
+        for pname in required:
+            if attributes.get(pname, None) is None:
+                raise self.Error(self, 'required parameter "%s" is missing' % pname)
+
+        try:
+            channel = self.strAttrToInt('channel', attributes['channel'], minv=1, maxv=512) if 'channel' in attributes else None
+
+            if name == 'repeat':
+                stride = attributes.get('stride', None)
+
+                self.recording = self.__Recording(name,
+                    (self.strAttrToInt('count', attributes['count'], minv=1, maxv=512),
+                     None if stride is None else self.strAttrToInt('stride', stride, minv=0, maxv=512),
+                     self.curChannel if channel is None else channel))
+            elif name == 'template':
+                self.recording = self.__Recording(name, attributes['name'].strip())
+            else:
+                tname = attributes['template'].strip()
+                if tname not in self.templates:
+                    raise ValueError('template "%s" is not defined' % tname)
+
+                self.stackTop.obj = None
+                self.stackTop.params = (tname, channel)
+        except ValueError as ex:
+            raise self.Error(self, str(ex)) from ex
+
+    def __replay(self, events, channel):
+        """Воспроизведение записанных событий SAX; явно указанные
+        номера каналов отсчитываются от channel."""
+
+        self.curChannel = channel
+
+        saved = self.channelBase
+        self.channelBase = channel
+        try:
+            for method, args in events:
+                method(*args)
+        finally:
+            self.channelBase = saved
+
+    def __end_expansion(self, name, stkitem):
+        if name == 'use':
+            tname, channel = stkitem.params
+            self.__replay(self.templates[tname], self.curChannel if channel is None else channel)
+            return
+
+        rec = self.recording
+        self.recording = None
+
+        if name == 'template':
+            self.templates[rec.params] = rec.events
+            return
+
+        count, stride, channel = rec.params
+
+        for ix in range(count):
+            if stride is not None:
+                base = channel + ix * stride
+            else:
+                # без stride каждый следующий экземпляр занимает каналы
+                # сразу после предыдущего
+                base = channel if ix == 0 else self.curChannel
+
+            self.__replay(rec.events, base)
+
+        if stride is not None:
+            self.curChannel = channel + count * stride
+
+    def startElement(self, name, attributes):
+        if self.recording is not None:
+            # тело repeat или template - только запоминаем
+            self.recording.depth += 1
+            self.recording.events.append((self.startElement, (name, dict(attributes.items()))))
+            return
+
+        if self.channelBase is not None and 'channel' in attributes:
+            attributes = self.__relative_channel(attributes)
+
+        self.stackTop = self.__StkItem(name, None)
+        self.stack.append(self.stackTop)
+        stackLen = len(self.stack)
+        #
+        #print(f'\033[32m%sstartElement({name})\033[0m' % (' ' * stackLen))
+
+        def checkParent(parents):
+            if self.getParent().name not in parents:
+                pss = tuple(map(lambda v: '"%s"' % v, parents))
+
+                psa = pss[-1]
+
+                if len(pss) >= 2:
+                    psa = '%s or %s' % (', '.join(pss[:-1]), psa)
+
+                raise self.Error(self, '"%s" must be child of %s' % (name, psa))
+
+        def checkSetAttributes():
+            try:
+                extra = set(attributes.keys()) - set(self.stackTop.obj.PARAMETERS | self.stackTop.obj.OPTIONS)
+                if extra:
+                    raise Exception('unsupported parameter(s) - %s' % (', '.join(map(lambda v: '"%s"' % v, extra))))
+
+                # обязательные параметры
+                for pname in self.stackTop.obj.PARAMETERS:
+                    pval = attributes.get(pname, None)
+                    if pval is None:
+                        raise Exception('required parameter "%s" is missing' % pname)
+
+                    #print('%s parameter: %s=%s' % (name, pname, pval))
+                    self.stackTop.obj.setParameter(pname, pval)
+
+                # необязательные параметры
+                for pname in self.stackTop.obj.OPTIONS:
+                    pval = attributes.get(pname, None)
+
+                    if pval is not None:
+                        #print('%s option: %s=%s' % (name, pname, pval))
+                        self.stackTop.obj.setParameter(pname, pval)
+
+                # принудительная установка атрибута "channel" при необходимости
+                if self.stackTop.obj.channel is not None:
+                    # если канал задан явно - меняем значение глобального атрибута
+                    # (если контрол вообще занимает каналы)
+                    if self.stackTop.obj.SETS_CHANNEL_COUNTER:
+                        self.curChannel = self.stackTop.obj.channel
+                else:
+                    # иначе - задаём атрибут "channel" текущему объекту
+                    # принудительно
+                    if self.stackTop.obj.USE_PARENT_CHANNEL:
+                        prnt = self.getParent()
+
+                        self.stackTop.obj.channel = prnt.obj.channel if prnt else self.curChannel
+                    else:
+                        self.stackTop.obj.channel = self.curChannel
+
+                if isinstance(self.stackTop.obj, Fixture):
+                    # контролы прибора создаются, когда уже известен
+                    # номер его первого канала
+                    self.stackTop.obj.instantiate(self.fixtures)
+
+                if isinstance(self.stackTop.obj, (Regulator, Fixture)):
+                    # глобальный счётчик изменяют только активные контролы
+                    # и приборы, т.к. прочие контейнеры сами каналов не занимают,
+                    # только хранят начальное значение канала для вложенных
+                    # контролов
+                    self.curChannel += self.stackTop.obj.getNChannels()
+
+            except Exception as ex:
+                raise self.Error(self, str(ex)) from ex
+
+        if stackLen == 1:
+            # вот таким тупым способом проверяем формат файла
+            if name != self.TAG:
+                raise self.Error(self, 'invalid root tag - file is not a DMXControls file')
+
+            self.stackTop.obj = self
+            checkSetAttributes()
+        else:
+            # служебные тэги
+            if name == 'br':
+                self.getParent().obj.comments.append('\n')
+            elif name in self.EXPANSION_TAGS:
+                self.__start_expansion(name, attributes)
+            # тэги контролов
+            else:
+                isValidClass = False
+
+                for cclass in self.CHILD_CLASSES:
+                    if name == cclass.TAG:
+                        checkParent(cclass.PARENTS)
+
+                        self.stackTop.obj = cclass()
+                        self.stackTop.obj.console = self
+
+                        if isinstance(self.stackTop.obj, (Derived, Timeline)):
+                            self.references[self.stackTop.obj] = self.getLocation() + (self.getStackStr(),)
+
+                        checkSetAttributes()
+
+                        oparent = self.getParent()
+                        oparent.obj.children.append(self.stackTop.obj)
+
+                        isValidClass = True
+                        break
+
+                if not isValidClass:
+                    raise self.Error(self, 'unsupported tag "%s"' % name)
+
+    def endElement(self, name):
+        if self.recording is not None and self.recording.depth > 0:
+            self.recording.depth -= 1
+            self.recording.events.append((self.endElement, (name,)))
+            return
+
+        #
+        self.stackTop = self.stack.pop() if self.stack else None
+
+        if len(self.stack) >= 1 and name in self.EXPANSION_TAGS:
+            self.__end_expansion(name, self.stackTop)
+            return
+
+        #indent = '  ' * len(self.stack)
+        #print(f'\033[32m%sendElement({name}): %s\033[0m' % (
+        #      indent,
+        #      self.stackTop))
+        if self.stackTop.obj:
+            try:
+                self.stackTop.obj.checkParameters()
+            except Exception as ex:
+                raise self.Error(self, str(ex)) from ex
+
+        if not self.stack:
+            # конец документа
+            self.checkReferences()
+
+    def characters(self, s):
+        s = s.strip()
+        if not s:
+            return
+
+        if self.recording is not None:
+            self.recording.events.append((self.characters, (s,)))
+            return
+
+        if self.stackTop and self.stackTop.obj:
+            self.stackTop.obj.comments.append(s)
+        else:
+            self.comments.append(s)
+
+
+__schemaSignature = None
+
+def get_schema_signature():
+    """Возвращает строку - хэш имён тэгов, параметров и атрибутов
+    экземпляров всех классов контролов. Значение изменяется при
+    добавлении или удалении атрибутов, и используется для проверки
+    актуальности сохранённых деревьев контролов (кэша профилей приборов,
+    скомпилированных файлов консолей)."""
+
+    global __schemaSignature
+
+    if __schemaSignature is None:
+        h = sha1()
+
+        for cls in DMXControls.CHILD_CLASSES:
+            h.update(('%s:%s:%s;' % (cls.TAG,
+                ','.join(sorted(cls.PARAMETERS | cls.OPTIONS)),
+                ','.join(sorted(vars(cls()))))).encode('utf-8'))
+
+        h.update(('%s:%s;' % (DMXControls.TAG,
+            ','.join(sorted(DMXControls.PARAMETERS | DMXControls.OPTIONS)))).encode('utf-8'))
+
+        __schemaSignature = h.hexdigest()
+
+    return __schemaSignature
+
+
+def control_to_tree(ctrl):
+    """Возвращает дерево из простых объектов Python для контрола ctrl
+    (без ссылки на консоль): кортеж (имя тэга, словарь атрибутов,
+    список деревьев вложенных контролов)."""
+
+    return (ctrl.TAG,
+        {k: v for k, v in vars(ctrl).items() if k not in ('console', 'children')},
+        [control_to_tree(child) for child in ctrl.children])
+
+
+__treeClasses = None
+
+def tree_to_control(tree):
+    """Создание контрола из дерева, полученного control_to_tree().
+    Экземпляры создаются конструкторами классов, так что атрибуты,
+    отсутствующие в дереве, получают значения по умолчанию."""
+
+    global __treeClasses
+
+    if __treeClasses is None:
+        __treeClasses = {cls.TAG: cls for cls in DMXControls.CHILD_CLASSES}
+
+    tag, attrs, children = tree
+
+    cls = __treeClasses.get(tag)
+    if cls is None:
+        raise ValueError('unsupported tag "%s"' % tag)
+
+    ctrl = cls()
+    vars(ctrl).update(attrs)
+    ctrl.children = [tree_to_control(child) for child in children]
+
+    return ctrl
 
 
 if __name__ == '__main__':
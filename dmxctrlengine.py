@@ -0,0 +1,1879 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+""" This file is part of DMXCtrl.
+
+    DMXCtrl is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    DMXCtrl is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with DMXCtrl.  If not, see <http://www.gnu.org/licenses/>."""
+
+
+from operator import add, sub, mul, neg, ne, or_, and_, lshift, itemgetter
+from itertools import repeat, groupby
+from array import array
+from time import perf_counter
+from bisect import bisect_left
+from random import Random
+from math import exp
+import sys
+import ast
+
+from dmxctrldata import *
+from dmxctrlbuf import *
+from dmxctrlfx import *
+
+
+# частота кадров вывода по умолчанию
+FRAME_RATE = 30
+
+# время затемнения (blackout) и восстановления уровней (в секундах)
+BLACKOUT_FADE_TIME = 1.0
+
+# период (в секундах) отсылки всех universe, в т.ч. неизменившихся -
+# на случай перезапуска olad или потери кадров
+FULL_REFRESH_INTERVAL = 1.0
+
+
+def make_curve_table(curve):
+    """Возвращает bytes длиной 256 - таблицу преобразования значений
+    канала для bytes.translate().
+
+    curve - кортеж (название, параметр), см. Control.strAttrToCurve()."""
+
+    name, param = curve
+
+    if name == 'square':
+        f = lambda x: x * x
+    elif name == 'scurve':
+        f = lambda x: x * x * (3.0 - 2.0 * x)
+    elif name == 'gamma':
+        f = lambda x: x ** param
+    else:
+        return bytes(range(256))
+
+    return bytes(round(255.0 * f(v / 255.0)) for v in range(256))
+
+
+LINEAR_CURVE = ('linear', 0.0)
+
+
+def fade_progress(now, start, duration):
+    """Возвращает степень завершённости перехода (0.0..1.0).
+
+    now, start  - вещественные, текущее время и время начала перехода
+                  (в секундах);
+    duration    - вещественное, длительность перехода."""
+
+    if duration <= 0.0:
+        return 1.0
+
+    p = (now - start) / duration
+
+    return 0.0 if p < 0.0 else 1.0 if p > 1.0 else p
+
+
+def crossfade(src, deltaUp, deltaDown, pUp, pDown):
+    """Расчёт промежуточных значений всех каналов при переходе.
+
+    Расчёт выполняется для всего universe сразу, функциями
+    map() со встроенными функциями и методами (без выполнения
+    байт-кода Python для каждого канала).
+
+    src         - bytes, значения каналов в начале перехода;
+    deltaUp     - array, разности конечных и начальных значений для
+                  нарастающих каналов (0 для прочих);
+    deltaDown   - array, то же для спадающих каналов;
+    pUp, pDown  - вещественные, степень завершённости нарастания
+                  и спада (0.0..1.0).
+
+    Возвращает bytes."""
+
+    return bytes(map(add,
+                     map(add, src, map(round, map(float(pUp).__mul__, deltaUp))),
+                     map(round, map(float(pDown).__mul__, deltaDown))))
+
+
+def get_word(data, ix):
+    """Возвращает 16-битное значение из пары каналов data[ix] (старший
+    байт) и data[ix + 1] (младший байт)."""
+
+    return (data[ix] << 8) | data[ix + 1]
+
+
+def crossfade16(src, deltaUp, deltaDown, pUp, pDown):
+    """Расчёт промежуточных 16-битных значений при переходе.
+    Параметры - как у crossfade(), но src - array с 16-битными
+    значениями.
+
+    Возвращает итератор целых."""
+
+    return map(add,
+               map(add, src, map(round, map(float(pUp).__mul__, deltaUp))),
+               map(round, map(float(pDown).__mul__, deltaDown)))
+
+
+class FadeScheduler():
+    """Плавные переходы значений групп каналов в буфере.
+
+    Один экземпляр обслуживает любое количество одновременных переходов;
+    значения каждого перехода рассчитываются на кадре одной операцией
+    над срезом буфера (см. crossfade()).
+
+    Атрибуты экземпляра класса:
+        buffer      - экземпляр ChannelBuffer, в котором изменяются
+                      значения каналов;
+        fades       - список активных переходов - списков из пяти
+                      элементов: индекс первого канала, bytes - значения
+                      в начале перехода, array - разности конечных
+                      и начальных значений, время начала и длительность
+                      перехода."""
+
+    def __init__(self, buffer):
+        self.buffer = buffer
+        self.fades = []
+
+    def clear(self):
+        """Отмена всех переходов (значения каналов остаются текущими)."""
+
+        self.fades.clear()
+
+    def cancel(self, first, stop):
+        """Отмена переходов для каналов с индексами first..stop-1.
+        Переходы, частично затрагивающие эти каналы, продолжаются
+        для прочих каналов."""
+
+        fades = []
+
+        for fade in self.fades:
+            ffirst, src, delta, start, duration = fade
+            fstop = ffirst + len(src)
+
+            if fstop <= first or ffirst >= stop:
+                fades.append(fade)
+                continue
+
+            if ffirst < first:
+                n = first - ffirst
+                fades.append([ffirst, src[:n], delta[:n], start, duration])
+
+            if fstop > stop:
+                n = stop - ffirst
+                fades.append([stop, src[n:], delta[n:], start, duration])
+
+        self.fades = fades
+
+    def start(self, channel, values, now, duration):
+        """Начало перехода.
+
+        channel     - целое, номер первого канала (от 1);
+        values      - конечные значения каналов (bytes, список целых и т.п.);
+        now         - время начала перехода (по time.monotonic());
+        duration    - длительность перехода в секундах; если <= 0 -
+                      значения устанавливаются сразу.
+
+        Ранее начатые переходы для тех же каналов отменяются."""
+
+        first = self.buffer.check_range(channel, len(values))
+        stop = first + len(values)
+
+        self.cancel(first, stop)
+
+        if duration <= 0.0:
+            self.buffer.set_values(channel, values)
+            return
+
+        src = bytes(self.buffer.view[first:stop])
+        self.fades.append([first, src, array('h', map(lambda s, d: d - s, src, values)), now, duration])
+
+    def render(self, now):
+        """Расчёт значений каналов для кадра, выводимого в момент now.
+        Возвращает True, если значения изменились."""
+
+        if not self.fades:
+            return False
+
+        done = False
+
+        for fade in self.fades:
+            first, src, delta, start, duration = fade
+
+            p = fade_progress(now, start, duration)
+
+            self.buffer.set_values(first + 1,
+                bytes(map(add, src, map(round, map(float(p).__mul__, delta)))))
+
+            if p >= 1.0:
+                fade[4] = None
+                done = True
+
+        if done:
+            self.fades = [fade for fade in self.fades if fade[4] is not None]
+
+        return True
+
+
+class CueStack():
+    """Воспроизведение сцен CueList.
+
+    Атрибуты экземпляра класса:
+        cuelist     - экземпляр dmxctrldata.CueList;
+        cues        - список кортежей (bytes, fadein, fadeout) -
+                      значения всех каналов universe для каждой сцены
+                      и времена переходов;
+        mask        - bytes, маска каналов, используемых сценами
+                      (1 - используется, 0 - нет);
+        finePairs   - список индексов старших байтов 16-битных
+                      значений (см. CueValue.fine), при переходе
+                      значения в парах каналов рассчитываются
+                      как 16-битные;
+        current     - целое, индекс текущей сцены в списке cues,
+                      -1 - сцена не выбрана;
+        output      - экземпляр ChannelBuffer, текущие значения
+                      каналов;
+        paused      - булевское значение, True, если переход
+                      приостановлен."""
+
+    def __init__(self, cuelist, size=DMX_UNIVERSE_SIZE):
+        self.cuelist = cuelist
+        self.cues = []
+
+        # маска каналов, используемых сценами
+        mask = bytearray(size)
+        finePairs = set()
+
+        for cue in cuelist.children:
+            levels = ChannelBuffer(size)
+
+            for cv in cue.children:
+                levels.set_values(cv.channel, cv.value)
+                mask[cv.channel - 1:cv.channel - 1 + len(cv.value)] = b'\x01' * len(cv.value)
+
+                if cv.fine:
+                    finePairs.update(range(cv.channel - 1, cv.channel - 1 + len(cv.value), 2))
+
+            self.cues.append((bytes(levels.data),
+                cuelist.fadein if cue.fadein is None else cue.fadein,
+                cuelist.fadeout if cue.fadeout is None else cue.fadeout))
+
+        self.mask = bytes(mask)
+        self.finePairs = sorted(finePairs)
+        self.output = ChannelBuffer(size)
+        self.current = -1
+        self.paused = False
+        self.pauseTime = 0.0
+
+        self.__set_fade(bytes(size), 0.0, 0.0, 0.0)
+
+    def __set_fade(self, target, now, fadein, fadeout):
+        self.fadeSrc = bytes(self.output.data)
+        self.fadeStart = now
+        self.fadeIn = fadein
+        self.fadeOut = fadeout
+
+        # разности значений раскладываем на два массива - для нарастающих
+        # и спадающих каналов, т.к. у них разное время перехода
+        self.deltaUp = array('h', map(lambda s, d: d - s if d > s else 0, self.fadeSrc, target))
+        self.deltaDown = array('h', map(lambda s, d: d - s if d < s else 0, self.fadeSrc, target))
+
+        if self.finePairs:
+            # то же для 16-битных значений
+            self.fadeSrc16 = array('l', map(get_word, repeat(self.fadeSrc), self.finePairs))
+            target16 = array('l', map(get_word, repeat(target), self.finePairs))
+
+            self.deltaUp16 = array('l', map(lambda s, d: d - s if d > s else 0, self.fadeSrc16, target16))
+            self.deltaDown16 = array('l', map(lambda s, d: d - s if d < s else 0, self.fadeSrc16, target16))
+
+        self.fading = True
+
+    def get_cue_name(self):
+        """Возвращает название текущей сцены или пустую строку."""
+
+        if self.current < 0:
+            return ''
+
+        cue = self.cuelist.children[self.current]
+        return cue.name if cue.name else '#%d' % (self.current + 1)
+
+    def goto(self, ixcue, now, fadein=None, fadeout=None):
+        """Переход к сцене с индексом ixcue.
+        fadein, fadeout - время перехода или None для времени,
+        заданного для сцены."""
+
+        self.current = ixcue
+        levels, cuefadein, cuefadeout = self.cues[ixcue]
+        self.paused = False
+        self.__set_fade(levels, now,
+            cuefadein if fadein is None else fadein,
+            cuefadeout if fadeout is None else fadeout)
+
+    def go(self, now):
+        """Переход к следующей сцене."""
+
+        ixcue = self.current + 1
+
+        if ixcue >= len(self.cues):
+            if not self.cuelist.loop:
+                return
+
+            ixcue = 0
+
+        self.goto(ixcue, now)
+
+    def back(self, now):
+        """Переход к предыдущей сцене."""
+
+        if self.current > 0:
+            self.goto(self.current - 1, now)
+
+    def pause(self, now):
+        """Приостановка или продолжение перехода."""
+
+        if self.paused:
+            # сдвигаем время начала перехода на время паузы
+            self.fadeStart += now - self.pauseTime
+            self.paused = False
+        elif self.fading:
+            self.pauseTime = now
+            self.paused = True
+
+    def render(self, now):
+        """Расчёт значений каналов для кадра, выводимого в момент now.
+        Возвращает True, если значения изменились."""
+
+        if not self.fading or self.paused:
+            return False
+
+        pUp = fade_progress(now, self.fadeStart, self.fadeIn)
+        pDown = fade_progress(now, self.fadeStart, self.fadeOut)
+
+        levels = crossfade(self.fadeSrc, self.deltaUp, self.deltaDown, pUp, pDown)
+
+        if self.finePairs:
+            # побайтный расчёт даёт ступени в младших байтах пар -
+            # заменяем пары значениями, рассчитанными как 16-битные
+            levels = bytearray(levels)
+
+            for ix, v in zip(self.finePairs,
+                             crossfade16(self.fadeSrc16, self.deltaUp16, self.deltaDown16, pUp, pDown)):
+                levels[ix:ix + 2] = v.to_bytes(2, 'big')
+
+        self.output.assign(levels)
+
+        if pUp >= 1.0 and pDown >= 1.0:
+            self.fading = False
+
+        return True
+
+
+class ChaseStack(CueStack):
+    """Воспроизведение чейза (dmxctrldata.Chase) - переключение шагов
+    по времени кадров, передаваемому в render(), т.е. по тем же часам,
+    что и вывод кадров, независимо от загруженности UI.
+
+    Атрибуты экземпляра класса (в дополнение к унаследованным):
+        bpm         - вещественное, текущий темп (шагов в минуту);
+        running     - булевское значение, True, если чейз запущен;
+        stepStart   - время начала текущего шага;
+        taps        - список времён последних нажатий "tap tempo"."""
+
+    # максимальное количество учитываемых нажатий "tap tempo"
+    MAX_TAPS = 5
+    # нажатия с интервалом больше этого значения (в секундах)
+    # начинают новый отсчёт темпа
+    TAP_TIMEOUT = 2.0
+
+    def __init__(self, chase, size=DMX_UNIVERSE_SIZE):
+        super().__init__(chase, size)
+
+        self.chase = chase
+        self.bpm = chase.bpm
+        self.running = False
+        self.stepStart = 0.0
+        self.bounceDir = 1
+        self.taps = []
+        # для воспроизводимости (в т.ч. при расчёте без ожидания)
+        # последовательность случайных шагов всегда одна и та же
+        self.random = Random(len(self.cues))
+        # для Chase.active - запуск на первом кадре
+        self.autostart = chase.active
+
+    def get_step_time(self):
+        """Возвращает длительность шага в секундах."""
+
+        return 60.0 / self.bpm
+
+    def start(self, now):
+        if not self.running:
+            self.running = True
+            self.__next_step(now)
+
+    def stop(self):
+        self.running = False
+
+    def set_bpm(self, bpm):
+        self.bpm = min(max(bpm, self.chase.MIN_BPM), self.chase.MAX_BPM)
+
+    def tap(self, now):
+        """Нажатие "tap tempo": темп рассчитывается по среднему интервалу
+        между последними нажатиями, новый шаг начинается в момент нажатия.
+        Нажатия с тем же (или более ранним) временем, что и предыдущее,
+        пропускаются."""
+
+        if self.taps:
+            interval = now - self.taps[-1]
+            if interval <= 0.0:
+                return
+
+            if interval > self.TAP_TIMEOUT:
+                self.taps.clear()
+
+        self.taps.append(now)
+        del self.taps[:-self.MAX_TAPS]
+
+        if len(self.taps) >= 2:
+            self.set_bpm(60.0 * (len(self.taps) - 1) / (self.taps[-1] - self.taps[0]))
+
+        if self.running:
+            self.__next_step(now)
+
+    def __get_next_index(self):
+        ncues = len(self.cues)
+        direction = self.chase.direction
+
+        if self.current < 0:
+            return ncues - 1 if direction == 'backward' else 0
+
+        if ncues == 1:
+            return 0
+
+        if direction == 'forward':
+            return (self.current + 1) % ncues
+        elif direction == 'backward':
+            return (self.current - 1) % ncues
+        elif direction == 'bounce':
+            ix = self.current + self.bounceDir
+            if ix < 0 or ix >= ncues:
+                self.bounceDir = -self.bounceDir
+                ix = self.current + self.bounceDir
+
+            return ix
+        else:
+            # random - без повтора текущего шага
+            ix = self.random.randrange(ncues - 1)
+            return ix + 1 if ix >= self.current else ix
+
+    def __next_step(self, start):
+        self.stepStart = start
+
+        fade = self.get_step_time() * self.chase.xfade / 100.0
+        self.goto(self.__get_next_index(), start, fade, fade)
+
+    def render(self, now):
+        if self.autostart:
+            self.autostart = False
+            self.start(now)
+
+        if self.running and not self.paused:
+            stepTime = self.get_step_time()
+            nextStep = self.stepStart + stepTime
+
+            if now >= nextStep:
+                # значения на момент окончания шага - начальные
+                # для перехода к следующему
+                super().render(nextStep)
+
+                # шаги отсчитываются от начала предыдущего шага (без
+                # накопления ошибки), а при большом отставании (напр. после
+                # паузы) - от текущего времени
+                self.__next_step(nextStep if now - nextStep < stepTime else now)
+
+        return super().render(now)
+
+    def pause(self, now):
+        super().pause(now)
+
+        if not self.paused:
+            # продолжение - текущий шаг отсчитывается заново
+            self.stepStart = now
+
+
+class TimelineSequencer():
+    """Воспроизведение событий Timeline.
+
+    Времена событий хранятся в упорядоченном массиве times, на каждом
+    кадре проверяются только события от текущей позиции (cursor) до
+    первого события с временем больше текущего, т.е. расчёт кадра
+    не зависит от общего количества событий. Перемотка - поиск
+    в массиве times (bisect).
+
+    Атрибуты экземпляра класса:
+        timeline    - экземпляр dmxctrldata.Timeline;
+        times       - array('d'), времена событий;
+        cursor      - целое, индекс следующего события;
+        startTime   - время начала воспроизведения (по time.monotonic());
+        playing     - булевское значение, True при воспроизведении;
+        fades       - экземпляр FadeScheduler для событий set и fade;
+        cueStacks,
+        effects     - словари, где ключи - имена CueList и Effect,
+                      а значения - экземпляры CueStack
+                      и EffectGenerator."""
+
+    def __init__(self, timeline, fades, cueStacks, effects):
+        self.timeline = timeline
+        self.events = timeline.events
+        self.times = array('d', (e[0] for e in self.events))
+        self.fades = fades
+        self.cueStacks = cueStacks
+        self.effects = effects
+
+        for t, action, channel, value, fade, target in self.events:
+            if action in ('go', 'back', 'pause') and target not in cueStacks:
+                raise ValueError('timeline "%s": cuelist "%s" is not found' % (timeline.name, target))
+            elif action == 'effect' and target not in effects:
+                raise ValueError('timeline "%s": effect "%s" is not found' % (timeline.name, target))
+
+        self.cursor = 0
+        self.startTime = 0.0
+        self.playing = False
+        # для Timeline.active - запуск на первом кадре, т.к. время
+        # отсчитывается по часам движка
+        self.autostart = timeline.active
+
+    def get_mask(self, size):
+        """Возвращает bytes - маску каналов, значения которых задаются
+        событиями set и fade."""
+
+        mask = bytearray(size)
+
+        for t, action, channel, value, fade, target in self.events:
+            if channel is not None:
+                mask[channel - 1:channel - 1 + len(value)] = b'\x01' * len(value)
+
+        return bytes(mask)
+
+    def start(self, now, position=0.0):
+        """Начало воспроизведения с позиции position (секунды от начала)."""
+
+        self.startTime = now - position
+        self.cursor = bisect_left(self.times, position)
+        self.playing = True
+
+    def stop(self):
+        self.playing = False
+
+    def get_position(self, now):
+        return now - self.startTime if self.playing else 0.0
+
+    def __execute(self, event):
+        t, action, channel, value, fade, target = event
+
+        # переходы отсчитываются от времени события, а не от времени
+        # кадра, на котором оно выполнено
+        now = self.startTime + t
+
+        if action == 'set':
+            self.fades.start(channel, value, now, 0.0)
+        elif action == 'fade':
+            self.fades.start(channel, value, now, fade)
+        elif action == 'effect':
+            self.effects[target].active = bool(value[0])
+        else:
+            getattr(self.cueStacks[target], action)(now)
+
+    def render(self, now):
+        """Выполнение событий, время которых наступило к моменту now."""
+
+        if self.autostart:
+            self.autostart = False
+            self.start(now)
+
+        if not self.playing:
+            return
+
+        position = now - self.startTime
+        times = self.times
+        nevents = len(times)
+
+        while True:
+            while self.cursor < nevents and times[self.cursor] <= position:
+                self.__execute(self.events[self.cursor])
+                self.cursor += 1
+
+            if self.cursor < nevents or position < self.timeline.length:
+                break
+
+            if not self.timeline.loop or self.timeline.length <= 0.0:
+                self.playing = False
+                break
+
+            # следующий повтор - с сохранением отставания от часов
+            self.startTime += self.timeline.length
+            position -= self.timeline.length
+            self.cursor = 0
+
+
+class MergeSource():
+    """Источник значений каналов для SourceMerger.
+
+    Атрибуты экземпляра класса:
+        name        - строка, имя источника (см. dmxctrldata.Source);
+        priority    - целое, приоритет (0..255);
+        buffer      - экземпляр ChannelBuffer, значения каналов,
+                      в который пишет источник;
+        mask        - bytes, маска каналов, значения которых задаёт
+                      источник (1 - задаёт, 0 - нет);
+        stamps      - array('Q'), номера кадров, на которых значения
+                      каналов последний раз изменялись (для LTP);
+        keys        - array('Q'), ключи для выбора значений при
+                      смешивании (см. SourceMerger), или None, если
+                      ключи требуется пересчитать."""
+
+    def __init__(self, name, size):
+        self.name = name
+        self.buffer = ChannelBuffer(size)
+        self.reset()
+
+    def reset(self):
+        size = len(self.buffer)
+
+        self.priority = Source.DEFAULT_PRIORITY
+        self.buffer.clear()
+        self.mask = bytes(size)
+        self.prev = bytes(size)
+        self.stamps = array('Q', bytes(8 * size))
+        self.keys = None
+
+    def set_mask(self, mask):
+        """Установка маски каналов (bytes или bytearray со значениями
+        0 и 1)."""
+
+        if mask != self.mask:
+            self.mask = bytes(mask)
+            self.keys = None
+
+    def claim(self, first, stop):
+        """Добавление в маску каналов с индексами first..stop-1."""
+
+        if self.mask.count(1, first, stop) != stop - first:
+            mask = bytearray(self.mask)
+            mask[first:stop] = b'\x01' * (stop - first)
+            self.set_mask(mask)
+
+    def set_values(self, channel, values):
+        """Установка значений в каналах (см. ChannelBuffer.set_values())
+        с добавлением каналов в маску."""
+
+        self.buffer.set_values(channel, values)
+        self.claim(channel - 1, channel - 1 + len(values))
+
+
+class SourceMerger():
+    """Смешивание значений каналов из нескольких источников.
+
+    Для каждого канала каждого источника вычисляется целочисленный
+    ключ, в старших разрядах которого - признак того, что источник
+    задаёт значение канала, и приоритет источника, далее - номер
+    кадра последнего изменения значения (только для каналов с правилом
+    LTP), и в младших 16 разрядах - само значение. Тогда для всех
+    каналов сразу результат смешивания - младший байт наибольшего
+    из ключей источников, т.е. весь расчёт выполняется функциями map()
+    над массивами ключей, а ключи источника пересчитываются только
+    при изменении его значений.
+
+    Каналы 16-битных значений (пары finePairs) смешиваются как одно
+    значение: у обоих каналов пары ключ один и тот же, в нём -
+    16-битное значение, так что оба байта берутся из одного источника.
+
+    Атрибуты экземпляра класса:
+        sources     - словарь, где ключи - имена источников,
+                      а значения - экземпляры MergeSource;
+        ltpMask     - array('Q'), маска для номеров кадров в ключах:
+                      0 для каналов с правилом HTP;
+        finePairs   - список индексов старших байтов 16-битных значений;
+        serial      - целое, номер кадра последнего изменения значений;
+        output      - bytes, результат смешивания."""
+
+    ACTIVE_FLAG = 1 << 56
+    PRIORITY_SHIFT = 48
+    STAMP_SHIFT = 16
+    STAMP_MASK = (1 << 32) - 1
+    # разряды ключа выше значения
+    KEY_HIGH_MASK = ~0xffff
+
+    def __init__(self, size=DMX_UNIVERSE_SIZE):
+        self.size = size
+        self.sources = dict(map(lambda n: (n, MergeSource(n, size)), Source.SOURCE_NAMES))
+        self.reset()
+
+    def reset(self):
+        """Сброс значений и параметров всех источников.
+        Буферы источников при этом остаются те же."""
+
+        for src in self.sources.values():
+            src.reset()
+
+        self.ltpMask = array('Q', bytes(8 * self.size))
+        self.finePairs = []
+        self.serial = 0
+        self.output = bytes(self.size)
+
+    def set_priority(self, name, priority):
+        src = self.sources[name]
+        src.priority = priority
+        src.keys = None
+
+    def set_ltp_channels(self, ltp):
+        """Установка правил смешивания.
+
+        ltp - bytes, bytearray или список булевских значений для каждого
+              канала: True (1) для правила LTP, False (0) для HTP."""
+
+        self.ltpMask = array('Q', map(mul, ltp, repeat(self.STAMP_MASK)))
+
+        for src in self.sources.values():
+            src.keys = None
+
+    def set_fine_pairs(self, indexes):
+        """Установка индексов старших байтов 16-битных значений."""
+
+        self.finePairs = sorted(ix for ix in indexes if ix + 1 < self.size)
+
+        for src in self.sources.values():
+            src.keys = None
+
+    def merge(self):
+        """Смешивание значений каналов.
+        Возвращает True, если результат (self.output) мог измениться."""
+
+        serial = self.serial + 1
+        changed = False
+        keys = []
+
+        for src in self.sources.values():
+            if src.buffer.pop_dirty() is not None:
+                vals = bytes(src.buffer.data)
+
+                if vals != src.prev:
+                    # номер кадра запоминаем только для каналов,
+                    # значения которых действительно изменились
+                    src.stamps = array('Q', map(max, src.stamps,
+                        map(mul, map(ne, src.prev, vals), repeat(serial))))
+                    src.prev = vals
+                    src.keys = None
+
+            if src.keys is None:
+                flag = self.ACTIVE_FLAG | (src.priority << self.PRIORITY_SHIFT)
+
+                src.keys = array('Q', map(or_,
+                    map(mul, src.mask, repeat(flag)),
+                    map(or_,
+                        map(lshift, map(and_, src.stamps, self.ltpMask), repeat(self.STAMP_SHIFT)),
+                        map(mul, src.prev, src.mask))))
+
+                skeys = src.keys
+                for ix in self.finePairs:
+                    hi, lo = skeys[ix], skeys[ix + 1]
+                    skeys[ix] = skeys[ix + 1] = (max(hi, lo) & self.KEY_HIGH_MASK) | ((hi & 255) << 8) | (lo & 255)
+
+                changed = True
+
+            if 1 in src.mask:
+                keys.append(src.keys)
+
+        if changed:
+            self.serial = serial
+
+            if not keys:
+                self.output = bytes(self.size)
+            else:
+                merged = keys[0] if len(keys) == 1 else array('Q', map(max, *keys))
+
+                output = bytearray(map(and_, merged, repeat(255)))
+                # младший байт ключа пары - младший байт значения
+                for ix in self.finePairs:
+                    output[ix] = (merged[ix] >> 8) & 255
+
+                self.output = bytes(output)
+
+        return changed
+
+
+class DerivedStage():
+    """Расчёт вычисляемых каналов (см. dmxctrldata.Derived).
+
+    Выражения компилируются при загрузке консоли в функции, получающие
+    кортеж входных значений - значений каналов (выбираемых из кадра
+    экземплярами operator.itemgetter), за которыми следуют уровни
+    submaster'ов (из levels), и упорядочиваются по зависимостям
+    (см. dmxctrldata.resolve_derived()).
+    На кадре выражение пересчитывается только при изменении его входных
+    значений.
+
+    Атрибуты экземпляра класса:
+        plan        - список списков из пяти элементов: индекс
+                      вычисляемого канала, функция выражения, функция
+                      выбора входных значений из кадра и levels, входные
+                      значения при предыдущем расчёте (или None)
+                      и результат предыдущего расчёта;
+        levels      - bytearray, уровни submaster'ов, используемых
+                      выражениями;
+        submasters  - словарь, где ключи - экземпляры Submaster,
+                      а значения - индексы их уровней в levels;
+        levelsChanged - булевское значение, True, если уровни
+                      изменились после предыдущего расчёта."""
+
+    def __init__(self):
+        self.plan = []
+        self.levels = bytearray()
+        self.submasters = dict()
+        self.levelsChanged = False
+
+    def reset(self):
+        self.plan.clear()
+        self.levels = bytearray()
+        self.submasters.clear()
+        self.levelsChanged = False
+
+    @staticmethod
+    def __tuple_getter(indexes):
+        """Возвращает функцию, выбирающую из последовательности кортеж
+        элементов с индексами indexes."""
+
+        if len(indexes) > 1:
+            return itemgetter(*indexes)
+        elif indexes:
+            return lambda seq, ix=indexes[0]: (seq[ix],)
+
+        return lambda seq: ()
+
+    def setup(self, console, size):
+        """Компиляция выражений консоли console (экземпляра DMXControls)
+        для кадра из size каналов.
+        В случае ошибок генерирует ValueError."""
+
+        self.reset()
+
+        for d, inputs in resolve_derived(console):
+            if d.channel > size:
+                raise ValueError('derived channel %d is out of range 1..%d' % (d.channel, size))
+
+            channels = []
+            levels = []
+
+            for name, src in zip(d.names, inputs):
+                if isinstance(src, Submaster):
+                    ix = self.submasters.get(src)
+                    if ix is None:
+                        ix = self.submasters[src] = len(self.levels)
+                        self.levels.append(src.value)
+
+                    levels.append((name, ix))
+                else:
+                    if src > size:
+                        raise ValueError('expression "%s": channel %d is out of range 1..%d' % (d.expr, src, size))
+
+                    channels.append((name, src - 1))
+
+            tree = d.parseExpression()
+
+            # имена заменяются элементами кортежа входных значений:
+            # сначала значения каналов, затем уровни
+            argnames = {name: ix for ix, (name, _) in enumerate(channels + levels)}
+
+            class __Args(ast.NodeTransformer):
+                def visit_Name(self, node):
+                    ix = argnames.get(node.id)
+                    if ix is None:
+                        return node
+
+                    return ast.copy_location(ast.Subscript(ast.Name('_v', ast.Load()),
+                        ast.Constant(ix), ast.Load()), node)
+
+                def visit_BinOp(self, node):
+                    self.generic_visit(node)
+
+                    if not isinstance(node.op, ast.Pow):
+                        return node
+
+                    # a ** b -> _pow(a, b), см. Derived.power()
+                    return ast.copy_location(ast.Call(ast.Name('_pow', ast.Load()),
+                        [node.left, node.right], []), node)
+
+            # выражение -> lambda _v: выражение
+            tree = ast.Expression(ast.Lambda(ast.arguments([], [ast.arg('_v')], None, [], [], None, []),
+                __Args().visit(tree).body))
+
+            code = compile(ast.fix_missing_locations(tree), '<derived channel %d>' % d.channel, 'eval')
+            func = eval(code, {'__builtins__': {}, '_pow': Derived.power, **Derived.EXPR_FUNCTIONS})
+
+            getter = self.__tuple_getter([ix for _, ix in channels])
+            if levels:
+                getter = lambda frame, fg=getter, lg=self.__tuple_getter([ix for _, ix in levels]), lv=self.levels: fg(frame) + lg(lv)
+
+            self.plan.append([d.channel - 1, func, getter, None, 0])
+
+    def set_level(self, sub, level):
+        """Изменение уровня submaster'а sub (экземпляра Submaster)."""
+
+        ix = self.submasters.get(sub)
+        if ix is not None and self.levels[ix] != level:
+            self.levels[ix] = level
+            self.levelsChanged = True
+
+    def apply(self, frame):
+        """Расчёт значений вычисляемых каналов в frame (bytearray)."""
+
+        self.levelsChanged = False
+
+        for item in self.plan:
+            ix, func, getter, last, value = item
+
+            args = getter(frame)
+            if args != last:
+                try:
+                    value = max(0, min(255, round(func(args))))
+                except (ArithmeticError, TypeError, ValueError):
+                    value = 0
+
+                item[3] = args
+                item[4] = value
+
+            frame[ix] = value
+
+
+class SmoothingStage():
+    """Ограничение скорости изменения (атрибут slew) и экспоненциальное
+    сглаживание (атрибут smooth) значений каналов перед выводом.
+
+    Каналы с одинаковой разрядностью объединяются в группы, значения
+    всех каналов группы рассчитываются на кадре одной последовательностью
+    операций над списками (map), а в кадр переносятся срезами - по одному
+    на каждую последовательность соседних каналов. Если таких каналов
+    в консоли нет, групп нет, и расчёт не выполняется.
+
+    Атрибуты экземпляра класса:
+        groups      - список экземпляров SmoothingGroup (8- и 16-битные
+                      каналы);
+        lastTime    - время расчёта предыдущего кадра или None."""
+
+    def __init__(self):
+        self.groups = []
+        self.lastTime = None
+
+    def reset(self):
+        self.groups.clear()
+        self.lastTime = None
+
+    def setup(self, levels, size):
+        """Подготовка групп каналов.
+
+        levels  - список экземпляров Level с ненулевыми атрибутами
+                  slew и/или smooth;
+        size    - количество каналов в кадре."""
+
+        self.reset()
+
+        items = ([], [])
+        used = set()
+
+        for ctrl in levels:
+            fine = isinstance(ctrl, Level) and ctrl.fine
+            # 16-битное значение - один элемент группы из двух каналов
+            step = 2 if fine else 1
+            stop = min(ctrl.channel - 1 + ctrl.getNChannels(), size)
+
+            for ix in range(ctrl.channel - 1, stop - step + 1, step):
+                if ix in used or ix + step - 1 in used:
+                    continue
+
+                used.update(range(ix, ix + step))
+                items[fine].append((ix, ctrl.slew, ctrl.smooth))
+
+        for fine, group in enumerate(items):
+            if group:
+                self.groups.append(SmoothingGroup(sorted(group), fine))
+
+    def update(self, frame, now):
+        """Расчёт сглаженных значений для кадра frame (значения каналов
+        после смешивания), выводимого в момент now.
+        Возвращает True, если сглаженные значения изменились."""
+
+        dt = 0.0 if self.lastTime is None else now - self.lastTime
+        self.lastTime = now
+
+        changed = False
+
+        for group in self.groups:
+            if group.update(frame, dt):
+                changed = True
+
+        return changed
+
+    def apply(self, frame):
+        """Запись сглаженных значений в frame (bytearray)."""
+
+        for group in self.groups:
+            group.apply(frame)
+
+
+class SmoothingGroup():
+    """Группа каналов одной разрядности для SmoothingStage.
+
+    Атрибуты экземпляра класса:
+        fine        - булевское значение, True для 16-битных значений
+                      (пар каналов - старший и младший байты);
+        getter      - функция, возвращающая кортеж значений каналов
+                      группы из кадра (для 16-битных - старших
+                      и младших байтов);
+        rates       - array('d'), максимальные скорости изменения
+                      значений в секунду (inf - без ограничения);
+        rcpTimes    - array('d'), величины, обратные постоянным времени
+                      сглаживания (inf - без сглаживания);
+        targets     - кортеж значений каналов в кадре на момент
+                      предыдущего расчёта или None;
+        values      - список вещественных, текущие сглаженные значения
+                      или None;
+        output      - bytes, сглаженные значения каналов для записи
+                      в кадр;
+        runs        - список кортежей (first, stop, offset) -
+                      последовательности соседних каналов в кадре
+                      и смещения их значений в output;
+        settled     - булевское значение, True, если сглаженные значения
+                      совпадают со значениями в кадре."""
+
+    def __init__(self, items, fine):
+        """items    - список кортежей (индекс канала, slew, smooth),
+                      отсортированный по индексам каналов;
+        fine        - булевское значение, True для 16-битных значений."""
+
+        self.fine = fine
+
+        scale = 257.0 if fine else 1.0
+        inf = float('inf')
+
+        self.rates = array('d', (slew * scale if slew > 0.0 else inf for ix, slew, smooth in items))
+        self.rcpTimes = array('d', (1.0 / smooth if smooth > 0.0 else inf for ix, slew, smooth in items))
+
+        indexes = []
+        for ix, slew, smooth in items:
+            indexes.append(ix)
+            if fine:
+                indexes.append(ix + 1)
+
+        # itemgetter с одним аргументом возвращает не кортеж
+        self.getter = itemgetter(*indexes) if len(indexes) > 1 else lambda frame: (frame[indexes[0]],)
+
+        self.runs = []
+        offset = 0
+        for k, run in groupby(enumerate(indexes), lambda v: v[1] - v[0]):
+            n = len(tuple(run))
+            self.runs.append((indexes[offset], indexes[offset] + n, offset))
+            offset += n
+
+        self.targets = None
+        self.values = None
+        self.output = b''
+        self.settled = True
+
+    def update(self, frame, dt):
+        """Расчёт сглаженных значений через dt секунд после предыдущего
+        расчёта. Возвращает True, если значения изменились."""
+
+        targets = self.getter(frame)
+
+        if self.settled and targets == self.targets:
+            return False
+
+        self.targets = targets
+
+        if self.fine:
+            # пары байт -> 16-битные значения
+            values = tuple(map(add, map(lshift, targets[::2], repeat(8)), targets[1::2]))
+        else:
+            values = targets
+
+        if self.values is None:
+            # первый кадр - значения устанавливаются сразу
+            smoothed = list(map(float, values))
+        elif dt <= 0.0:
+            smoothed = self.values
+        else:
+            # экспоненциальное сглаживание: шаг = разность * (1 - exp(-dt/T)),
+            # затем ограничение шага величиной rate * dt
+            factors = map((1.0).__sub__, map(exp, map((-dt).__mul__, self.rcpTimes)))
+            steps = map(mul, map(sub, values, self.values), factors)
+            limits = tuple(map(dt.__mul__, self.rates))
+
+            smoothed = list(map(add, self.values,
+                map(min, map(max, steps, map(neg, limits)), limits)))
+
+        rounded = list(map(round, smoothed))
+
+        if self.fine:
+            words = array('H', rounded)
+            if sys.byteorder == 'little':
+                words.byteswap()
+
+            output = words.tobytes()
+        else:
+            output = bytes(rounded)
+
+        self.settled = output == bytes(targets)
+        # после завершения перехода дробные остатки не накапливаются
+        self.values = list(map(float, values)) if self.settled else smoothed
+
+        changed = output != self.output
+        self.output = output
+
+        return changed
+
+    def apply(self, frame):
+        output = self.output
+
+        for first, stop, offset in self.runs:
+            frame[first:stop] = output[offset:offset + stop - first]
+
+
+class OutputStage():
+    """Преобразование значений каналов перед выводом: масштабирование
+    общим уровнем (grand master) и уровнями submaster'ов и движков групп
+    (grouplevel), прибавление значений движков групп с mode="offset",
+    затем преобразование кривыми (curve) каналов.
+
+    Для каждого канала рассчитывается множитель (0..255), и для
+    каждой последовательности соседних каналов с одинаковыми
+    множителем и кривой - общая таблица преобразования значений для
+    bytes.translate(), т.е. на каждом кадре преобразование выполняется
+    одним (если у всех каналов одинаковые множители и кривые) или
+    несколькими вызовами translate() над срезами, а таблицы
+    пересчитываются только при изменении уровней.
+
+    Атрибуты экземпляра класса:
+        intensityMask   - bytes, маска каналов яркости (1 - канал
+                          управляет яркостью), масштабируемых
+                          grand master'ом;
+        grandMaster     - целое, уровень grand master (0..255);
+        blackoutLevel   - вещественное, уровень затемнения (0.0..1.0),
+                          изменяется плавно методом blackout();
+        submasters      - словарь, где ключи - экземпляры Submaster
+                          (и GroupLevel с mode="scale"), а значения -
+                          списки из двух элементов: уровня (0..255)
+                          и списка индексов каналов;
+        offsets         - словарь, где ключи - экземпляры GroupLevel
+                          с mode="offset", а значения - списки из двух
+                          элементов: прибавляемого значения (0..255)
+                          и списка индексов каналов;
+        curves          - список таблиц кривых, первый элемент - таблица
+                          линейного преобразования;
+        curveIndexes    - bytes, индексы таблиц в curves для каждого
+                          канала;
+        runs            - список кортежей (first, stop, table) - индексы
+                          первого и следующего за последним каналов
+                          и таблица преобразования; для каналов, значения
+                          которых не изменяются, элементов нет;
+        finePairs       - список индексов старших байтов 16-битных
+                          значений (Level.fine); пары каналов
+                          масштабируются как одно 16-битное значение,
+                          а не по отдельности таблицами;
+        fineRuns        - список кортежей (index, factor, offset, table) -
+                          индекс старшего байта, множитель (0..255),
+                          прибавляемое значение (0..255) и таблица кривой
+                          (None для линейной) для пар, значения которых
+                          изменяются; кривая интерполируется между
+                          соседними значениями таблицы по младшему
+                          байту."""
+
+    def __init__(self, size=DMX_UNIVERSE_SIZE):
+        self.size = size
+        self.tables = dict()
+        # уровни grand master и затемнения относятся не к консоли,
+        # а к UI программы, и при загрузке консоли не сбрасываются
+        self.grandMaster = 255
+        self.blackoutLevel = 1.0
+        self.blackoutFade = None
+        self.runs = []
+        self.reset()
+
+    def reset(self):
+        """Сброс параметров, заданных консолью."""
+
+        self.intensityMask = bytes(self.size)
+        self.submasters = dict()
+        self.offsets = dict()
+        self.curves = [make_curve_table(LINEAR_CURVE)]
+        self.curveIndexes = bytes(self.size)
+        self.finePairs = []
+        self.fineRuns = []
+        self.tables.clear()
+        self.valid = False
+
+    def get_table(self, factor, curve, offset=0):
+        """Возвращает таблицу преобразования для множителя factor (0..255),
+        индекса кривой curve и прибавляемого значения offset."""
+
+        key = (factor, curve, offset)
+        table = self.tables.get(key)
+        if table is None:
+            # композиция преобразований - тем же translate();
+            # прибавляемое значение масштабируется вместе со значением
+            # канала, чтобы grand master и затемнение гасили и его
+            table = bytes(min(v + offset, 255) * factor // 255 for v in range(256)).translate(self.curves[curve])
+            self.tables[key] = table
+
+        return table
+
+    def set_curves(self, curves):
+        """Установка кривых преобразования значений каналов.
+
+        curves  - список кортежей (название, параметр) для каждого
+                  канала (см. Control.strAttrToCurve())."""
+
+        names = [LINEAR_CURVE]
+        self.curves = [make_curve_table(LINEAR_CURVE)]
+        indexes = bytearray(self.size)
+
+        for ix, curve in enumerate(curves[:self.size]):
+            if curve not in names:
+                names.append(curve)
+                self.curves.append(make_curve_table(curve))
+
+            indexes[ix] = names.index(curve)
+
+        self.curveIndexes = bytes(indexes)
+        self.tables.clear()
+        self.valid = False
+
+    def set_fine_pairs(self, indexes):
+        """Установка индексов старших байтов 16-битных значений."""
+
+        self.finePairs = sorted(ix for ix in indexes if ix + 1 < self.size)
+        self.valid = False
+
+    def set_intensity_mask(self, mask):
+        self.intensityMask = bytes(mask)
+        self.valid = False
+
+    def set_grand_master(self, level):
+        self.grandMaster = level
+        self.valid = False
+
+    def add_submaster(self, sub):
+        levels = self.offsets if isinstance(sub, GroupLevel) and sub.mode == 'offset' else self.submasters
+        levels[sub] = [sub.value, [ch - 1 for ch in sub.channels if ch <= self.size]]
+        self.valid = False
+
+    def set_submaster(self, sub, level):
+        (self.offsets if sub in self.offsets else self.submasters)[sub][0] = level
+        self.valid = False
+
+    def blackout(self, now, on):
+        """Плавное затемнение (on=True) или восстановление уровней
+        (on=False), начиная с момента now."""
+
+        self.blackoutFade = (now, self.blackoutLevel, 0.0 if on else 1.0)
+
+    def compile(self):
+        """Пересчёт множителей и таблиц преобразования."""
+
+        gm = self.grandMaster / 255.0 * self.blackoutLevel
+        factors = [gm if m else 1.0 for m in self.intensityMask]
+
+        for level, indexes in self.submasters.values():
+            if level < 255:
+                level /= 255.0
+                for ix in indexes:
+                    factors[ix] *= level
+
+        offsets = [0] * self.size
+
+        for level, indexes in self.offsets.values():
+            if level > 0:
+                for ix in indexes:
+                    offsets[ix] += level
+
+        keys = list(zip(map(round, map((255.0).__mul__, factors)),
+                        self.curveIndexes, map(min, offsets, repeat(255))))
+
+        # 16-битные значения масштабируются целиком (см. apply()),
+        # множитель и кривая берутся от старшего байта
+        self.fineRuns.clear()
+        for ix in self.finePairs:
+            factor, curve, offset = keys[ix]
+
+            if factor < 255 or curve or offset:
+                self.fineRuns.append((ix, factor, offset, self.curves[curve] if curve else None))
+
+            keys[ix] = keys[ix + 1] = (255, 0, 0)
+
+        self.runs.clear()
+        ix = 0
+        for (factor, curve, offset), run in groupby(keys):
+            first = ix
+            ix += len(tuple(run))
+
+            if factor < 255 or curve or offset:
+                self.runs.append((first, ix, self.get_table(factor, curve, offset)))
+
+        self.valid = True
+
+    def update(self, now):
+        """Расчёт уровня затемнения на момент now.
+        Возвращает True, если таблицы преобразования изменились."""
+
+        if self.blackoutFade is not None:
+            start, src, dst = self.blackoutFade
+            p = fade_progress(now, start, BLACKOUT_FADE_TIME)
+
+            self.blackoutLevel = src + (dst - src) * p
+            self.valid = False
+
+            if p >= 1.0:
+                self.blackoutFade = None
+
+        if self.valid:
+            return False
+
+        self.compile()
+        return True
+
+    def apply(self, frame):
+        """Преобразование значений каналов в frame (bytearray)."""
+
+        for first, stop, table in self.runs:
+            frame[first:stop] = frame[first:stop].translate(table)
+
+        for ix, factor, offset, table in self.fineRuns:
+            word = min(((frame[ix] << 8) | frame[ix + 1]) + offset * 257, 65535) * factor // 255
+
+            if table is not None:
+                # линейная интерполяция кривой между соседними
+                # значениями таблицы - без "ступенек" и обратных скачков
+                hi, lo = word >> 8, word & 255
+                a = table[hi] * 257
+                word = a + (table[min(hi + 1, 255)] * 257 - a) * lo // 256
+
+            frame[ix] = word >> 8
+            frame[ix + 1] = word & 255
+
+
+class PatchTable():
+    """Вывод значений логических каналов в физические каналы
+    одного или нескольких universe (см. dmxctrldata.Patch).
+
+    Таблица коммутации компилируется при загрузке консоли в список
+    индексов логических каналов для каждого физического канала
+    каждого universe, на каждом кадре значения выбираются одним
+    вызовом operator.itemgetter() для каждого universe.
+
+    Атрибуты экземпляра класса:
+        universes   - словарь, где ключи - номера universe,
+                      а значения - экземпляры ChannelBuffer
+                      с значениями физических каналов для вывода;
+        getters     - словарь, где ключи - номера universe, а значения -
+                      экземпляры operator.itemgetter, выбирающие значения
+                      физических каналов из значений логических;
+                      пустой, если таблица коммутации не задана
+                      (тогда в universes единственный буфер - буфер
+                      логических каналов)."""
+
+    def __init__(self, output):
+        """output - экземпляр ChannelBuffer, значения логических каналов."""
+
+        self.output = output
+        self.universes = dict()
+        self.getters = dict()
+        self.setup(None)
+
+    def setup(self, console):
+        """Компиляция таблицы коммутации консоли console
+        (экземпляра DMXControls или None)."""
+
+        self.universes.clear()
+        self.getters.clear()
+
+        defUniverse = console.universe if console is not None else 1
+
+        maps = [] if console is None else [m for m in console.walk() if isinstance(m, PatchMap)]
+        if not maps:
+            self.universes[defUniverse] = self.output
+            return
+
+        size = len(self.output)
+        # индекс size указывает на нулевое значение,
+        # добавляемое к значениям логических каналов
+        indexes = dict()
+        patched = set()
+
+        for pm in maps:
+            universe = defUniverse if pm.universe is None else pm.universe
+            index = indexes.setdefault(universe, [size] * size)
+
+            for ix in range(pm.count):
+                index[pm.address - 1 + ix] = pm.channel - 1 + ix
+                patched.add(pm.channel - 1 + ix)
+
+        # незадействованные логические каналы - в те же физические
+        # каналы universe консоли, если они свободны
+        index = indexes.setdefault(defUniverse, [size] * size)
+        targets = set(ix for ix, src in enumerate(index) if src != size)
+
+        for ix in range(size):
+            if ix not in patched and ix not in targets:
+                index[ix] = ix
+
+        for universe, index in indexes.items():
+            self.universes[universe] = ChannelBuffer(size)
+            self.getters[universe] = itemgetter(*index)
+
+    def apply(self):
+        """Перенос значений логических каналов в буферы universe."""
+
+        if self.getters:
+            src = bytes(self.output.data) + b'\x00'
+
+            for universe, getter in self.getters.items():
+                self.universes[universe].assign(bytes(getter(src)))
+
+    def clear(self):
+        """Обнуление значений во всех universe."""
+
+        self.output.clear()
+
+        for buf in self.universes.values():
+            buf.clear()
+
+
+class FrameStats():
+    """Статистика времени расчёта кадров (для оценки нагрузки на CPU).
+
+    Атрибуты экземпляра класса:
+        frames  - целое, количество рассчитанных кадров;
+        stages  - словарь, где ключи - строки, названия этапов расчёта
+                  кадра ("frame" - весь кадр), а значения - списки
+                  из трёх вещественных: общее, максимальное и последнее
+                  время выполнения этапа в секундах."""
+
+    def __init__(self):
+        self.reset()
+
+    def reset(self):
+        self.frames = 0
+        self.stages = dict()
+
+    def add(self, stage, t):
+        st = self.stages.get(stage)
+        if st is None:
+            self.stages[stage] = [t, t, t]
+        else:
+            st[0] += t
+            if t > st[1]:
+                st[1] = t
+            st[2] = t
+
+        if stage == 'frame':
+            self.frames += 1
+
+    def __str__(self):
+        if not self.frames:
+            return 'no frames'
+
+        return '%d frame(s); %s' % (self.frames,
+            '; '.join(map(lambda i: '%s: avg %.3f ms, max %.3f ms' % (i[0],
+                                    i[1][0] * 1000.0 / self.frames,
+                                    i[1][1] * 1000.0),
+                          self.stages.items())))
+
+
+class DMXEngine():
+    """Расчёт кадров, выводимых в DMX.
+
+    Атрибуты экземпляра класса:
+        merger      - экземпляр SourceMerger;
+        channels    - экземпляр ChannelBuffer, значения каналов,
+                      заданные контролами UI (буфер источника "ui");
+        uiFades     - экземпляр FadeScheduler, плавные переходы значений
+                      в self.channels (см. set_ui_values());
+        inputUniverse - целое, номер universe для входа DMX или None;
+        output      - экземпляр ChannelBuffer, значения логических
+                      каналов для вывода (см. patch);
+        cueStacks   - словарь, где ключи - экземпляры CueList (и Chase),
+                      а значения - соответствующие им экземпляры
+                      CueStack (ChaseStack);
+        effects     - словарь, где ключи - экземпляры Effect,
+                      а значения - соответствующие им экземпляры
+                      EffectGenerator;
+        timelines   - словарь, где ключи - экземпляры Timeline,
+                      а значения - соответствующие им экземпляры
+                      TimelineSequencer;
+        timelineFades - экземпляр FadeScheduler, общий для всех
+                      Timeline (буфер источника "timeline");
+        derived     - экземпляр DerivedStage;
+        smoothing   - экземпляр SmoothingStage;
+        outputStage - экземпляр OutputStage;
+        patch       - экземпляр PatchTable;
+        frame       - bytes, значения каналов до преобразования
+                      экземпляром OutputStage;
+        stats       - экземпляр FrameStats."""
+
+    def __init__(self):
+        self.merger = SourceMerger()
+        self.channels = self.merger.sources['ui'].buffer
+        self.uiFades = FadeScheduler(self.channels)
+        self.inputUniverse = None
+        self.output = ChannelBuffer()
+        self.cueStacks = dict()
+        self.effects = dict()
+        self.timelines = dict()
+        self.timelineFades = FadeScheduler(self.merger.sources['timeline'].buffer)
+        self.derived = DerivedStage()
+        self.smoothing = SmoothingStage()
+        self.outputStage = OutputStage()
+        self.patch = PatchTable(self.output)
+        self.frame = bytes(len(self.output))
+        self.stats = FrameStats()
+
+    def setup(self, console):
+        """Подготовка к выводу кадров для консоли console
+        (экземпляра DMXControls или None)."""
+
+        self.merger.reset()
+        self.uiFades.clear()
+        self.inputUniverse = None
+        self.output.clear()
+        self.cueStacks.clear()
+        self.effects.clear()
+        self.timelines.clear()
+        self.timelineFades.clear()
+        self.derived.reset()
+        self.smoothing.reset()
+        self.outputStage.reset()
+        self.patch.setup(console)
+        self.frame = bytes(len(self.output))
+        self.stats.reset()
+        self.cuesActive = None
+        self.setEffectsActive = None
+        # эффекты с mode="scale", применённые к предыдущему кадру
+        self.scaleEffects = []
+
+        if console is None:
+            return
+
+        size = len(self.output)
+        uimask = bytearray(size)
+        intensity = bytearray(size)
+        curves = [LINEAR_CURVE] * size
+        patchCurves = []
+        timelines = []
+        smoothed = []
+        finePairs = []
+        ltp = bytearray(b'\x01' if console.merge == 'ltp' else b'\x00') * size
+
+        for ctrl in console.walk():
+            if isinstance(ctrl, Regulator):
+                first = ctrl.channel - 1
+                stop = min(first + ctrl.getNChannels(), size)
+                uimask[first:stop] = b'\x01' * (stop - first)
+
+                if ctrl.intensity:
+                    intensity[first:stop] = b'\x01' * (stop - first)
+
+                if isinstance(ctrl, Level) and ctrl.fine:
+                    finePairs.append(first)
+
+                if ctrl.curve != LINEAR_CURVE:
+                    # у 16-битных движков кривая задаётся для старшего
+                    # байта и интерполируется по младшему (см. OutputStage)
+                    cstop = first + 1 if isinstance(ctrl, Level) and ctrl.fine else stop
+                    curves[first:cstop] = [ctrl.curve] * (cstop - first)
+
+                if isinstance(ctrl, Submaster):
+                    self.outputStage.add_submaster(ctrl)
+                elif isinstance(ctrl, Level) and (ctrl.slew or ctrl.smooth):
+                    smoothed.append(ctrl)
+
+                if ctrl.merge is not None:
+                    ltp[first:stop] = (b'\x01' if ctrl.merge == 'ltp' else b'\x00') * (stop - first)
+            elif isinstance(ctrl, Chase):
+                self.cueStacks[ctrl] = ChaseStack(ctrl, size)
+            elif isinstance(ctrl, CueList):
+                self.cueStacks[ctrl] = CueStack(ctrl, size)
+            elif isinstance(ctrl, Effect):
+                self.effects[ctrl] = EffectGenerator(ctrl)
+            elif isinstance(ctrl, Source):
+                self.merger.set_priority(ctrl.name, ctrl.priority)
+                if ctrl.universe is not None:
+                    self.inputUniverse = ctrl.universe
+            elif isinstance(ctrl, PatchMap):
+                if ctrl.curve is not None:
+                    patchCurves.append(ctrl)
+            elif isinstance(ctrl, Timeline):
+                timelines.append(ctrl)
+
+        # события Timeline ссылаются на сцены и эффекты по именам
+        if timelines:
+            namedCueStacks = {c.name: stk for c, stk in self.cueStacks.items() if c.name}
+            namedEffects = {c.name: fx for c, fx in self.effects.items() if c.name}
+            timelineMask = bytes(size)
+
+            for tl in timelines:
+                seq = TimelineSequencer(tl, self.timelineFades, namedCueStacks, namedEffects)
+                self.timelines[tl] = seq
+                timelineMask = bytes(map(or_, timelineMask, seq.get_mask(size)))
+
+            self.merger.sources['timeline'].set_mask(timelineMask)
+
+        # каналы, не занятые контролами, по умолчанию тоже считаются
+        # каналами яркости - их значения задают сцены, эффекты и т.п.
+        if console.intensity:
+            intensity = bytearray(i | (not o) for i, o in zip(intensity, uimask))
+
+        # кривые из таблицы коммутации перекрывают кривые контролов
+        for pm in patchCurves:
+            curves[pm.channel - 1:pm.channel - 1 + pm.count] = [pm.curve] * pm.count
+
+        if smoothed:
+            self.smoothing.setup(smoothed, size)
+
+        self.derived.setup(console, size)
+
+        self.merger.sources['ui'].set_mask(uimask)
+        self.merger.set_ltp_channels(ltp)
+        self.outputStage.set_intensity_mask(intensity)
+        self.outputStage.set_fine_pairs(finePairs)
+        self.merger.set_fine_pairs(finePairs)
+
+        for fx in self.effects.values():
+            fx.set_fine_pairs(finePairs)
+        self.outputStage.set_curves(curves)
+
+    def set_default_values(self, console):
+        """Установка начальных значений каналов контролов консоли
+        console (при работе без UI, когда значения не задаются
+        виджетами)."""
+
+        for ctrl in console.walk():
+            if isinstance(ctrl, Regulator) and ctrl.getNChannels():
+                self.channels.set_values(ctrl.channel, ctrl.getDefaultValues())
+
+    def set_ui_values(self, channel, values, now=None, fade=0.0):
+        """Установка значений каналов контролами UI (источник "ui").
+
+        channel - номер первого канала (от 1);
+        values  - значения (см. ChannelBuffer.set_values());
+        now     - время начала перехода (по time.monotonic()),
+                  используется, если fade > 0;
+        fade    - время плавного перехода в секундах; если 0 - значения
+                  устанавливаются сразу.
+
+        Незавершённые переходы для тех же каналов отменяются."""
+
+        if fade > 0.0:
+            self.uiFades.start(channel, values, now, fade)
+        else:
+            if self.uiFades.fades:
+                first = self.channels.check_range(channel, len(values))
+                self.uiFades.cancel(first, first + len(values))
+
+            self.channels.set_values(channel, values)
+
+    def set_submaster(self, sub, level):
+        """Изменение уровня submaster'а или движка группы sub
+        (экземпляра Submaster)."""
+
+        self.outputStage.set_submaster(sub, level)
+        self.derived.set_level(sub, level)
+
+    def set_remote_values(self, channel, values):
+        """Установка значений каналов внешней программой (источник "remote")."""
+
+        self.merger.sources['remote'].set_values(channel, values)
+
+    def recall_scene(self, data, mask=None):
+        """Установка значений каналов сцены (источник "scene").
+
+        data    - значения каналов (bytes);
+        mask    - маска каналов, значения которых задаёт сцена
+                  (bytes со значениями 0 и 1), или None - все каналы."""
+
+        size = len(self.output)
+        src = self.merger.sources['scene']
+
+        src.buffer.assign(data[:size].ljust(size, b'\x00'))
+        src.set_mask(mask[:size].ljust(size, b'\x00') if mask is not None else b'\x01' * size)
+
+    def release_scene(self):
+        """Отключение источника "scene"."""
+
+        self.merger.sources['scene'].set_mask(bytes(len(self.output)))
+
+    def set_input_values(self, values):
+        """Установка значений каналов, принятых со входа DMX
+        (источник "input")."""
+
+        self.merger.sources['input'].set_values(1, values[:len(self.output)])
+
+    def __update_cues(self, now):
+        changed = False
+
+        for cstk in self.cueStacks.values():
+            if cstk.render(now):
+                changed = True
+
+        # источник "cues" задаёт значения только каналов, используемых
+        # выбранными сценами или переходом к ним
+        active = tuple(map(lambda c: c.current >= 0 or c.fading, self.cueStacks.values()))
+        if active != self.cuesActive:
+            self.cuesActive = active
+
+            mask = bytes(len(self.output))
+            for cstk, act in zip(self.cueStacks.values(), active):
+                if act:
+                    mask = bytes(map(or_, mask, cstk.mask))
+
+            self.merger.sources['cues'].set_mask(mask)
+
+        if changed:
+            # значения сцен из разных cuelist смешиваются по принципу HTP
+            outputs = [cstk.output.data for cstk in self.cueStacks.values()]
+
+            self.merger.sources['cues'].buffer.assign(
+                outputs[0] if len(outputs) == 1 else bytes(map(max, *outputs)))
+
+    def __update_effects(self, now):
+        # эффекты с mode="set" - источник "effects",
+        # с mode="scale" - изменяют уже смешанные значения
+        setEffects = [fx for fx in self.effects.values() if fx.active and fx.effect.mode == 'set']
+
+        active = tuple(setEffects)
+        if active != self.setEffectsActive:
+            self.setEffectsActive = active
+
+            mask = bytearray(len(self.output))
+            for fx in setEffects:
+                mask[fx.first:fx.stop] = bytes(map(or_, mask[fx.first:fx.stop], fx.channelMask))
+
+            self.merger.sources['effects'].set_mask(mask)
+
+        if setEffects:
+            frame = bytearray(len(self.output))
+
+            for fx in setEffects:
+                fx.apply(frame, now)
+
+            self.merger.sources['effects'].buffer.assign(frame)
+
+    def render(self, now):
+        """Расчёт значений каналов для кадра, выводимого в момент now
+        (вещественное, в секундах, по time.monotonic()).
+        Результат помещается в self.output (логические каналы)
+        и в буферы self.patch.universes (физические каналы), при наличии
+        изменений они будут отмечены в атрибутах dirty* буферов."""
+
+        t0 = perf_counter()
+
+        # переходы значений, заданных контролами UI, рассчитываются
+        # для всех контролов сразу, до смешивания источников
+        self.uiFades.render(now)
+
+        tcues = t0
+
+        if self.timelines:
+            for seq in self.timelines.values():
+                seq.render(now)
+
+            self.timelineFades.render(now)
+
+            tcues = perf_counter()
+            self.stats.add('timeline', tcues - t0)
+
+        if self.cueStacks:
+            self.__update_cues(now)
+
+        t1 = perf_counter()
+        self.stats.add('cues', t1 - tcues)
+
+        if self.effects:
+            self.__update_effects(now)
+
+        t2 = perf_counter()
+
+        changed = self.merger.merge()
+
+        t3 = perf_counter()
+        self.stats.add('merge', t3 - t2)
+
+        scaleEffects = [fx for fx in self.effects.values() if fx.active and fx.effect.mode == 'scale']
+
+        # при выключении эффекта кадр надо пересчитать без него,
+        # даже если смешанные значения не изменились
+        if scaleEffects != self.scaleEffects:
+            self.scaleEffects = scaleEffects
+            changed = True
+
+        if changed or scaleEffects or self.derived.levelsChanged:
+            frame = bytearray(self.merger.output)
+
+            for fx in scaleEffects:
+                fx.apply(frame, now)
+
+            if self.derived.plan:
+                self.derived.apply(frame)
+
+            self.frame = bytes(frame)
+            changed = True
+
+        t4 = perf_counter()
+        self.stats.add('effects', t2 - t1 + t4 - t3)
+
+        # сглаживание рассчитывается на каждом кадре, пока сглаженные
+        # значения не совпадут со смешанными
+        smoothing = self.smoothing.groups and self.smoothing.update(self.frame, now)
+
+        # уровни grand master и submaster'ов применяются к копии
+        # значений каналов непосредственно перед выводом
+        if self.outputStage.update(now) or changed or smoothing:
+            frame = bytearray(self.frame)
+            self.smoothing.apply(frame)
+            self.outputStage.apply(frame)
+
+            if self.output.assign(frame):
+                self.patch.apply()
+
+        t5 = perf_counter()
+        self.stats.add('masters', t5 - t4)
+        self.stats.add('frame', t5 - t0)
+
+
+if __name__ == '__main__':
+    print('[debugging %s]' % __file__)
+
+    # затемнение гасит и каналы движка группы с mode="offset"
+    stage = OutputStage(8)
+    grp = GroupLevel()
+    grp.mode = 'offset'
+    grp.value = 100
+    grp.channels = [1, 2]
+    stage.add_submaster(grp)
+    stage.set_intensity_mask(b'\x01' * 8)
+    stage.set_fine_pairs([2])
+
+    frame = bytearray(b'\x80' * 8)
+    stage.update(0.0)
+    stage.apply(frame)
+    print(frame.hex())
+
+    stage.blackout(0.0, True)
+    stage.update(BLACKOUT_FADE_TIME)
+    frame = bytearray(b'\x80' * 8)
+    stage.apply(frame)
+    print(frame.hex())
+    assert frame == bytes(8), 'blackout must give zero output'
@@ -0,0 +1,184 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+""" This file is part of DMXCtrl.
+
+    DMXCtrl is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    DMXCtrl is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with DMXCtrl.  If not, see <http://www.gnu.org/licenses/>."""
+
+
+from math import sin, pi
+from random import Random
+from itertools import repeat
+from operator import mul, floordiv, and_, or_
+
+
+# количество шагов (значений волны) на период
+WAVE_STEPS = 256
+
+# таблица псевдослучайных значений для волны "random";
+# генератор инициализируется константой, чтобы эффект
+# при одинаковом времени давал одинаковые значения
+# (напр. при просчёте кадров без вывода в DMX)
+__rnd = Random(0x444d58)
+NOISE_TABLE = bytes(__rnd.getrandbits(8) for i in range(4096))
+del __rnd
+
+
+def make_wave_table(wave):
+    """Возвращает bytes длиной WAVE_STEPS - значения (0..255)
+    периодической волны wave (см. dmxctrldata.Effect.EFFECT_WAVES)
+    или None для непериодических волн."""
+
+    if wave == 'sine':
+        # начинаем с минимального значения, как и прочие волны
+        return bytes(round(127.5 - 127.5 * sin(pi / 2 - 2 * pi * i / WAVE_STEPS)) for i in range(WAVE_STEPS))
+    elif wave == 'ramp':
+        return bytes(i * 255 // (WAVE_STEPS - 1) for i in range(WAVE_STEPS))
+    elif wave == 'square':
+        return bytes(255 if i >= WAVE_STEPS // 2 else 0 for i in range(WAVE_STEPS))
+    else:
+        return None
+
+
+class EffectGenerator():
+    """Генератор значений для Effect.
+
+    Значения каналов для всех приборов эффекта рассчитываются
+    заранее, для каждого из WAVE_STEPS шагов периода, потому на
+    каждом кадре остаётся выбрать готовый кадр эффекта и применить
+    его к значениям каналов одной операцией над срезом, независимо
+    от количества приборов.
+
+    Атрибуты экземпляра класса:
+        effect      - экземпляр dmxctrldata.Effect;
+        active      - булевское значение, True, если эффект включен;
+        first, stop - целые, индексы первого канала первого прибора
+                      и следующего за последним каналом последнего
+                      прибора;
+        frames      - список bytes - кадры эффекта для каждого шага
+                      периода (для волны "random" - None);
+        finePairs   - список индексов (относительно first) старших
+                      байтов 16-битных значений в диапазоне эффекта;
+                      с mode="scale" пара масштабируется как одно
+                      значение."""
+
+    def __init__(self, effect):
+        self.effect = effect
+        self.active = effect.active
+
+        self.first = effect.channel - 1
+        self.stop = self.first + effect.stride * (effect.count - 1) + effect.width
+        self.finePairs = []
+
+        # сдвиги фаз приборов в шагах периода;
+        # spread=360 равномерно распределяет фазы по всему периоду
+        self.fixtureOffsets = [round(effect.spread / 360.0 * WAVE_STEPS * ix / effect.count) % WAVE_STEPS
+                               for ix in range(effect.count)]
+
+        # маска незанятых приборами каналов внутри диапазона
+        # (для mode="set" при stride > width)
+        self.contiguous = effect.stride == effect.width
+        mask = bytearray(b'\xff' * (self.stop - self.first))
+        for ix in range(effect.count):
+            fxs = ix * effect.stride
+            mask[fxs:fxs + effect.width] = bytes(effect.width)
+
+        self.gapMask = bytes(mask)
+        # и маска каналов приборов
+        self.channelMask = bytes(mask).translate(bytes.maketrans(b'\x00\xff', b'\x01\x00'))
+
+        table = make_wave_table(effect.wave)
+        if table is None:
+            self.frames = None
+            self.lastCycles = None
+            self.lastFrame = None
+        else:
+            self.frames = [self.make_frame([table[(step + off) % WAVE_STEPS] for off in self.fixtureOffsets])
+                           for step in range(WAVE_STEPS)]
+
+    def set_fine_pairs(self, indexes):
+        """Установка индексов (в кадре universe) старших байтов
+        16-битных значений."""
+
+        self.finePairs = [ix - self.first for ix in indexes if self.first <= ix and ix + 1 < self.stop]
+
+    def make_frame(self, levels):
+        """Возвращает bytes - кадр эффекта для диапазона каналов
+        first..stop-1.
+
+        levels  - список целых, значения волны (0..255) для каждого
+                  прибора."""
+
+        size = self.effect.size
+
+        if self.effect.mode == 'scale':
+            # множители (0..255) значений каналов;
+            # каналы вне приборов не изменяются
+            gap = 255
+            values = [255 - size * (255 - w) // 255 for w in levels]
+        else:
+            gap = 0
+            values = [min(255, self.effect.offset + size * w // 255) for w in levels]
+
+        frame = bytearray([gap]) * (self.stop - self.first)
+        width = self.effect.width
+
+        for ix, v in enumerate(values):
+            fxs = ix * self.effect.stride
+            frame[fxs:fxs + width] = bytes((v,)) * width
+
+        return bytes(frame)
+
+    def get_frame(self, now):
+        """Возвращает кадр эффекта для момента времени now."""
+
+        pos = int(now * self.effect.rate * WAVE_STEPS)
+
+        if self.frames is not None:
+            return self.frames[pos % WAVE_STEPS]
+
+        # волна "random": новое значение для каждого прибора
+        # на каждом периоде, кадр пересчитывается только при смене
+        # периода хотя бы у одного из приборов
+        cycles = [(pos + off) // WAVE_STEPS for off in self.fixtureOffsets]
+        if cycles != self.lastCycles:
+            self.lastCycles = cycles
+            self.lastFrame = self.make_frame([NOISE_TABLE[(cycle * 131 + ix * 17) % len(NOISE_TABLE)]
+                                              for ix, cycle in enumerate(cycles)])
+
+        return self.lastFrame
+
+    def apply(self, frame, now):
+        """Изменение значений каналов.
+
+        frame   - bytearray, значения всех каналов universe;
+        now     - вещественное, время в секундах."""
+
+        fxf = self.get_frame(now)
+
+        if self.effect.mode == 'scale':
+            values = frame[self.first:self.stop]
+            scaled = bytearray(map(floordiv, map(mul, values, fxf), repeat(255)))
+
+            for ix in self.finePairs:
+                word = ((values[ix] << 8) | values[ix + 1]) * fxf[ix] // 255
+                scaled[ix] = word >> 8
+                scaled[ix + 1] = word & 255
+
+            frame[self.first:self.stop] = scaled
+        elif self.contiguous:
+            frame[self.first:self.stop] = fxf
+        else:
+            frame[self.first:self.stop] = bytes(map(or_,
+                map(and_, frame[self.first:self.stop], self.gapMask), fxf))
@@ -0,0 +1,544 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+""" This file is part of DMXCtrl.
+
+    DMXCtrl is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    DMXCtrl is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with DMXCtrl.  If not, see <http://www.gnu.org/licenses/>."""
+
+
+""" Запись кадров, отосланных в DMX, в файл ("запись шоу")
+    и воспроизведение записи.
+    Модуль не должен импортировать GTK.
+
+    Формат файла записи (все целые - little endian):
+        заголовок   - SHOW_MAGIC, версия формата (uint16), время начала
+                      записи (double, секунды с начала эпохи);
+        записи      - последовательность записей кадров (см. ниже);
+        индекс      - записывается при завершении записи: количество
+                      элементов (uint32), затем элементы - время (double)
+                      и смещение в файле (uint64) первой записи каждой
+                      группы ключевых кадров;
+        окончание   - смещение индекса в файле (uint64) и INDEX_MAGIC.
+
+    Если запись не была завершена нормально (индекса нет), файл
+    остаётся пригодным для воспроизведения - индекс строится заново
+    просмотром записей.
+
+    Запись кадра: тип (байт), время от начала записи в секундах (double),
+    номер universe (uint16), затем:
+        K (ключевой кадр)   - длина данных (uint16) и значения каналов;
+        D (изменения)       - количество диапазонов (uint16), затем для
+                              каждого диапазона - смещение (uint16),
+                              длина (uint16) и новые значения каналов.
+
+    Ключевые кадры для всех universe записываются подряд, с одним
+    временем, через каждые KEYFRAME_INTERVAL секунд."""
+
+
+import os
+import mmap
+import threading
+from bisect import bisect_right
+from queue import SimpleQueue
+from struct import Struct, error as struct_error
+from time import monotonic, time
+
+from dmxctrlbuf import ChannelBuffer
+
+
+SHOW_FILE_EXT = '.dmxshow'
+
+SHOW_MAGIC = b'DMXSHOW\x00'
+INDEX_MAGIC = b'DMXSIDX\x00'
+SHOW_FORMAT_VERSION = 1
+
+# интервал между ключевыми кадрами в секундах
+KEYFRAME_INTERVAL = 2.0
+
+REC_KEYFRAME = b'K'
+REC_DELTA = b'D'
+
+SHOW_HEADER = Struct('<8sHd')
+FRAME_HEADER = Struct('<cdH')
+FRAME_COUNT = Struct('<H')
+DELTA_RANGE = Struct('<HH')
+INDEX_COUNT = Struct('<I')
+INDEX_ENTRY = Struct('<dQ')
+INDEX_TRAILER = Struct('<Q8s')
+
+# неизменившиеся участки короче этого значения включаются в диапазон
+# изменений - заголовок нового диапазона занимает столько же места
+DELTA_MIN_GAP = DELTA_RANGE.size
+
+
+def get_changed_ranges(prev, cur):
+    """Возвращает список кортежей (смещение, длина) участков,
+    различающихся в prev и cur (bytestring'ах одинаковой длины).
+    Участки, разделённые менее чем DELTA_MIN_GAP одинаковыми байтами,
+    объединяются."""
+
+    ranges = []
+
+    start = None
+    last = None
+
+    for ix, (a, b) in enumerate(zip(prev, cur)):
+        if a != b:
+            if start is None:
+                start = ix
+            elif ix - last > DELTA_MIN_GAP:
+                ranges.append((start, last - start + 1))
+                start = ix
+
+            last = ix
+
+    if start is not None:
+        ranges.append((start, last - start + 1))
+
+    return ranges
+
+
+class ShowRecorder():
+    """Запись кадров в файл.
+
+    Метод record() вызывается из цикла вывода кадров и только ставит
+    копию кадра в очередь; вычисление изменений и запись в файл
+    производятся отдельным потоком, так что запись не задерживает
+    вывод в DMX.
+
+    Атрибуты экземпляра класса:
+        filename    - имя файла записи;
+        startTime   - время начала записи (по time.monotonic());
+        error       - None или экземпляр исключения, если при записи
+                      произошла ошибка (запись после этого прекращается)."""
+
+    def __init__(self, filename, startTime=None, recordTime=None):
+        """Параметры:
+            filename    - имя файла записи;
+            startTime   - время начала записи по time.monotonic()
+                          или None для текущего времени;
+            recordTime  - время начала записи, сохраняемое в файле
+                          (секунды с начала эпохи), или None для текущего
+                          времени (для получения одинаковых файлов
+                          при повторном расчёте можно указать 0)."""
+
+        self.filename = filename
+        self.error = None
+
+        self.file = open(filename, 'wb')
+        self.file.write(SHOW_HEADER.pack(SHOW_MAGIC, SHOW_FORMAT_VERSION,
+            time() if recordTime is None else recordTime))
+
+        self.startTime = monotonic() if startTime is None else startTime
+
+        # последние записанные значения каналов по номерам universe
+        self.frames = dict()
+        self.nextKeyframe = 0.0
+        self.index = []
+
+        self.queue = SimpleQueue()
+        self.writer = threading.Thread(target=self.__writer, name='ShowRecorder', daemon=True)
+        self.writer.start()
+
+    def record(self, universe, data, now=None):
+        """Постановка в очередь на запись кадра.
+
+        universe    - целое, номер universe;
+        data        - значения каналов (bytes, bytearray и т.п.);
+        now         - время отсылки кадра (по time.monotonic())
+                      или None для текущего времени."""
+
+        if self.queue is not None:
+            self.queue.put(((monotonic() if now is None else now) - self.startTime, universe, bytes(data)))
+
+    def __write_keyframe(self, t, universe, data):
+        self.file.write(FRAME_HEADER.pack(REC_KEYFRAME, t, universe))
+        self.file.write(FRAME_COUNT.pack(len(data)))
+        self.file.write(data)
+
+    def __write_keyframes(self, t):
+        self.index.append((t, self.file.tell()))
+
+        for universe, data in self.frames.items():
+            self.__write_keyframe(t, universe, data)
+
+        self.nextKeyframe = t + KEYFRAME_INTERVAL
+
+    def __write_frame(self, t, universe, data):
+        prev = self.frames.get(universe)
+        self.frames[universe] = data
+
+        if t >= self.nextKeyframe:
+            self.__write_keyframes(t)
+            return
+
+        if prev is None or len(prev) != len(data):
+            # первый кадр universe (или изменился его размер) - ключевой
+            # кадр только этого universe, без записи в индекс; при
+            # перемотке к предыдущему ключевому кадру он будет прочитан
+            # вместе с прочими записями
+            self.__write_keyframe(t, universe, data)
+            return
+
+        ranges = get_changed_ranges(prev, data)
+        if not ranges:
+            return
+
+        self.file.write(FRAME_HEADER.pack(REC_DELTA, t, universe))
+        self.file.write(FRAME_COUNT.pack(len(ranges)))
+
+        for offset, length in ranges:
+            self.file.write(DELTA_RANGE.pack(offset, length))
+            self.file.write(data[offset:offset + length])
+
+    def __writer(self):
+        while True:
+            item = self.queue.get()
+            if item is None:
+                break
+
+            if self.error is None:
+                try:
+                    self.__write_frame(*item)
+                except Exception as ex:
+                    self.error = ex
+
+    def close(self):
+        """Завершение записи: дожидается записи всех кадров из очереди,
+        записывает индекс и закрывает файл."""
+
+        if self.queue is None:
+            return
+
+        self.queue.put(None)
+        self.writer.join()
+        self.queue = None
+
+        try:
+            if self.error is None:
+                indexOffset = self.file.tell()
+
+                self.file.write(INDEX_COUNT.pack(len(self.index)))
+                for entry in self.index:
+                    self.file.write(INDEX_ENTRY.pack(*entry))
+
+                self.file.write(INDEX_TRAILER.pack(indexOffset, INDEX_MAGIC))
+        finally:
+            self.file.close()
+
+
+class ShowFormatError(ValueError):
+    def __init__(self, filename, msg):
+        super().__init__('Error in show file "%s": %s' % (filename, msg))
+
+
+def is_show_file(filename):
+    """Возвращает True, если файл filename - файл записи шоу."""
+
+    with open(filename, 'rb') as f:
+        return f.read(len(SHOW_MAGIC)) == SHOW_MAGIC
+
+
+class ShowPlayer():
+    """Воспроизведение записанного шоу.
+
+    Файл записи отображается в память (mmap), так что расход памяти
+    не зависит от длины записи: в памяти находятся только индекс
+    ключевых кадров и текущие значения каналов.
+
+    Перемотка - поиск в индексе (bisect) ближайшего предшествующего
+    ключевого кадра и применение изменений от него до нужного момента,
+    т.е. не более чем за KEYFRAME_INTERVAL секунд записи.
+
+    Атрибуты экземпляра класса:
+        filename    - имя файла записи;
+        recordTime  - время начала записи (секунды с начала эпохи);
+        duration    - длительность записи в секундах;
+        universes   - словарь, где ключи - номера universe,
+                      а значения - экземпляры ChannelBuffer
+                      с текущими значениями каналов;
+        position    - время текущего кадра от начала записи в секундах;
+        speed       - вещественное, скорость воспроизведения (1.0 -
+                      с исходной скоростью);
+        loop        - булевское значение, True для повторения записи
+                      с начала по её окончании;
+        playing     - булевское значение, False при паузе или
+                      по окончании записи."""
+
+    def __init__(self, filename, speed=1.0, loop=False):
+        self.filename = filename
+
+        with open(filename, 'rb') as f:
+            try:
+                self.map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+            except ValueError as ex:
+                # файл нулевой длины
+                raise ShowFormatError(filename, 'file is empty') from ex
+
+        self.buf = memoryview(self.map)
+
+        try:
+            magic, version, self.recordTime = SHOW_HEADER.unpack_from(self.buf, 0)
+        except struct_error as ex:
+            self.close()
+            raise ShowFormatError(filename, 'file is too short') from ex
+
+        if magic != SHOW_MAGIC:
+            self.close()
+            raise ShowFormatError(filename, 'file is not a show file')
+
+        if version != SHOW_FORMAT_VERSION:
+            self.close()
+            raise ShowFormatError(filename, 'unsupported format version %d' % version)
+
+        self.dataStart = SHOW_HEADER.size
+        self.dataEnd = self.__load_index()
+
+        self.indexTimes = [e[0] for e in self.index]
+        self.duration = self.__get_duration()
+
+        self.universes = dict()
+        self.speed = speed
+        self.loop = loop
+        self.playing = False
+
+        # время начала воспроизведения с позиции basePosition
+        # (по time.monotonic())
+        self.baseTime = 0.0
+        self.basePosition = 0.0
+
+        # смещение в файле следующей записи кадра
+        self.offset = self.dataStart
+        self.position = 0.0
+
+        self.seek(0.0)
+
+    def close(self):
+        self.buf.release()
+        self.map.close()
+
+    def __load_index(self):
+        """Загрузка индекса ключевых кадров из файла в self.index.
+        Если индекса нет (запись не завершена) - индекс строится
+        просмотром записей.
+        Возвращает смещение в файле конца последней записи кадра."""
+
+        size = len(self.buf)
+
+        if size >= self.dataStart + INDEX_COUNT.size + INDEX_TRAILER.size:
+            indexOffset, magic = INDEX_TRAILER.unpack_from(self.buf, size - INDEX_TRAILER.size)
+
+            if magic == INDEX_MAGIC and self.dataStart <= indexOffset <= size - INDEX_TRAILER.size - INDEX_COUNT.size:
+                count = INDEX_COUNT.unpack_from(self.buf, indexOffset)[0]
+                if indexOffset + INDEX_COUNT.size + count * INDEX_ENTRY.size + INDEX_TRAILER.size == size:
+                    self.index = list(INDEX_ENTRY.iter_unpack(self.buf[indexOffset + INDEX_COUNT.size:size - INDEX_TRAILER.size]))
+                    return indexOffset
+
+        # индекса нет - последняя запись может быть неполной
+        self.index = []
+
+        offset = self.dataStart
+        keyTime = None
+
+        while True:
+            frame = self.__get_frame(offset, size)
+            if frame is None:
+                return offset
+
+            rtype, t, universe, nextOffset = frame
+
+            if rtype == REC_KEYFRAME:
+                if keyTime != t:
+                    self.index.append((t, offset))
+                    keyTime = t
+            else:
+                keyTime = None
+
+            offset = nextOffset
+
+    def __get_frame(self, offset, end):
+        """Разбор заголовка записи кадра по смещению offset.
+        Возвращает кортеж из четырёх элементов - тип записи, время,
+        номер universe и смещение следующей записи, или None, если
+        записей больше нет (или запись неполная)."""
+
+        if offset + FRAME_HEADER.size + FRAME_COUNT.size > end:
+            return None
+
+        rtype, t, universe = FRAME_HEADER.unpack_from(self.buf, offset)
+        dstart = offset + FRAME_HEADER.size
+        count = FRAME_COUNT.unpack_from(self.buf, dstart)[0]
+        dstart += FRAME_COUNT.size
+
+        if rtype == REC_KEYFRAME:
+            nextOffset = dstart + count
+        elif rtype == REC_DELTA:
+            nextOffset = dstart
+            for i in range(count):
+                if nextOffset + DELTA_RANGE.size > end:
+                    return None
+
+                nextOffset += DELTA_RANGE.size + DELTA_RANGE.unpack_from(self.buf, nextOffset)[1]
+        else:
+            return None
+
+        if nextOffset > end:
+            return None
+
+        return rtype, t, universe, nextOffset
+
+    def __get_duration(self):
+        # время последней записи; записи идут по возрастанию времени,
+        # так что достаточно просмотреть записи после последнего
+        # ключевого кадра
+        offset = self.index[-1][1] if self.index else self.dataStart
+        duration = 0.0
+
+        while offset < self.dataEnd:
+            rtype, duration, universe, offset = self.__get_frame(offset, self.dataEnd)
+
+        return duration
+
+    def __apply_frame(self, offset):
+        """Применение записи кадра по смещению offset к значениям
+        каналов в self.universes.
+        Возвращает смещение следующей записи."""
+
+        rtype, t, universe = FRAME_HEADER.unpack_from(self.buf, offset)
+        offset += FRAME_HEADER.size
+        count = FRAME_COUNT.unpack_from(self.buf, offset)[0]
+        offset += FRAME_COUNT.size
+
+        if rtype == REC_KEYFRAME:
+            buf = self.universes.get(universe)
+            if buf is None or len(buf) != count:
+                buf = ChannelBuffer(count)
+                self.universes[universe] = buf
+
+            buf.assign(self.buf[offset:offset + count])
+            return offset + count
+
+        buf = self.universes[universe]
+
+        for i in range(count):
+            first, length = DELTA_RANGE.unpack_from(self.buf, offset)
+            offset += DELTA_RANGE.size
+            buf.set_values(first + 1, self.buf[offset:offset + length])
+            offset += length
+
+        return offset
+
+    def __advance(self, t):
+        """Применение записей кадров со временем не больше t."""
+
+        while self.offset < self.dataEnd:
+            if FRAME_HEADER.unpack_from(self.buf, self.offset)[1] > t:
+                break
+
+            self.offset = self.__apply_frame(self.offset)
+
+        self.position = t
+
+    def seek(self, t, now=None):
+        """Перемотка на момент t (секунды от начала записи).
+        now - текущее время по time.monotonic() (для отсчёта времени
+        воспроизведения) или None для текущего времени."""
+
+        t = min(max(t, 0.0), self.duration)
+
+        ixkey = bisect_right(self.indexTimes, t) - 1
+
+        # без перехода к ключевому кадру можно обойтись только при
+        # перемотке вперёд в пределах интервала между ключевыми кадрами
+        if t < self.position or ixkey < 0 or self.index[ixkey][1] > self.offset:
+            self.offset = self.index[ixkey][1] if ixkey >= 0 else self.dataStart
+
+            for buf in self.universes.values():
+                buf.clear()
+
+        self.__advance(t)
+
+        self.baseTime = monotonic() if now is None else now
+        self.basePosition = t
+
+    def play(self, now=None):
+        """Начало (продолжение) воспроизведения с текущей позиции."""
+
+        if not self.playing:
+            if self.position >= self.duration:
+                self.seek(0.0, now)
+
+            self.baseTime = monotonic() if now is None else now
+            self.basePosition = self.position
+            self.playing = True
+
+    def pause(self, now=None):
+        if self.playing:
+            self.render(monotonic() if now is None else now)
+            self.playing = False
+
+    def set_speed(self, speed, now=None):
+        """Изменение скорости воспроизведения без скачка позиции."""
+
+        if speed <= 0.0:
+            raise ValueError('playback speed must be positive')
+
+        if self.playing:
+            self.render(monotonic() if now is None else now)
+            self.baseTime = monotonic() if now is None else now
+            self.basePosition = self.position
+
+        self.speed = speed
+
+    def render(self, now):
+        """Расчёт значений каналов для момента now (по time.monotonic()).
+        Изменившиеся значения будут отмечены в атрибутах dirty*
+        буферов self.universes."""
+
+        if not self.playing:
+            return
+
+        t = self.basePosition + (now - self.baseTime) * self.speed
+
+        if t >= self.duration:
+            if self.loop and self.duration > 0.0:
+                # отсчёт времени - от начала очередного повтора
+                self.seek(t % self.duration, now)
+                return
+
+            t = self.duration
+            self.playing = False
+
+        self.__advance(t)
+
+
+def new_show_file_name(consoleFile):
+    """Возвращает имя нового файла записи для файла консоли consoleFile -
+    в том же каталоге, с датой и временем начала записи в имени."""
+
+    from datetime import datetime
+
+    return '%s-%s%s' % (os.path.splitext(consoleFile)[0],
+        datetime.now().strftime('%Y%m%d-%H%M%S'), SHOW_FILE_EXT)
+
+
+if __name__ == '__main__':
+    print('[debugging %s]' % __file__)
+
+    rec = ShowRecorder('/tmp/test.dmxshow')
+    for i in range(100):
+        rec.record(1, bytes([i]) * 8 + bytes(504), rec.startTime + i * 0.1)
+    rec.close()
+
+    print(os.path.getsize('/tmp/test.dmxshow'), rec.error)
@@ -0,0 +1,584 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+""" This file is part of DMXCtrl.
+
+    DMXCtrl is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    DMXCtrl is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with DMXCtrl.  If not, see <http://www.gnu.org/licenses/>."""
+
+
+""" Воспроизведение консоли без UI (для инсталляций и т.п.).
+    Модуль не должен импортировать GTK."""
+
+
+import sys
+import os
+import socket
+import selectors
+import signal
+from time import monotonic, perf_counter
+from math import isfinite
+
+from dmxctrldata import *
+from dmxctrlengine import *
+from dmxctrlbin import load_console_file
+from dmxctrlrec import ShowRecorder, ShowPlayer, is_show_file
+
+
+class ControlConnection():
+    """Соединение с управляющей программой.
+
+    Команды передаются текстовыми строками, на каждую команду
+    отсылается строка "ok" или "error: <описание ошибки>".
+
+    Команды:
+        set <канал> <значение> [<значение>...]
+                            - установка значений каналов, начиная
+                              с указанного (источник "remote");
+        gm <значение>       - уровень grand master (0..255);
+        blackout on|off     - плавное затемнение или восстановление
+                              общего уровня;
+        go|back|pause <имя> - управление cuelist с указанным именем;
+        effect <имя> on|off - включение или выключение эффекта;
+        timeline <имя> on|off - запуск (с начала) или остановка timeline;
+        chase <имя> on|off  - запуск или остановка чейза;
+        tap <имя>           - нажатие "tap tempo" чейза;
+        bpm <имя> <темп>    - установка темпа чейза;
+        group <имя> <значение> - значение движков grouplevel группы
+                              с указанным именем (0..255);
+        save <имя>          - сохранение текущих значений каналов
+                              в библиотеку сцен (см. dmxctrlscenes);
+        recall <имя>        - вызов сцены из библиотеки (источник "scene");
+        release             - отключение вызванной сцены;
+        quit                - завершение работы программы.
+
+    Команды при воспроизведении записи шоу:
+        play                - воспроизведение с текущей позиции;
+        pause               - пауза;
+        seek <секунды>      - перемотка;
+        speed <множитель>   - скорость воспроизведения;
+        quit                - завершение работы программы."""
+
+    MAX_LINE_LENGTH = 4096
+
+    def __init__(self, runner, sock):
+        self.runner = runner
+        self.sock = sock
+        self.inbuf = b''
+
+    def readable(self):
+        # ошибки соединения с одной управляющей программой (напр., сброс
+        # соединения клиентом) не должны прерывать вывод кадров
+        try:
+            data = self.sock.recv(self.MAX_LINE_LENGTH)
+        except OSError:
+            data = b''
+
+        if not data:
+            self.runner.close_connection(self)
+            return
+
+        self.inbuf += data
+
+        while True:
+            line, sep, rest = self.inbuf.partition(b'\n')
+            if not sep:
+                if len(self.inbuf) > self.MAX_LINE_LENGTH:
+                    self.inbuf = b''
+                    self.reply('error: line is too long')
+
+                break
+
+            self.inbuf = rest
+
+            try:
+                self.runner.execute(line.decode('utf-8', 'replace').split())
+            except ValueError as ex:
+                self.reply('error: %s' % ex)
+            else:
+                self.reply('ok')
+
+    def reply(self, s):
+        try:
+            self.sock.sendall(('%s\n' % s).encode('utf-8'))
+        except OSError:
+            self.runner.close_connection(self)
+
+
+def load_timed_commands(filename):
+    """Загрузка команд для ShowRunner.render_offline() из текстового
+    файла filename.
+
+    Каждая строка файла - время в секундах от начала расчёта и команда
+    (см. ControlConnection), например "12.5 go main"; пустые строки
+    и строки, начинающиеся с "#", пропускаются.
+
+    Возвращает список кортежей (время, команда), где команда - список
+    строк. В случае ошибок генерирует ValueError."""
+
+    commands = []
+
+    with open(filename, 'r', encoding='utf-8') as f:
+        for lineno, line in enumerate(f, 1):
+            words = line.split()
+            if not words or words[0].startswith('#'):
+                continue
+
+            try:
+                t = float(words[0])
+            except ValueError:
+                raise ValueError('%s:%d: invalid time "%s"' % (filename, lineno, words[0]))
+
+            if t < 0 or len(words) < 2:
+                raise ValueError('%s:%d: time and command expected' % (filename, lineno))
+
+            commands.append((t, words[1:]))
+
+    return commands
+
+
+class ShowRunner():
+    """Вывод значений каналов консоли или записанного шоу
+    (см. dmxctrlrec) в DMX без UI.
+
+    Все события (расчёт кадров по часам time.monotonic(), ответы olad,
+    команды управляющих программ) обрабатываются в одном цикле
+    на основе модуля selectors, без потоков.
+
+    Атрибуты экземпляра класса:
+        console     - экземпляр DMXControls или None при воспроизведении
+                      записи шоу;
+        engine      - экземпляр DMXEngine или None;
+        player      - экземпляр ShowPlayer или None;
+        universes   - словарь, где ключи - номера universe,
+                      а значения - экземпляры ChannelBuffer
+                      с выводимыми значениями каналов;
+        framePeriod - вещественное, период вывода кадров в секундах;
+        client      - экземпляр ola.OlaClient.OlaClient или None,
+                      если вывод в DMX не требуется;
+        selector    - экземпляр selectors.DefaultSelector;
+        server      - управляющий сокет или None;
+        recorder    - экземпляр ShowRecorder или None;
+        scenes      - экземпляр SceneLibrary или None, создаётся
+                      при первом обращении к библиотеке сцен;
+        running     - булевское значение, False для завершения цикла."""
+
+    def __init__(self, consoleFile, control=None, fps=FRAME_RATE, output=True, record=None,
+                 speed=1.0, loop=False, start=0.0):
+        """Параметры:
+            consoleFile - строка, имя файла консоли или файла записи шоу;
+            control     - строка, адрес управляющего сокета или None:
+                          номер порта TCP (на 127.0.0.1), "адрес:порт"
+                          или путь к сокету AF_UNIX;
+            fps         - количество кадров в секунду;
+            output      - булевское значение; если False - кадры
+                          рассчитываются, но в DMX не выводятся;
+            record      - строка, имя файла для записи выводимых кадров
+                          (см. dmxctrlrec) или None;
+            speed,
+            loop,
+            start       - скорость воспроизведения, повторение и начальная
+                          позиция в секундах для файла записи шоу."""
+
+        self.consoleFile = consoleFile
+        self.console = None
+        self.engine = None
+        self.player = None
+        self.scenes = None
+        self.cueStacks = dict()
+        self.effects = dict()
+        self.timelines = dict()
+        self.groupLevels = dict()
+
+        if is_show_file(consoleFile):
+            self.player = ShowPlayer(consoleFile, speed, loop)
+            self.player.seek(start)
+            self.universes = self.player.universes
+        else:
+            self.console = load_console_file(consoleFile)
+
+            self.engine = DMXEngine()
+            self.engine.setup(self.console)
+            self.engine.set_default_values(self.console)
+            self.universes = self.engine.patch.universes
+
+            # контролы, к которым можно обращаться по имени
+            self.cueStacks = {c.name: stk for c, stk in self.engine.cueStacks.items() if c.name}
+            self.effects = {c.name: fx for c, fx in self.engine.effects.items() if c.name}
+            self.timelines = {c.name: seq for c, seq in self.engine.timelines.items() if c.name}
+
+            # движки групп - по именам групп
+            for ctrl in self.console.walk():
+                if isinstance(ctrl, GroupLevel):
+                    self.groupLevels.setdefault(ctrl.group, []).append(ctrl)
+
+        self.framePeriod = 1.0 / fps
+        self.running = False
+
+        self.selector = selectors.DefaultSelector()
+        self.connections = set()
+
+        self.client = None
+        if output:
+            # модуль OLA импортируется только при необходимости
+            from ola.OlaClient import OlaClient
+
+            self.client = OlaClient()
+            self.selector.register(self.client.GetSocket(), selectors.EVENT_READ, self.client.SocketReady)
+
+            if self.engine is not None and self.engine.inputUniverse is not None:
+                self.client.RegisterUniverse(self.engine.inputUniverse,
+                    self.client.REGISTER, self.engine.set_input_values)
+
+        self.server = None
+        self.serverPath = None
+        if control:
+            self.__open_server(control)
+
+        self.recorder = ShowRecorder(record) if record else None
+
+    def __open_server(self, control):
+        if os.sep in control:
+            self.serverPath = control
+            if os.path.exists(control):
+                os.unlink(control)
+
+            self.server = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            self.server.bind(control)
+        else:
+            host, sep, port = control.rpartition(':')
+
+            try:
+                port = int(port)
+            except ValueError as ex:
+                raise ValueError('invalid control socket address - "%s"' % control) from ex
+
+            self.server = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+            self.server.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+            self.server.bind((host if sep else '127.0.0.1', port))
+
+        self.server.listen()
+        self.server.setblocking(False)
+        self.selector.register(self.server, selectors.EVENT_READ, self.__accept)
+
+    def __accept(self):
+        sock, _ = self.server.accept()
+        sock.setblocking(False)
+
+        conn = ControlConnection(self, sock)
+        self.connections.add(conn)
+        self.selector.register(sock, selectors.EVENT_READ, conn.readable)
+
+    def close_connection(self, conn):
+        if conn in self.connections:
+            self.connections.discard(conn)
+            self.selector.unregister(conn.sock)
+            conn.sock.close()
+
+    def execute(self, cmd, now=None):
+        """Выполнение команды управляющей программы (списка строк,
+        см. ControlConnection). В случае ошибок генерирует ValueError.
+        now - время выполнения команды (по time.monotonic())
+              или None для текущего времени."""
+
+        if not cmd:
+            return
+
+        def __int(s, minv, maxv):
+            try:
+                v = int(s)
+            except ValueError:
+                raise ValueError('invalid number "%s"' % s)
+
+            if v < minv or v > maxv:
+                raise ValueError('%d is out of range %d..%d' % (v, minv, maxv))
+
+            return v
+
+        def __onoff(args):
+            if len(args) != 1 or args[0] not in ('on', 'off'):
+                raise ValueError('"on" or "off" expected')
+
+            return args[0] == 'on'
+
+        def __named(d, args):
+            name = ' '.join(args)
+            if name not in d:
+                raise ValueError('"%s" is not found' % name)
+
+            return d[name]
+
+        if now is None:
+            now = monotonic()
+
+        verb, args = cmd[0].lower(), cmd[1:]
+
+        if verb == 'quit':
+            self.running = False
+        elif self.player is not None:
+            self.__execute_player(verb, args, now)
+        elif verb == 'set':
+            if len(args) < 2:
+                raise ValueError('channel and value(s) expected')
+
+            self.engine.set_remote_values(__int(args[0], 1, len(self.engine.output)),
+                                          bytes(__int(v, 0, 255) for v in args[1:]))
+        elif verb == 'gm':
+            if len(args) != 1:
+                raise ValueError('level expected')
+
+            self.engine.outputStage.set_grand_master(__int(args[0], 0, 255))
+        elif verb == 'blackout':
+            self.engine.outputStage.blackout(now, __onoff(args))
+        elif verb in ('go', 'back', 'pause'):
+            getattr(__named(self.cueStacks, args), verb)(now)
+        elif verb == 'effect':
+            __named(self.effects, args[:-1]).active = __onoff(args[-1:])
+        elif verb in ('chase', 'tap', 'bpm'):
+            stk = __named(self.cueStacks, args if verb == 'tap' else args[:-1])
+            if not isinstance(stk, ChaseStack):
+                raise ValueError('"%s" is not a chase' % stk.cuelist.name)
+
+            if verb == 'chase':
+                if __onoff(args[-1:]):
+                    stk.start(now)
+                else:
+                    stk.stop()
+            elif verb == 'tap':
+                stk.tap(now)
+            else:
+                try:
+                    bpm = float(args[-1])
+                except ValueError:
+                    raise ValueError('invalid number "%s"' % args[-1])
+
+                if not isfinite(bpm):
+                    raise ValueError('invalid number "%s"' % args[-1])
+
+                stk.set_bpm(bpm)
+        elif verb == 'group':
+            if len(args) < 2:
+                raise ValueError('group name and level expected')
+
+            level = __int(args[-1], 0, 255)
+            for ctrl in __named(self.groupLevels, args[:-1]):
+                self.engine.set_submaster(ctrl, level)
+        elif verb in ('save', 'recall'):
+            if not args:
+                raise ValueError('scene name expected')
+
+            name = ' '.join(args)
+
+            # библиотека сцен нужна не всем консолям - модули
+            # загружаются только при первой команде
+            import sqlite3
+            from dmxctrlscenes import SceneLibrary
+
+            try:
+                if self.scenes is None:
+                    self.scenes = SceneLibrary(self.consoleFile)
+
+                if verb == 'save':
+                    self.scenes.save(name, self.engine.frame)
+                else:
+                    sceneId = self.scenes.get_id(name)
+                    if sceneId is None:
+                        raise ValueError('scene "%s" is not found' % name)
+
+                    self.engine.recall_scene(*self.scenes.load(sceneId))
+            except (sqlite3.Error, OSError) as ex:
+                raise ValueError('scene library error - %s' % ex)
+        elif verb == 'release':
+            self.engine.release_scene()
+        elif verb == 'timeline':
+            seq = __named(self.timelines, args[:-1])
+
+            if __onoff(args[-1:]):
+                seq.start(now)
+            else:
+                seq.stop()
+        else:
+            raise ValueError('unknown command "%s"' % verb)
+
+    def __execute_player(self, verb, args, now):
+        def __float(args):
+            if len(args) != 1:
+                raise ValueError('number expected')
+
+            try:
+                return float(args[0])
+            except ValueError:
+                raise ValueError('invalid number "%s"' % args[0])
+
+        if verb == 'play':
+            self.player.play(now)
+        elif verb == 'pause':
+            self.player.pause(now)
+        elif verb == 'seek':
+            self.player.seek(__float(args), now)
+        elif verb == 'speed':
+            self.player.set_speed(__float(args), now)
+        else:
+            raise ValueError('unknown command "%s"' % verb)
+
+    def send_channels(self, force=False):
+        """Отсылка изменившихся (или, если force == True, всех)
+        значений каналов в olad."""
+
+        for universe, buf in self.universes.items():
+            if buf.pop_dirty() or force:
+                if self.client is not None:
+                    self.client.SendDmx(universe, buf.data)
+
+                if self.recorder is not None:
+                    self.recorder.record(universe, buf.data)
+
+    def stop(self, *args):
+        self.running = False
+
+    def run(self):
+        """Цикл вывода кадров; завершается командой quit или сигналами
+        SIGINT/SIGTERM."""
+
+        signal.signal(signal.SIGTERM, self.stop)
+        signal.signal(signal.SIGINT, self.stop)
+
+        self.running = True
+        nextFrame = monotonic()
+        nextRefresh = nextFrame
+
+        render = self.engine.render if self.engine is not None else self.player.render
+
+        if self.player is not None:
+            self.player.play(nextFrame)
+
+        try:
+            while self.running:
+                now = monotonic()
+
+                if now >= nextFrame:
+                    render(now)
+
+                    # изменившиеся значения отсылаются на каждом кадре,
+                    # все universe - раз в FULL_REFRESH_INTERVAL секунд
+                    force = now >= nextRefresh
+                    if force:
+                        nextRefresh = now + FULL_REFRESH_INTERVAL
+
+                    self.send_channels(force)
+
+                    # кадры отсчитываются от времени начала, а не от времени
+                    # окончания предыдущего кадра - без накопления ошибки;
+                    # при отставании пропущенные кадры не догоняются
+                    nextFrame += self.framePeriod
+                    if nextFrame < now:
+                        nextFrame = now + self.framePeriod
+
+                for key, _ in self.selector.select(max(0.0, nextFrame - monotonic())):
+                    key.data()
+        finally:
+            self.close()
+
+    def render_offline(self, duration, commands=(), outFile=None):
+        """Расчёт кадров консоли за duration секунд с максимально
+        возможной скоростью - время не отсчитывается по часам,
+        а увеличивается на период кадра.
+
+        commands    - последовательность кортежей (время, команда),
+                      где время - секунды от начала расчёта, а команда -
+                      список строк (см. ControlConnection и
+                      load_timed_commands()); команды выполняются
+                      перед расчётом первого кадра со временем
+                      не меньше указанного;
+        outFile     - None или имя файла, в который записываются
+                      кадры (в формате записи шоу, см. dmxctrlrec).
+
+        Возвращает кортеж из двух элементов - количество рассчитанных
+        кадров и затраченное время в секундах."""
+
+        if self.engine is None:
+            raise ValueError('offline rendering requires console file')
+
+        commands = sorted(commands, key=lambda c: c[0])
+        ixcmd = 0
+
+        recorder = ShowRecorder(outFile, 0.0, 0.0) if outFile else None
+
+        nframes = int(round(duration / self.framePeriod)) + 1
+
+        t0 = perf_counter()
+
+        try:
+            for frame in range(nframes):
+                now = frame * self.framePeriod
+
+                while ixcmd < len(commands) and commands[ixcmd][0] <= now:
+                    self.execute(commands[ixcmd][1], now)
+                    ixcmd += 1
+
+                self.engine.render(now)
+
+                for universe, buf in self.universes.items():
+                    if buf.pop_dirty() and recorder is not None:
+                        recorder.record(universe, buf.data, now)
+        finally:
+            elapsed = perf_counter() - t0
+
+            if recorder is not None:
+                recorder.close()
+                if recorder.error is not None:
+                    raise recorder.error
+
+        return nframes, elapsed
+
+    def close(self):
+        print('Black out DMX channels...', file=sys.stderr)
+        if self.engine is not None:
+            self.engine.patch.clear()
+        else:
+            for buf in self.universes.values():
+                buf.clear()
+
+        self.send_channels(True)
+
+        if self.recorder is not None:
+            self.recorder.close()
+            if self.recorder.error is not None:
+                print('Show recording error - %s' % self.recorder.error, file=sys.stderr)
+
+            self.recorder = None
+
+        for conn in list(self.connections):
+            self.close_connection(conn)
+
+        if self.scenes is not None:
+            self.scenes.close()
+            self.scenes = None
+
+        if self.server is not None:
+            self.server.close()
+            self.server = None
+
+            if self.serverPath and os.path.exists(self.serverPath):
+                os.unlink(self.serverPath)
+
+        if self.client is not None:
+            self.client.GetSocket().close()
+            self.client = None
+
+        if self.engine is not None:
+            print('Frame time: %s' % self.engine.stats, file=sys.stderr)
+
+        if self.player is not None:
+            self.player.close()
+            self.player = None
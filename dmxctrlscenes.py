@@ -0,0 +1,180 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+""" This file is part of DMXCtrl.
+
+    DMXCtrl is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    DMXCtrl is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with DMXCtrl.  If not, see <http://www.gnu.org/licenses/>."""
+
+
+""" Библиотека сцен - снимков значений каналов консоли.
+
+    Сцены хранятся в базе SQLite (по умолчанию - общей для всех консолей,
+    ~/.config/dmxctrl/scenes.sqlite), ключ - полный путь к файлу консоли
+    и имя сцены.
+
+    Для поиска и отображения списка из базы выбираются только
+    идентификаторы и имена сцен (не более заданного количества),
+    значения каналов загружаются при вызове сцены и кэшируются.
+    Модуль не должен импортировать GTK."""
+
+
+import os
+import sqlite3
+from time import time
+
+
+SCENES_FILE = os.path.join(os.path.expanduser('~'), '.config', 'dmxctrl', 'scenes.sqlite')
+
+# наибольшее количество сцен, выбираемых одним поиском
+FIND_LIMIT = 500
+
+
+class SceneLibrary():
+    """Сцены одной консоли.
+
+    Атрибуты экземпляра класса:
+        console     - строка, полный путь к файлу консоли;
+        filename    - строка, имя файла базы;
+        db          - экземпляр sqlite3.Connection;
+        cache       - словарь, где ключи - идентификаторы сцен,
+                      а значения - кортежи (data, mask) (см. load())."""
+
+    def __init__(self, consoleFile, filename=None):
+        """Параметры:
+            consoleFile - строка, имя файла консоли;
+            filename    - строка, имя файла базы или None
+                          для SCENES_FILE."""
+
+        self.console = os.path.abspath(consoleFile)
+        self.filename = filename if filename else SCENES_FILE
+        self.cache = dict()
+
+        dname = os.path.dirname(self.filename)
+        if dname and not os.path.exists(dname):
+            os.makedirs(dname)
+
+        self.db = sqlite3.connect(self.filename)
+
+        # уникальный ключ (console, name) - он же индекс для выбора
+        # сцен консоли в порядке имён
+        self.db.execute('''create table if not exists scenes (
+            id integer primary key,
+            console text not null,
+            name text not null,
+            data blob not null,
+            mask blob,
+            created real not null,
+            unique (console, name))''')
+        self.db.commit()
+
+    def close(self):
+        self.db.close()
+        self.cache.clear()
+
+    def count(self):
+        """Возвращает количество сцен консоли."""
+
+        return self.db.execute('select count(*) from scenes where console = ?',
+            (self.console,)).fetchone()[0]
+
+    def find(self, text='', limit=FIND_LIMIT):
+        """Поиск сцен, в именах которых есть подстрока text (без учёта
+        регистра для латиницы). Пустая строка соответствует всем сценам.
+        Возвращает список кортежей (идентификатор, имя), отсортированный
+        по именам, не более limit элементов."""
+
+        if text:
+            pattern = '%%%s%%' % text.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_')
+
+            cur = self.db.execute('''select id, name from scenes
+                where console = ? and name like ? escape '\\'
+                order by name limit ?''', (self.console, pattern, limit))
+        else:
+            cur = self.db.execute('''select id, name from scenes
+                where console = ? order by name limit ?''', (self.console, limit))
+
+        return cur.fetchall()
+
+    def get_id(self, name):
+        """Возвращает идентификатор сцены с именем name или None."""
+
+        r = self.db.execute('select id from scenes where console = ? and name = ?',
+            (self.console, name)).fetchone()
+
+        return r[0] if r else None
+
+    def save(self, name, data, mask=None):
+        """Сохранение сцены.
+
+        name    - строка, имя сцены; сцена с тем же именем заменяется;
+        data    - значения каналов (bytes, bytearray и т.п.);
+        mask    - маска каналов, устанавливаемых при вызове сцены
+                  (значения 0 и 1), или None - все каналы.
+
+        Возвращает идентификатор сцены."""
+
+        name = name.strip()
+        if not name:
+            raise ValueError('scene name must not be empty')
+
+        if mask is not None and len(mask) != len(data):
+            raise ValueError('scene mask size does not match data size')
+
+        sceneId = self.get_id(name)
+
+        with self.db:
+            if sceneId is None:
+                sceneId = self.db.execute('''insert into scenes (console, name, data, mask, created)
+                    values (?, ?, ?, ?, ?)''', (self.console, name, bytes(data),
+                    None if mask is None else bytes(mask), time())).lastrowid
+            else:
+                self.db.execute('update scenes set data = ?, mask = ?, created = ? where id = ?',
+                    (bytes(data), None if mask is None else bytes(mask), time(), sceneId))
+
+        self.cache.pop(sceneId, None)
+
+        return sceneId
+
+    def delete(self, sceneId):
+        with self.db:
+            self.db.execute('delete from scenes where id = ?', (sceneId,))
+
+        self.cache.pop(sceneId, None)
+
+    def load(self, sceneId):
+        """Возвращает кортеж из двух элементов - значения каналов (bytes)
+        и маску (bytes или None) сцены с идентификатором sceneId.
+        Если сцена не найдена - генерирует KeyError."""
+
+        scene = self.cache.get(sceneId)
+
+        if scene is None:
+            r = self.db.execute('select data, mask from scenes where id = ? and console = ?',
+                (sceneId, self.console)).fetchone()
+            if r is None:
+                raise KeyError('scene #%d is not found' % sceneId)
+
+            scene = (bytes(r[0]), None if r[1] is None else bytes(r[1]))
+            self.cache[sceneId] = scene
+
+        return scene
+
+
+if __name__ == '__main__':
+    print('[debugging %s]' % __file__)
+
+    lib = SceneLibrary('example.dmxctrl', '/tmp/scenes.sqlite')
+    sid = lib.save('test', bytes(range(256)) * 2)
+    print(lib.find(), lib.load(sid)[0][:16])
+    lib.close()
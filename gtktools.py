@@ -32,11 +32,13 @@ from gi.repository.GdkPixbuf import Pixbuf
 
 # для *ResourceLoader
 import zipfile
+import mmap
+from struct import Struct
 from sys import stderr, argv
 import os.path
 
 
-REVISION = 2021042400
+REVISION = 2026101900
 
 
 def get_widget_base_units():
@@ -367,6 +369,11 @@ class FileResourceLoader():
         self.appFilePath = appFilePath
         self.appDir = os.path.split(appFilePath)[0]
 
+        # кэш загруженных изображений:
+        # ключи - кортежи (filename, width, height),
+        # значения - экземпляры Gdk.Pixbuf
+        self.pixbufs = dict()
+
     def load(self, filename):
         """Загружает файл filename в память и возвращает в виде
         bytestring.
@@ -433,11 +440,22 @@ class FileResourceLoader():
                           <=0 или None.
         fallback        - имя стандартной иконки, которая будет загружена,
                           если не удалось загрузить файл filename;
-                          если fallback=None - генерируется исключение."""
+                          если fallback=None - генерируется исключение.
+
+        Загруженные изображения кэшируются, повторная загрузка того же
+        файла с теми же размерами возвращает тот же экземпляр Pixbuf."""
+
+        pbkey = (filename, width, height)
+
+        pbuf = self.pixbufs.get(pbkey)
+        if pbuf is not None:
+            return pbuf
 
         try:
-            return self.pixbuf_from_bytes(self.load_bytes(filename),
+            pbuf = self.pixbuf_from_bytes(self.load_bytes(filename),
                 width, height)
+            self.pixbufs[pbkey] = pbuf
+            return pbuf
         except Exception as ex:
             print('Can not load image "%s" - %s' % (filename, str(ex)), file=stderr)
             if fallback is None:
@@ -451,19 +469,82 @@ class FileResourceLoader():
 
                 return Gtk.IconTheme.get_default().load_icon(fallback, height, Gtk.IconLookupFlags.FORCE_SIZE)
 
-    def load_gtk_builder(self, filename):
+    def load_gtk_builder(self, filename, objects=None):
         """Загружает в память и возвращает экземпляр класса Gtk.Builder.
-        filename - имя файла .ui.
+        filename - имя файла .ui;
+        objects  - None или список имён объектов, которые следует
+                   создать (для ускорения загрузки; объекты, на которые
+                   ссылаются указанные, создаются автоматически);
+                   если None - создаются все объекты.
         При отсутствии файла и прочих ошибках генерируются исключения."""
 
-        uistr = self.load(filename)
-        return Gtk.Builder.new_from_string(str(uistr, 'utf-8'), -1)
+        uistr = str(self.load(filename), 'utf-8')
+
+        if objects is None:
+            return Gtk.Builder.new_from_string(uistr, -1)
+
+        uibldr = Gtk.Builder()
+        uibldr.add_objects_from_string(uistr, objects)
+        return uibldr
 
 
 class ZipFileResourceLoader(FileResourceLoader):
     """Загрузчик файлов ресурсов из архива ZIP.
     Архив - сам файл приложения в случае, когда он
-    представляет собой python zip application."""
+    представляет собой python zip application.
+
+    Архив открывается (и его оглавление читается) один раз, при создании
+    экземпляра класса. Несжатые файлы (ZIP_STORED) читаются напрямую
+    из отображённого в память (mmap) файла архива, распакованные
+    сжатые файлы кэшируются."""
+
+    # локальный заголовок файла в архиве: длины имени файла
+    # и дополнительного поля (по смещению 26 от начала заголовка)
+    __LOCAL_HEADER_LENGTHS = Struct('<HH')
+    __LOCAL_HEADER_LENGTHS_OFFSET = 26
+
+    def __init__(self, appFilePath):
+        super().__init__(appFilePath)
+
+        if not zipfile.is_zipfile(self.appFilePath):
+            raise TypeError('Файл "%s" не является архивом ZIP' % self.appFilePath)
+
+        self.zfile = zipfile.ZipFile(self.appFilePath, allowZip64=True)
+
+        try:
+            self.zmap = mmap.mmap(self.zfile.fp.fileno(), 0, access=mmap.ACCESS_READ)
+        except (OSError, ValueError):
+            # mmap недоступен - все файлы читаются через ZipFile
+            self.zmap = None
+
+        # кэш распакованных файлов:
+        # ключи - пути к файлам внутри архива, значения - bytestring
+        self.cache = dict()
+
+    def close(self):
+        """Закрытие файла архива.
+        После вызова этого метода загружать файлы уже нельзя."""
+
+        if self.zmap is not None:
+            self.zmap.close()
+            self.zmap = None
+
+        self.zfile.close()
+        self.cache.clear()
+
+    def __load_stored(self, zinfo):
+        """Возвращает содержимое несжатого файла, описываемого экземпляром
+        zipfile.ZipInfo, прямо из отображённого в память архива."""
+
+        hstart = zinfo.header_offset
+        hlen = self.__LOCAL_HEADER_LENGTHS_OFFSET + self.__LOCAL_HEADER_LENGTHS.size
+
+        fnlen, extralen = self.__LOCAL_HEADER_LENGTHS.unpack(
+            self.zmap[hstart + self.__LOCAL_HEADER_LENGTHS_OFFSET:hstart + hlen])
+
+        dstart = hstart + zipfile.sizeFileHeader + fnlen + extralen
+
+        return self.zmap[dstart:dstart + zinfo.file_size]
 
     def load(self, filename):
         """Аналогично FileResourceLoader.load(), загружает файл
@@ -471,15 +552,26 @@ class ZipFileResourceLoader(FileResourceLoader):
 
         filename - путь к файлу внутри архива."""
 
-        if not zipfile.is_zipfile(self.appFilePath):
-            raise TypeError('Файл "%s" не является архивом ZIP' % self.appFilePath)
+        data = self.cache.get(filename)
+        if data is not None:
+            return data
+
+        try:
+            zinfo = self.zfile.getinfo(filename)
+
+            if self.zmap is not None and zinfo.compress_type == zipfile.ZIP_STORED and not zinfo.flag_bits & 0x01:
+                # несжатый и незашифрованный файл - без распаковки
+                # и без кэширования
+                return self.__load_stored(zinfo)
+
+            with self.zfile.open(zinfo, 'r') as f:
+                data = f.read()
+        except Exception as ex:
+            raise Exception('Не удалось загрузить файл "%s" - %s' % (filename, str(ex)))
+
+        self.cache[filename] = data
 
-        with zipfile.ZipFile(self.appFilePath, allowZip64=True) as zfile:
-            try:
-                with zfile.open(filename, 'r') as f:
-                    return f.read()
-            except Exception as ex:
-                raise Exception('Не удалось загрузить файл "%s" - %s' % (filename, str(ex)))
+        return data
 
 
 class TreeViewShell():